@@ -28,7 +28,7 @@ import redis
 from zato.common import BROKER, ZATO_NONE
 from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
 from zato.common.kvdb import LuaContainer
-from zato.common.util import new_cid, spawn_greenlet
+from zato.common.util import asbool, new_cid, spawn_greenlet
 
 logger = logging.getLogger(__name__)
 has_debug = logger.isEnabledFor(logging.DEBUG)
@@ -43,6 +43,14 @@ NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
     MESSAGE_TYPE.TO_PARALLEL_ANY,
 )]
 
+# Topic -> Redis list that messages to the topic are pushed to in work-queue mode
+WORK_QUEUE_KEYS = {topic: b'zato:broker:queue{}'.format(KEYS[msg_type]) for msg_type, topic in TOPICS.items()
+    if topic in NEEDS_TMP_KEY}
+WORK_QUEUE_TOPICS = {v:k for k,v in WORK_QUEUE_KEYS.items()}
+
+# How long, in seconds, to block in BRPOP before checking if the work-queue consumer should keep running
+WORK_QUEUE_BLOCK_TIMEOUT = 1
+
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
@@ -112,6 +120,52 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             self.keep_running = False
             self.client.close()
 
+    class _QueueThread(object):
+        """ Consumes messages from work queues, i.e. Redis lists, using blocking pops - each message is received
+        by exactly one of the consumers across all the servers.
+        """
+        def __init__(self, kvdb, name, queue_keys, on_message):
+            self.kvdb = kvdb
+            self.name = name
+            self.queue_keys = queue_keys
+            self.on_message = on_message
+            self.keep_running = ZATO_NONE
+            self.connect_sleep_time = 1
+
+        def set_up_client(self):
+            try:
+                self.kvdb = self.kvdb.copy()
+                self.kvdb.init()
+                self.kvdb.conn.ping()
+            except Exception, e:
+                logger.warn('Redis connection error, will retry after %ss.\n%s',
+                    self.connect_sleep_time, format_exc(e))
+                sleep(self.connect_sleep_time)
+
+        def run(self, _block_timeout=WORK_QUEUE_BLOCK_TIMEOUT):
+
+            # We're in a new thread and we can initialize the KVDB connection now.
+            self.kvdb.init()
+            self.keep_running = True
+
+            try:
+                while self.keep_running:
+                    try:
+                        result = self.kvdb.conn.brpop(self.queue_keys, _block_timeout)
+                    except redis.ConnectionError, e:
+                        if self.keep_running:
+                            logger.warn('Caught Redis exception `%s`', e.message)
+                            self.set_up_client()
+                    else:
+                        # None means that the timeout was reached without any message
+                        if result:
+                            try:
+                                self.on_message(*result)
+                            except Exception, e:
+                                logger.warn('Could not handle broker queue message `%s`, e:`%s`', result, format_exc(e))
+            except KeyboardInterrupt:
+                self.keep_running = False
+
     class _BrokerClient(object):
         """ Zato broker client. Starts two background threads, one for publishing
         and one for receiving of the messages.
@@ -134,6 +188,12 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+           If broker_work_queue is set in the KVDB config, 3) uses a work queue instead - the message is LPUSH-ed
+           to a Redis list in a single round trip and each client BRPOP-s from it, so only one of them receives it
+           and there are no temporary keys to rename, read, delete or expire. Clients always consume from
+           the work queue, whether they publish to it or not, which means that this mode may be enabled
+           once all the servers in a cluster understand it.
         """
         def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
             self.kvdb = kvdb
@@ -141,6 +201,8 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             self.name = '{}-{}'.format(client_type, new_cid())
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
+            self.use_work_queue = asbool((self.kvdb.config or {}).get('broker_work_queue', False))
+            self.queue_client = None
             self.ready = False
 
         def run(self):
@@ -150,10 +212,18 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             self.pub_client = _ClientThread(self.kvdb.copy(), 'pub', self.name)
             self.sub_client = _ClientThread(self.kvdb.copy(), 'sub', self.name, self.topic_callbacks, self.on_message)
 
-            start_new_thread(self.pub_client.run, ())
-            start_new_thread(self.sub_client.run, ())
+            clients = [self.pub_client, self.sub_client]
+
+            # Work queues are consumed only if there is anything to receive from them
+            queue_keys = [WORK_QUEUE_KEYS[topic] for topic in self.topic_callbacks if topic in WORK_QUEUE_KEYS]
+            if queue_keys:
+                self.queue_client = _QueueThread(self.kvdb.copy(), self.name, queue_keys, self.on_queue_message)
+                clients.append(self.queue_client)
 
-            for client in(self.pub_client, self.sub_client):
+            for client in clients:
+                start_new_thread(client.run, ())
+
+            for client in clients:
                 while client.keep_running == ZATO_NONE:
                     time.sleep(0.01)
                 self.ready = True
@@ -174,6 +244,12 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                 raise
             else:
                 topic = TOPICS[msg_type]
+
+                # A single round trip - the deadline is stored along with the message because list elements cannot expire
+                if self.use_work_queue and topic in WORK_QUEUE_KEYS:
+                    self.kvdb.conn.lpush(WORK_QUEUE_KEYS[topic], b'{}:{}'.format(time.time() + expiration, msg))
+                    return
+
                 key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
 
                 self.kvdb.conn.set(key, str(msg))
@@ -203,22 +279,38 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                 else:
                     payload = loads(msg.data)
 
-                if payload:
-                    payload = Bunch(payload)
-                    if has_debug:
-                        logger.debug('Got broker message payload `%s`', payload)
+                self._dispatch(msg.channel, payload, msg)
 
-                    callback = self.topic_callbacks[msg.channel]
-                    spawn_greenlet(callback, payload)
+        def on_queue_message(self, queue_key, data):
+            if has_debug:
+                logger.debug('Got broker queue message `%s` from `%s`', data, queue_key)
 
-                else:
-                    if has_debug:
-                        logger.debug('No payload in msg: `%s`', msg)
+            expires, data = data.split(b':', 1)
+
+            if float(expires) < time.time():
+                logger.warning('Broker queue message expired, queue_key:`%s`, data:`%s`', queue_key, data)
+                return
+
+            self._dispatch(WORK_QUEUE_TOPICS[queue_key], loads(data), data)
+
+        def _dispatch(self, topic, payload, msg):
+            if payload:
+                payload = Bunch(payload)
+                if has_debug:
+                    logger.debug('Got broker message payload `%s`', payload)
+
+                callback = self.topic_callbacks[topic]
+                spawn_greenlet(callback, payload)
+
+            else:
+                if has_debug:
+                    logger.debug('No payload in msg: `%s`', msg)
 
         def close(self):
-            for client in(self.pub_client, self.sub_client):
-                client.keep_running = False
-                client.kvdb.close()
+            for client in(self.pub_client, self.sub_client, self.queue_client):
+                if client:
+                    client.keep_running = False
+                    client.kvdb.close()
 
     client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
     start_new_thread(client.run, ())
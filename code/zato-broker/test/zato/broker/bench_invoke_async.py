@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures how many invoke_async calls per second are delivered to a consumer through a local Redis, using publish/subscribe
+# with temporary keys and using a work queue. Run as: python bench_invoke_async.py [messages] [host] [port]
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import sys
+from timeit import default_timer
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+from gevent.event import Event
+
+# Zato
+from zato.broker.client import BrokerClient
+from zato.cli.create_server import lua_zato_rename_if_exists
+from zato.common.broker_message import MESSAGE_TYPE, TOPICS
+from zato.common.kvdb import KVDB
+
+# ################################################################################################################################
+
+lua_programs = [('zato.rename_if_exists', lua_zato_rename_if_exists)]
+
+# ################################################################################################################################
+
+def get_kvdb(host, port, use_work_queue):
+    kvdb = KVDB(config=Bunch(host=host, port=port, db=0, broker_work_queue=use_work_queue))
+    kvdb.init()
+    return kvdb
+
+# ################################################################################################################################
+
+def wait_until_ready(*clients):
+    for client in clients:
+        while not client.ready:
+            sleep(0.01)
+
+# ################################################################################################################################
+
+def bench(messages, host, port, use_work_queue):
+
+    received = []
+    all_received = Event()
+
+    def on_message(msg):
+        received.append(msg)
+        if len(received) == messages:
+            all_received.set()
+
+    consumer = BrokerClient(get_kvdb(host, port, use_work_queue), 'bench-consumer',
+        {TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]: on_message}, lua_programs)
+
+    # The producer does not consume parallel messages itself
+    producer = BrokerClient(get_kvdb(host, port, use_work_queue), 'bench-producer',
+        {TOPICS[MESSAGE_TYPE.TO_SCHEDULER]: lambda msg: None}, [])
+
+    wait_until_ready(consumer, producer)
+
+    start = default_timer()
+
+    for idx in xrange(messages):
+        producer.invoke_async({'action': 'bench', 'idx': idx})
+
+    all_received.wait()
+    elapsed = default_timer() - start
+
+    producer.close()
+    consumer.close()
+
+    return messages / elapsed
+
+# ################################################################################################################################
+
+def main(messages, host, port):
+    print('{:>10} {:>12}'.format('', 'calls/s'))
+
+    for label, use_work_queue in (('pub/sub', False), ('queue', True)):
+        print('{:>10} {:>12.0f}'.format(label, bench(messages, host, port, use_work_queue)))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        sys.argv[2] if len(sys.argv) > 2 else 'localhost',
+        int(sys.argv[3]) if len(sys.argv) > 3 else 6379)
+
+# ################################################################################################################################
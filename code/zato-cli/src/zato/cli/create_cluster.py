@@ -33,6 +33,7 @@ zato_services = {
     'zato.channel.amqp.delete':'zato.server.service.internal.channel.amqp_.Delete',
     'zato.channel.amqp.edit':'zato.server.service.internal.channel.amqp_.Edit',
     'zato.channel.amqp.get-list':'zato.server.service.internal.channel.amqp_.GetList',
+    'zato.channel.amqp.get-metrics':'zato.server.service.internal.channel.amqp_.GetMetrics',
 
     # Channels - IBM MQ
     'zato.channel.jms-wmq.create':'zato.server.service.internal.channel.jms_wmq.Create',
@@ -721,6 +722,10 @@ class Create(ZatoCommand):
         item.is_default = True
         item.max_size = CACHE.DEFAULT.MAX_SIZE
         item.max_item_size = CACHE.DEFAULT.MAX_ITEM_SIZE
+        item.opaque1 = {
+            'max_total_size': CACHE.DEFAULT.MAX_TOTAL_SIZE,
+            'sync_batch_window': CACHE.DEFAULT.SYNC_BATCH_WINDOW,
+        }
         item.extend_expiry_on_get = True
         item.extend_expiry_on_set = True
         item.cache_type = CACHE.TYPE.BUILTIN
@@ -58,6 +58,12 @@ redis_sentinels=
 redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
+broker_work_queue=False # Whether to use Redis lists for async invocations, requires all servers to support it
+
+[scheduler]
+use_timer_heap=True # Whether to run all jobs from a single greenlet rather than spawn a greenlet for each job
+job_batch_time=0.1 # In seconds, executions of jobs within that time are sent to servers together, 0 = send each one separately
+job_batch_size=100 # How many job executions at most to send to servers in one message
 
 [secret_keys]
 key1={secret_key1}
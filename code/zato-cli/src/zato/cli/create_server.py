@@ -116,18 +116,26 @@ http_server_header=Zato
 zeromq_connect_sleep=0.1
 aws_host=
 use_soap_envelope=True
-fifo_response_buffer_size=0.2 # In MB
 jwt_secret=zato+secret://zato.server_conf.misc.jwt_secret
 enforce_service_invokes=False
 return_tracebacks=True
 default_error_message="An error has occurred"
 startup_callable=
+http_url_cache_max_size=10000 # How many URL paths of HTTP channels to cache, 0 = no limit
+jwt_local_cache_size=10000 # How many validated JWT tokens each worker keeps locally, 0 = none
+jwt_local_cache_ttl=5 # In seconds, for how long a locally cached JWT token is used before it is validated anew
+jwt_renew_interval=0 # In seconds, how often to extend a JWT token's expiration at most, 0 = on each request
+use_config_snapshot=True # Whether server processes other than the first one should read configuration from its snapshot
 
 [ibm_mq]
 ipc_tcp_start_port=34567
+ipc_pool_size=20 # How many persistent connections to the IBM MQ connector each server process keeps at most
+callback_batch_size=100 # How many messages from IBM MQ queues to deliver to servers in one request at most
+callback_batch_time=0.01 # In seconds, for how long to wait for a batch of messages from IBM MQ queues to fill up
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+timing_flush_interval=5 # In seconds, 0 = store each processing time of services in Redis as soon as it is known
 
 [kvdb]
 host={{kvdb_host}}
@@ -143,6 +151,7 @@ redis_sentinels=
 redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
+broker_work_queue=False # Whether to use Redis lists for async invocations, requires all servers to support it
 
 [startup_services_first_worker]
 zato.helpers.input-logger=Sample payload for a startup service (first worker)
@@ -349,6 +358,9 @@ inform_if_not_approved=True
 
 [session]
 expiry=60 # In minutes
+cache_size=10000 # How many sessions each server process keeps in its local cache, 0 = none
+cache_ttl=30 # In seconds, for how long a session is kept in the local cache before it is looked up anew
+renew_batch_interval=0 # In seconds, how often to store session renewals in bulk, 0 = store each one immediately
 
 [password]
 expiry=730 # In days, 365 days * 2 years = 730 days
@@ -457,6 +457,8 @@ class CACHE:
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 1000 # In characters for string/unicode, bytes otherwise
+        MAX_TOTAL_SIZE = 0 # In bytes, approximate size of all keys and values in a cache, 0 = no limit
+        SYNC_BATCH_WINDOW = 250 # In milliseconds, how long state changes are buffered before being sent out in one batch
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -469,10 +471,11 @@ class CACHE:
     class SYNC_METHOD:
         NO_SYNC = NameId('No synchronization', 'no-sync')
         IN_BACKGROUND = NameId('In background', 'in-background')
+        IN_BATCHES = NameId('In batches', 'in-batches')
 
         class __metaclass__(type):
             def __iter__(self):
-                return iter((self.NO_SYNC, self.IN_BACKGROUND))
+                return iter((self.NO_SYNC, self.IN_BACKGROUND, self.IN_BATCHES))
 
 class KVDB(Attrs):
     SEPARATOR = ':::'
@@ -513,6 +516,10 @@ class KVDB(Attrs):
     SERVICE_TIME_AGGREGATED_BY_DAY = 'zato:stats:service:time:aggr-by-day:'
     SERVICE_TIME_AGGREGATED_BY_MONTH = 'zato:stats:service:time:aggr-by-month:'
     SERVICE_TIME_SLOW = 'zato:stats:service:time:slow:'
+    SERVICE_TIME_SUMMARY = 'zato:stats:service:time:summary:'
+    SERVICE_TIME_SUMMARY_BY_MINUTE = 'zato:stats:service:time:summary-by-minute:'
+    SERVICE_TIME_INDEX = 'zato:stats:service:time:index:'
+    SERVICE_TIME_INDEX_SINCE = 'zato:stats:service:time:index-since'
 
     SERVICE_SUMMARY_PREFIX_PATTERN = 'zato:stats:service:summary:{}:'
     SERVICE_SUMMARY_BY_DAY = 'zato:stats:service:summary:by-day:'
@@ -537,6 +544,8 @@ class KVDB(Attrs):
     ASYNC_INVOKE_PROCESSED_FLAG_PATTERN = 'zato:async-invoke-with-pattern:processed:{}:{}'
     ASYNC_INVOKE_PROCESSED_FLAG = '1'
 
+    CONFIG_VERSION = 'zato:config:version'
+
 class SCHEDULER:
 
     class JOB_TYPE(Attrs):
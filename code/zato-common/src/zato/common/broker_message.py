@@ -71,6 +71,7 @@ class SCHEDULER(Constants):
     DELETE = ValueConstant('')
     EXECUTE = ValueConstant('')
     JOB_EXECUTED = ValueConstant('')
+    JOB_EXECUTED_BATCH = ValueConstant('')
 
 class ZMQ_SOCKET(Constants):
     code_start = 100200
@@ -203,6 +204,8 @@ class OUTGOING(Constants):
     STOMP_DELETE = ValueConstant('')
     STOMP_CHANGE_PASSWORD = ValueConstant('')
 
+    WMQ_SEND_BATCH = ValueConstant('')
+
 class CHANNEL(Constants):
     code_start = 101000
 
@@ -473,6 +476,8 @@ class CACHE(Constants):
     MEMCACHED_EDIT = ValueConstant('')
     MEMCACHED_DELETE = ValueConstant('')
 
+    BUILTIN_STATE_CHANGED_BATCH = ValueConstant('')
+
 class SERVER_STATUS(Constants):
     code_start = 106800
 
@@ -486,6 +491,11 @@ class GENERIC(Constants):
     CONNECTION_DELETE = ValueConstant('')
     CONNECTION_CHANGE_PASSWORD = ValueConstant('')
 
+class SSO(Constants):
+    code_start = 107200
+
+    SESSION_CACHE_INVALIDATE = ValueConstant('')
+
 code_to_name = {}
 
 # To prevent 'RuntimeError: dictionary changed size during iteration'
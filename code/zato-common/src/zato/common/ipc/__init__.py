@@ -34,7 +34,7 @@ class Request(object):
         self.request_id = request_id or 'ipc.{}'.format(new_cid())
         self.target_pid = None
         self.reply_to_tag = ''
-        self.reply_to_fifo = ''
+        self.reply_to = '' # Address of the reply server to send responses to, if any are expected
         self.in_reply_to = ''
         self.creation_time_utc = datetime.utcnow()
 
@@ -9,19 +9,12 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import errno
 import logging
-import os
-import stat
-import tempfile
-from cStringIO import StringIO
-from datetime import datetime, timedelta
-from fcntl import fcntl
 from traceback import format_exc
-from uuid import uuid4
 
 # gevent
-from gevent import sleep
+from gevent import Timeout
+from gevent.event import AsyncResult
 
 # pyrapidjson
 from rapidjson import loads
@@ -30,8 +23,9 @@ from rapidjson import loads
 from zato.common import IPC
 from zato.common.ipc.forwarder import Forwarder
 from zato.common.ipc.publisher import Publisher
+from zato.common.ipc.reply import get_reply_address, ReplySender, ReplyServer
 from zato.common.ipc.subscriber import Subscriber
-from zato.common.util import spawn_greenlet
+from zato.common.util import new_cid, spawn_greenlet
 
 # ################################################################################################################################
 
@@ -39,16 +33,9 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
-fifo_create_mode = stat.S_IRUSR | stat.S_IWUSR
-fifo_ignore_err = errno.EAGAIN, errno.EWOULDBLOCK
-
-# On Linux, this is F_LINUX_SPECIFIC_BASE (1024) + 7
-_F_SETPIPE_SZ = 1031
-
-# ################################################################################################################################
-
 class IPCAPI(object):
-    """ API through which IPC is performed.
+    """ API through which IPC is performed. Requests are published to all worker processes whereas responses are sent back
+    over long-lived Unix sockets, each response carrying the ID of the request it is for.
     """
     def __init__(self, is_forwarder, name=None, on_message_callback=None, pid=None):
         self.is_forwarder = is_forwarder
@@ -56,6 +43,9 @@ class IPCAPI(object):
         self.on_message_callback = on_message_callback
         self.pid = pid
 
+        # Request ID -> AsyncResult that its response will be set in
+        self.pending = {}
+
     def run(self):
 
         if self.is_forwarder:
@@ -63,88 +53,75 @@ class IPCAPI(object):
         else:
             self.publisher = Publisher(self.name, self.pid)
             self.subscriber = Subscriber(self.on_message_callback, self.name, self.pid)
+            self.reply_server = ReplyServer(self.pid, self.on_response)
+            self.reply_sender = ReplySender()
+            self.reply_server.start()
             spawn_greenlet(self.subscriber.serve_forever)
 
     def publish(self, payload):
         self.publisher.publish(payload)
 
-    def _get_response(self, fifo, buffer_size, fifo_ignore_err=fifo_ignore_err, empty=('', None)):
-
-        try:
-            buff = StringIO()
-            data = object() # Use a sentinel because '' or None are expected from os.read
-
-            # The most common use-case for IPC are publish/subscribe messages and the most
-            # common response is this: 'zs;{"r": {"r": null}}'
-            # which is 21 bytes. For other messages, the buffer size makes no difference.
-
-            while data not in empty:
-                data = os.read(fifo, 21)
-                buff.write(data)
-
-            response = buff.getvalue()
+    def on_response(self, request_id, response, _success=IPC.STATUS.SUCCESS, _status_length=IPC.STATUS.LENGTH):
+        """ Invoked by the reply server for each response received - wakes up whoever is waiting for it.
+        """
+        result = self.pending.pop(request_id, None)
 
-            status = response[:IPC.STATUS.LENGTH]
-            response = response[IPC.STATUS.LENGTH+1:] # Add 1 to account for the separator
-            is_success = status == IPC.STATUS.SUCCESS
+        # No one is waiting, e.g. the request has already timed out
+        if not result:
+            logger.info('Ignoring IPC response to `%s`, no such request', request_id)
+            return
 
-            if is_success:
-                response = loads(response) if response else ''
+        status = response[:_status_length]
+        response = response[_status_length+1:] # Add 1 to account for the separator
+        is_success = status == _success
 
-            buff.close()
+        if is_success:
+            response = loads(response) if response else ''
 
-            return is_success, response
+        result.set((is_success, response))
 
-        except OSError, e:
-            if e.errno not in fifo_ignore_err:
-                raise
+    def send_response(self, reply_to, request_id, status, response):
+        """ Sends a response to a request received from another process - reply_to is the address of that process'
+        reply server.
+        """
+        self.reply_sender.send(reply_to, request_id, '{};{}'.format(status, response))
 
-    def invoke_by_pid(self, service, payload, target_pid, fifo_response_buffer_size, timeout=90, is_async=False):
+    def invoke_by_pid(self, service, payload, target_pid, timeout=90, is_async=False):
         """ Invokes a service through IPC, synchronously or in background. If target_pid is an exact PID then this one worker
         process will be invoked if it exists at all.
         """
-        # Create a FIFO pipe to receive replies to come through
-        fifo_path = os.path.join(tempfile.tempdir, 'zato-ipc-fifo-{}'.format(uuid4().hex))
-        os.mkfifo(fifo_path, fifo_create_mode)
-
         try:
-            self.publisher.publish(payload, service, target_pid, reply_to_fifo=fifo_path)
 
             # Async = we do not need to wait for any response
             if is_async:
+                self.publisher.publish(payload, service, target_pid)
                 return
 
-            response = None, None
+            request_id = 'ipc.{}'.format(new_cid())
+            result = self.pending[request_id] = AsyncResult()
 
             try:
+                self.publisher.publish(payload, service, target_pid, reply_to=get_reply_address(self.pid),
+                    request_id=request_id)
 
-                # Open the pipe for reading ..
-                fifo_fd = os.open(fifo_path, os.O_RDONLY|os.O_NONBLOCK)
-                fcntl(fifo_fd, _F_SETPIPE_SZ, 1000000)
-
-                # .. and wait for response ..
-                now = datetime.utcnow()
-                until = now + timedelta(seconds=timeout)
+                # Wait until either the response is received or the timeout is reached
+                return result.get(timeout=timeout)
 
-                while now < until:
-                    sleep(0.05)
-                    response = self._get_response(fifo_fd, fifo_response_buffer_size)
-                    if response:
-                        break
-                    else:
-                        now = datetime.utcnow()
+            except Timeout:
+                msg = 'IPC response to `{}` not received in {}s (service:`{}`, pid:`{}`)'.format(
+                    request_id, timeout, service, target_pid)
+                logger.warn(msg)
 
-            except Exception:
-                logger.warn('Exception in IPC FIFO, e:`%s`', format_exc())
+                # Callers expect an (is_ok, data) tuple - data is the reason for the failure in this case
+                return False, msg
 
             finally:
-                os.close(fifo_fd)
-
-            return response
+                self.pending.pop(request_id, None)
 
         except Exception, e:
             logger.warn(format_exc(e))
-        finally:
-            os.remove(fifo_path)
+
+            if not is_async:
+                return False, format_exc(e)
 
 # ################################################################################################################################
@@ -20,14 +20,14 @@ class Publisher(IPCEndpoint):
     socket_method = 'connect'
     socket_type = 'pub'
 
-    def publish(self, payload, service='', target_pid=None, action=IPC.ACTION.INVOKE_SERVICE, reply_to_fifo=None):
-        request = Request(self.name, self.pid)
+    def publish(self, payload, service='', target_pid=None, action=IPC.ACTION.INVOKE_SERVICE, reply_to=None, request_id=None):
+        request = Request(self.name, self.pid, request_id=request_id)
 
         request.payload = payload
         request.service = service
         request.action = action
         request.target_pid = target_pid
-        request.reply_to_fifo = reply_to_fifo
+        request.reply_to = reply_to
 
         self.socket.send_pyobj(request)
 
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+import socket
+from struct import Struct
+from tempfile import gettempdir
+from traceback import format_exc
+
+# gevent
+from gevent.lock import RLock
+from gevent.server import StreamServer
+
+# Zato
+from zato.common.util import get_logger_for_class, make_repr
+
+# ################################################################################################################################
+
+# Each frame is a 4-byte big-endian length of the data that follows it, i.e. of request_id;response
+_header = Struct(b'!I')
+_header_size = _header.size
+
+# ################################################################################################################################
+
+def get_reply_address(pid):
+    """ Returns a path to the Unix socket that responses to IPC requests sent by the worker process of input PID arrive on.
+    """
+    return os.path.join(gettempdir(), 'zato-ipc-reply-{}'.format(pid))
+
+# ################################################################################################################################
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+# ################################################################################################################################
+
+class ReplyServer(object):
+    """ Listens on a long-lived Unix socket for responses to IPC requests that the current process sent. Each response
+    carries the ID of the request it is for, which means that any number of requests may be awaited at a time,
+    no matter which connections their responses arrive through.
+    """
+    def __init__(self, pid, on_response_callback):
+        self.pid = pid
+        self.address = get_reply_address(pid)
+        self.on_response_callback = on_response_callback
+        self.server = None
+        self.logger = get_logger_for_class(self.__class__)
+
+    def __repr__(self):
+        return make_repr(self)
+
+    def start(self):
+
+        # A socket left over by a previous process of the same PID would not let us bind
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(128)
+
+        self.server = StreamServer(listener, self.handle)
+        self.server.start()
+
+        self.logger.info('IPC reply server listening on `%s` (pid: %s)', self.address, self.pid)
+
+    def handle(self, sock, ignored_address, _header_size=_header_size, _unpack=_header.unpack):
+        """ Reads all responses sent through a single connection until the connection is closed by the other side.
+        """
+        f = sock.makefile('rb')
+
+        try:
+            while True:
+                header = f.read(_header_size)
+                if len(header) < _header_size:
+                    break
+
+                data = f.read(_unpack(header)[0])
+                request_id, data = data.split(b';', 1)
+
+                try:
+                    self.on_response_callback(request_id, data)
+                except Exception:
+                    self.logger.warn('Could not handle IPC response to `%s`, e:`%s`', request_id, format_exc())
+
+        except Exception:
+            self.logger.warn('Error in IPC reply connection, e:`%s`', format_exc())
+
+        finally:
+            f.close()
+
+    def close(self):
+        if self.server:
+            self.server.stop()
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+# ################################################################################################################################
+
+class ReplySender(object):
+    """ Sends responses to IPC requests through persistent connections, one for each of the processes
+    that requests are received from.
+    """
+    def __init__(self):
+        self.connections = {} # Address -> (socket, lock)
+        self.lock = RLock()
+        self.logger = get_logger_for_class(self.__class__)
+
+    def __repr__(self):
+        return make_repr(self)
+
+    def _get_connection(self, address):
+        with self.lock:
+            connection = self.connections.get(address)
+            if not connection:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(address)
+                connection = self.connections[address] = (sock, RLock())
+
+            return connection
+
+    def _drop_connection(self, address, sock):
+        with self.lock:
+            if self.connections.get(address, (None,))[0] is sock:
+                del self.connections[address]
+
+        try:
+            sock.close()
+        except Exception:
+            pass # The connection is being dropped anyway
+
+    def send(self, address, request_id, data, _pack=_header.pack):
+        """ Sends data as a response to request_id to the process listening on address.
+        """
+        data = b'{};{}'.format(_to_bytes(request_id), _to_bytes(data))
+        frame = _pack(len(data)) + data
+
+        # A connection may have been closed by the other side since it was last used,
+        # in which case it is opened again and the data is sent once more.
+        for is_last in (False, True):
+            sock, lock = self._get_connection(address)
+            try:
+                with lock:
+                    sock.sendall(frame)
+            except socket.error:
+                self._drop_connection(address, sock)
+                if is_last:
+                    raise
+            else:
+                return
+
+    def close(self):
+        with self.lock:
+            for sock, _ in self.connections.values():
+                sock.close()
+            self.connections.clear()
+
+# ################################################################################################################################
@@ -644,6 +644,100 @@ class ODBManager(SessionWrapper):
             logger.error('Could not add service, name:[%s], e:[%s]', name, format_exc(e).decode('utf-8'))
             self._session.rollback()
 
+# ################################################################################################################################
+
+    def add_services(self, items):
+        """ Adds information about many of the server's services, and their deployment details, into the ODB in one transaction.
+        Each item is a Bunch with the same attributes that add_service expects on input. Returns a dictionary of service names
+        to their IDs, is_active flags and slow response thresholds.
+        """
+        try:
+            try:
+                return self._add_services(items)
+            except(IntegrityError, ProgrammingError), e:
+
+                # Another server may have just added some of the same services, in which case it suffices to try again
+                # because this time they will be found in the ODB.
+                logger.log(TRACE1, 'IntegrityError (Service), e:[%s]', format_exc(e).decode('utf-8'))
+                self._session.rollback()
+
+                return self._add_services(items)
+
+        except Exception, e:
+            logger.warn('Could not add services in one transaction, adding them one by one, e:[%s]',
+                format_exc(e).decode('utf-8'))
+            self._session.rollback()
+
+            # This way, only the services that cannot be added at all will be missing from the output
+            out = {}
+
+            for item in items:
+                info = self.add_service(
+                    item.name, item.impl_name, item.is_internal, item.deployment_time, item.details, item.source_info)
+
+                if info:
+                    out[item.name] = info
+
+            return out
+
+    def _add_services(self, items, _chunk_size=500):
+
+        services = {}
+        names = sorted(set(item.name for item in items))
+
+        # Look up services that already exist ..
+        for idx in xrange(0, len(names), _chunk_size):
+            for service in self._session.query(Service).\
+                filter(Service.cluster_id==self.cluster.id).\
+                filter(Service.name.in_(names[idx:idx+_chunk_size])):
+                services[service.name] = service
+
+        # .. add the ones that do not ..
+        for item in items:
+            if item.name not in services:
+                service = Service(None, item.name, True, item.impl_name, item.is_internal, self.cluster)
+                self._session.add(service)
+                services[item.name] = service
+
+        # .. so that all of them have their IDs ..
+        self._session.flush()
+
+        deployed = {}
+        service_ids = sorted(service.id for service in services.itervalues())
+
+        # .. now, look up information about services already deployed on this server ..
+        for idx in xrange(0, len(service_ids), _chunk_size):
+            for ds in self._session.query(DeployedService).\
+                filter(DeployedService.server_id==self.server.id).\
+                filter(DeployedService.service_id.in_(service_ids[idx:idx+_chunk_size])):
+                deployed[ds.service_id] = ds
+
+        # .. and add or update it for each service.
+        for item in items:
+            service = services[item.name]
+            si = item.source_info
+            ds = deployed.get(service.id)
+
+            if ds is None:
+                ds = DeployedService(item.deployment_time, item.details, self.server.id, service,
+                    si.source, si.path, si.hash, si.hash_method)
+                self._session.add(ds)
+                deployed[service.id] = ds
+            else:
+                ds.deployment_time = item.deployment_time
+                ds.details = item.details
+                ds.source = si.source
+                ds.source_path = si.path
+                ds.source_hash = si.hash
+                ds.source_hash_method = si.hash_method
+
+        # Read everything before committing - otherwise each object would be loaded from the ODB again
+        out = dict((name, (service.id, service.is_active, service.slow_threshold)) for name, service in services.iteritems())
+
+        self._session.commit()
+
+        return out
+
 # ################################################################################################################################
 
     def drop_deployed_services(self, server_id):
@@ -1647,6 +1647,10 @@ def update_apikey_username_to_channel(config):
 def get_response_value(response):
     """ Extracts the actual response string from a response object produced by services.
     """
+    # Streamed output may be an iterator that can be read only once so it must be left for the actual recipient
+    if getattr(response.payload, 'zato_output_stream', False):
+        return '(streamed)'
+
     return (response.payload.getvalue() if hasattr(response.payload, 'getvalue') else response.payload) or ''
 
 # ################################################################################################################################
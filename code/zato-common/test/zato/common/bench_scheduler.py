@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures scheduling jitter, i.e. how late jobs run compared to when they were due, and CPU time used by the scheduler
+# when each job has a greenlet of its own and when all of them are run from a timer heap.
+# Run as: python bench_scheduler.py [jobs] [interval] [seconds]
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import logging
+import resource
+import sys
+from datetime import datetime, timedelta
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+
+# Zato
+from zato.common import SCHEDULER
+from zato.scheduler.backend import Interval, Job, Scheduler
+
+# ################################################################################################################################
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# ################################################################################################################################
+
+def get_percentile(values, percentile):
+    return values[min(int(len(values) * percentile / 100.0), len(values) - 1)] if values else 0
+
+# ################################################################################################################################
+
+def bench(jobs, interval, seconds, use_timer_heap):
+
+    due = {} # Job name -> UNIX timestamp of its first execution
+    jitter = []
+
+    def on_job_executed_cb(ctx):
+        jitter.append(time() - (due[ctx['name']] + (ctx['current_run'] - 1) * interval))
+
+    config = Bunch()
+    config.on_job_executed_cb = on_job_executed_cb
+    config._add_startup_jobs = False
+    config._add_scheduler_jobs = False
+    config.startup_jobs = []
+    config.odb = None
+    config.job_log_level = 'debug'
+    config.use_timer_heap = use_timer_heap
+
+    scheduler = Scheduler(config, None)
+
+    # Job greenlets are not spawned through spawn_greenlet, which waits a moment for each one to start
+    scheduler._spawn = spawn
+
+    # Spread first executions evenly across the first interval, starting a moment from now
+    now = datetime.utcnow() + timedelta(seconds=1)
+    now_ts = time() + 1
+
+    for idx in xrange(jobs):
+        offset = interval * idx / jobs
+        name = 'job-{}'.format(idx)
+        due[name] = now_ts + offset
+
+        job = Job(idx, name, SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(in_seconds=interval),
+            now + timedelta(seconds=offset), clone_start_time=True)
+        scheduler.create(job, spawn=False)
+
+    def stop(stop_at):
+        if time() >= stop_at:
+            scheduler.keep_running = False
+
+    scheduler.iter_cb = stop
+    scheduler.iter_cb_args = (time() + seconds,)
+
+    cpu_start = get_cpu_time()
+    scheduler.run()
+    cpu_used = get_cpu_time() - cpu_start
+
+    for greenlet in scheduler.job_greenlets.values():
+        greenlet.kill(block=False)
+
+    if scheduler.timer_heap:
+        scheduler.timer_heap.stop()
+
+    sleep(0.5)
+
+    jitter.sort()
+    return len(jitter), get_percentile(jitter, 50), get_percentile(jitter, 99), jitter[-1] if jitter else 0, cpu_used
+
+# ################################################################################################################################
+
+def main(jobs, interval, seconds):
+
+    # Each execution is logged otherwise
+    logging.disable(logging.INFO)
+
+    print('{:>12} {:>10} {:>12} {:>12} {:>12} {:>10}'.format('', 'runs', 'p50 ms', 'p99 ms', 'max ms', 'cpu s'))
+
+    for label, use_timer_heap in (('greenlets', False), ('timer heap', True)):
+        runs, p50, p99, max_, cpu_used = bench(jobs, interval, seconds, use_timer_heap)
+        print('{:>12} {:>10} {:>12.2f} {:>12.2f} {:>12.2f} {:>10.2f}'.format(
+            label, runs, p50 * 1000, p99 * 1000, max_ * 1000, cpu_used))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5.0,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 30.0)
+
+# ################################################################################################################################
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+from uuid import uuid4
+
+# gevent
+from gevent.event import AsyncResult
+
+# Zato
+from zato.common import IPC
+from zato.common.ipc.api import IPCAPI
+from zato.common.ipc.reply import get_reply_address, ReplySender, ReplyServer
+
+# ################################################################################################################################
+
+class IPCReplyTestCase(TestCase):
+
+    def setUp(self):
+        self.api = IPCAPI(False, pid='test-{}'.format(uuid4().hex))
+        self.api.reply_server = ReplyServer(self.api.pid, self.api.on_response)
+        self.api.reply_sender = ReplySender()
+        self.api.reply_server.start()
+        self.address = get_reply_address(self.api.pid)
+
+    def tearDown(self):
+        self.api.reply_sender.close()
+        self.api.reply_server.close()
+
+# ################################################################################################################################
+
+    def test_responses_multiplexed(self):
+        results = {}
+        for idx in range(10):
+            results['ipc.{}'.format(idx)] = self.api.pending['ipc.{}'.format(idx)] = AsyncResult()
+
+        # Responses arrive in a different order than the one requests were sent in, all over the same connection
+        for idx in reversed(range(10)):
+            self.api.send_response(self.address, 'ipc.{}'.format(idx), IPC.STATUS.SUCCESS, '{"r": %d}' % idx)
+
+        for idx in range(10):
+            self.assertEquals(results['ipc.{}'.format(idx)].get(timeout=2), (True, {'r': idx}))
+
+        self.assertEquals(len(self.api.reply_sender.connections), 1)
+        self.assertFalse(self.api.pending)
+
+# ################################################################################################################################
+
+    def test_failure(self):
+        result = self.api.pending['ipc.1'] = AsyncResult()
+        self.api.send_response(self.address, 'ipc.1', IPC.STATUS.FAILURE, 'Traceback; zażółć')
+        self.assertEquals(result.get(timeout=2), (False, 'Traceback; zażółć'.encode('utf-8')))
+
+# ################################################################################################################################
+
+    def test_no_such_request(self):
+        result = self.api.pending['ipc.2'] = AsyncResult()
+
+        # A response to a request that already timed out is ignored
+        self.api.send_response(self.address, 'ipc.1', IPC.STATUS.SUCCESS, '')
+        self.api.send_response(self.address, 'ipc.2', IPC.STATUS.SUCCESS, '')
+
+        self.assertEquals(result.get(timeout=2), (True, ''))
+
+# ################################################################################################################################
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+
+# Bunch
+from bunch import Bunch
+
+# SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import SourceInfo
+from zato.common.odb.api import ODBManager, WritableTupleQuery
+from zato.common.odb.model import Cluster, DeployedService, Server, Service
+from zato.common.test import ODBTestCase
+
+# ################################################################################################################################
+
+def get_item(name, hash='hash'):
+    si = SourceInfo()
+    si.source = b'source'
+    si.path = '/tmp/{}.py'.format(name)
+    si.hash = hash
+    si.hash_method = 'SHA-256'
+
+    return Bunch(name=name, impl_name='impl.{}'.format(name), is_internal=True, deployment_time=datetime.utcnow(),
+        details='details', source_info=si)
+
+# ################################################################################################################################
+
+class AddServicesTestCase(ODBTestCase):
+
+    def setUp(self):
+        super(AddServicesTestCase, self).setUp()
+
+        self.odb = ODBManager()
+        self.odb._Session = sessionmaker(bind=self.engine, query_cls=WritableTupleQuery)
+        self.odb._session = self.odb._Session()
+
+        self.odb.cluster = Cluster(None, 'test', None, 'sqlite', None, None, None, None, None, 'localhost', 6379, 'localhost',
+            11223, 20151)
+        self.odb.server = Server(None, 'test', self.odb.cluster, 'test')
+        self.odb._session.add(self.odb.server)
+        self.odb._session.commit()
+
+    def tearDown(self):
+        self.odb._session.close()
+        super(AddServicesTestCase, self).tearDown()
+
+    def get_deployed(self):
+        session = self.odb._Session()
+        try:
+            return dict((service.name, (ds.source_hash, ds.details)) for ds, service in session.query(DeployedService, Service).\
+                filter(DeployedService.service_id==Service.id))
+        finally:
+            session.close()
+
+    def test_insert(self):
+        out = self.odb.add_services([get_item('a'), get_item('b')])
+
+        self.assertEquals(sorted(out), ['a', 'b'])
+        self.assertNotEquals(out['a'][0], out['b'][0])
+        self.assertEquals(out['a'][1:], (True, 99999))
+        self.assertEquals(self.get_deployed(), {'a': ('hash', 'details'), 'b': ('hash', 'details')})
+
+    def test_update(self):
+        first = self.odb.add_services([get_item('a')])
+
+        # The service already exists and is already deployed on this server
+        service = self.odb._session.query(Service).filter(Service.name=='a').one()
+        service.is_active = False
+        self.odb._session.commit()
+
+        out = self.odb.add_services([get_item('a', 'hash2'), get_item('b', 'hash2')])
+
+        # Both the service and its deployment are updated in place, instead of being added anew
+        self.assertEquals(out['a'], (first['a'][0], False, 99999))
+        self.assertEquals(self.odb._session.query(Service).count(), 2)
+        self.assertEquals(self.get_deployed(), {'a': ('hash2', 'details'), 'b': ('hash2', 'details')})
+
+    def test_integrity_error_retry(self):
+        add_services = self.odb._add_services
+        calls = []
+
+        def _add_services(items):
+            calls.append(items)
+
+            # Another server adds the same service after the look-up, making the first attempt fail
+            if len(calls) == 1:
+                session = self.odb._Session()
+                session.add(Service(None, 'a', True, 'impl.a', True, session.merge(self.odb.cluster)))
+                session.commit()
+                session.close()
+
+                raise IntegrityError('INSERT', {}, Exception('Duplicate service'))
+
+            return add_services(items)
+
+        self.odb._add_services = _add_services
+        out = self.odb.add_services([get_item('a'), get_item('b')])
+
+        # The second attempt found the service that the other server added
+        self.assertEquals(len(calls), 2)
+        self.assertEquals(sorted(out), ['a', 'b'])
+        self.assertEquals(self.odb._session.query(Service).count(), 2)
+        self.assertEquals(sorted(self.get_deployed()), ['a', 'b'])
+
+    def test_fallback_to_one_by_one(self):
+
+        def _add_services(items):
+            raise IntegrityError('INSERT', {}, Exception('Still failing'))
+
+        add_service = self.odb.add_service
+
+        def add_service_one(name, *args):
+            if name == 'b':
+                return None # As add_service does if it could not add a service
+            return add_service(name, *args)
+
+        self.odb._add_services = _add_services
+        self.odb.add_service = add_service_one
+
+        out = self.odb.add_services([get_item('a'), get_item('b'), get_item('c')])
+
+        # The batch failed twice so each service was added separately and only the one that could not be added is missing
+        self.assertEquals(sorted(out), ['a', 'c'])
+        self.assertEquals(sorted(self.get_deployed()), ['a', 'c'])
+
+# ################################################################################################################################
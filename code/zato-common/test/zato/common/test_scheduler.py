@@ -31,8 +31,10 @@ from mock import patch
 
 # Zato
 from zato.common import SCHEDULER
+from zato.common.broker_message import SCHEDULER as SCHEDULER_MSG
 from zato.common.test import is_like_cid, rand_bool, rand_date_utc, rand_int, rand_string
-from zato.scheduler.backend import Interval, Job, Scheduler
+from zato.scheduler.api import Scheduler as SchedulerAPI
+from zato.scheduler.backend import Interval, Job, Scheduler, TimerHeap
 
 seed()
 
@@ -819,3 +821,206 @@ class SchedulerTestCase(TestCase):
 
         for idx, item in enumerate(data['runs']):
             self.assertEquals(data['ctx'][idx], item)
+
+class TimerHeapTestCase(TestCase):
+
+    def get_job(self, name, interval, max_repeats=None, job_type=SCHEDULER.JOB_TYPE.INTERVAL_BASED, runs=None):
+
+        def callback(ctx):
+            runs.append(ctx['name'])
+
+        job = Job(rand_int(), name, job_type, Interval(seconds=interval), datetime.utcnow(), max_repeats=max_repeats)
+        job.callback = callback
+
+        return job
+
+    def test_jobs_run_in_order(self):
+        runs = []
+        timer_heap = TimerHeap()
+
+        start_time = datetime.utcnow() + timedelta(seconds=0.2)
+
+        for name, offset in (('c', 0.2), ('a', 0), ('b', 0.1)):
+            job = self.get_job(name, 10, runs=runs)
+            job.start_time = start_time + timedelta(seconds=offset)
+            timer_heap.add(job)
+
+        spawn(timer_heap.run)
+        sleep(0.6)
+        timer_heap.stop()
+
+        self.assertEquals(runs, ['a', 'b', 'c'])
+        self.assertEquals(len(timer_heap), 3)
+
+    def test_max_repeats(self):
+        runs = []
+        timer_heap = TimerHeap()
+
+        job = self.get_job('a', 0.05, max_repeats=3, runs=runs)
+        timer_heap.add(job)
+
+        spawn(timer_heap.run)
+        sleep(0.5)
+        timer_heap.stop()
+
+        self.assertEquals(runs, ['a', 'a', 'a'])
+        self.assertTrue(job.max_repeats_reached)
+        self.assertFalse(job.keep_running)
+        self.assertEquals(len(timer_heap), 0)
+
+    def test_one_time(self):
+        runs = []
+        timer_heap = TimerHeap()
+
+        timer_heap.add(self.get_job('a', 0.05, job_type=SCHEDULER.JOB_TYPE.ONE_TIME, runs=runs))
+
+        spawn(timer_heap.run)
+        sleep(0.3)
+        timer_heap.stop()
+
+        self.assertEquals(runs, ['a'])
+        self.assertEquals(len(timer_heap), 0)
+
+    def test_remove_replace(self):
+        runs = []
+        timer_heap = TimerHeap()
+
+        timer_heap.add(self.get_job('a', 0.05, runs=runs))
+        timer_heap.add(self.get_job('b', 0.05, runs=runs))
+
+        # The first job is replaced by one of the same name, the other is removed
+        timer_heap.add(self.get_job('a', 0.05, max_repeats=1, runs=runs))
+        self.assertTrue(timer_heap.remove('b'))
+        self.assertFalse(timer_heap.remove('b'))
+
+        spawn(timer_heap.run)
+        sleep(0.3)
+        timer_heap.stop()
+
+        self.assertEquals(runs, ['a'])
+
+    def test_scheduler_uses_timer_heap(self):
+
+        runs = []
+
+        def on_job_executed_cb(ctx):
+            runs.append(ctx['name'])
+
+        test_wait_time = 0.5
+
+        config = get_scheduler_config()
+        config.use_timer_heap = True
+        config.on_job_executed_cb = on_job_executed_cb
+
+        scheduler = Scheduler(config, None)
+        scheduler.iter_cb = iter_cb
+        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
+
+        job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=2)
+        scheduler.create(job)
+        scheduler.run()
+        scheduler.timer_heap.stop()
+
+        self.assertFalse(scheduler.job_greenlets)
+        self.assertEquals(runs, ['a', 'a'])
+        self.assertFalse(job.is_active)
+
+class SchedulerAPIJobBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.invoked = []
+        self.published = []
+
+    def get_scheduler(self, job_batch_time, job_batch_size=100):
+
+        # Broker and ODB connections are not needed to check what is sent to servers
+        scheduler = SchedulerAPI.__new__(SchedulerAPI)
+        scheduler.broker_client = Bunch(invoke_async=self.invoked.append, publish=self.published.append)
+        scheduler.job_batch_time = job_batch_time
+        scheduler.job_batch_size = job_batch_size
+        scheduler.job_batch = []
+        scheduler.one_time_batch = []
+        scheduler.job_batch_flush_pending = False
+
+        return scheduler
+
+    def on_job_executed(self, scheduler, id, job_type=SCHEDULER.JOB_TYPE.INTERVAL_BASED):
+        scheduler.on_job_executed({'id':id, 'name':'job-{}'.format(id), 'type':job_type, 'cid':'cid-{}'.format(id),
+            'cb_kwargs':{'service':'my.service', 'extra':''}})
+
+    def test_unbatched(self):
+        scheduler = self.get_scheduler(0)
+
+        self.on_job_executed(scheduler, 1)
+        self.on_job_executed(scheduler, 2, SCHEDULER.JOB_TYPE.ONE_TIME)
+
+        # Each execution is sent immediately and a one-time job is deactivated as soon as it runs
+        self.assertEquals([msg['name'] for msg in self.invoked], ['job-1', 'job-2'])
+        self.assertEquals(self.invoked[0]['action'], SCHEDULER_MSG.JOB_EXECUTED.value)
+        self.assertEquals(len(self.published), 1)
+        self.assertEquals(self.published[0]['service'], 'zato.scheduler.job.set-active-status')
+        self.assertEquals(self.published[0]['payload'], {'id':2, 'is_active':False})
+        self.assertFalse(scheduler.job_batch_flush_pending)
+
+    def test_batched(self):
+        scheduler = self.get_scheduler(0.05)
+
+        self.on_job_executed(scheduler, 1, SCHEDULER.JOB_TYPE.ONE_TIME)
+        self.on_job_executed(scheduler, 2)
+        self.on_job_executed(scheduler, 3, SCHEDULER.JOB_TYPE.ONE_TIME)
+
+        # Nothing is sent until the batch window closes ..
+        self.assertTrue(scheduler.job_batch_flush_pending)
+        self.assertEquals(self.invoked, [])
+        self.assertEquals(self.published, [])
+
+        sleep(0.1)
+
+        # .. and then all the executions are sent in one message and all the one-time jobs are deactivated in one go.
+        self.assertEquals(len(self.invoked), 1)
+        self.assertEquals(self.invoked[0]['action'], SCHEDULER_MSG.JOB_EXECUTED_BATCH.value)
+        self.assertEquals([msg['name'] for msg in self.invoked[0]['jobs']], ['job-1', 'job-2', 'job-3'])
+
+        self.assertEquals(len(self.published), 1)
+        self.assertEquals(self.published[0]['service'], 'zato.scheduler.job.deactivate-list')
+        self.assertEquals(self.published[0]['payload'], {'id_list':[1, 3]})
+
+        self.assertFalse(scheduler.job_batch_flush_pending)
+        self.assertEquals(scheduler.job_batch, [])
+        self.assertEquals(scheduler.one_time_batch, [])
+
+    def test_batch_split_by_size(self):
+        scheduler = self.get_scheduler(0.05, 2)
+
+        for id in range(1, 6):
+            self.on_job_executed(scheduler, id)
+
+        scheduler.flush_job_batch()
+
+        # The last batch has one job only so it is sent as a regular message
+        self.assertEquals([msg['action'] for msg in self.invoked], [SCHEDULER_MSG.JOB_EXECUTED_BATCH.value] * 2 + [
+            SCHEDULER_MSG.JOB_EXECUTED.value])
+        self.assertEquals([msg['name'] for msg in self.invoked[0]['jobs']], ['job-1', 'job-2'])
+        self.assertEquals([msg['name'] for msg in self.invoked[1]['jobs']], ['job-3', 'job-4'])
+        self.assertEquals(self.invoked[2]['name'], 'job-5')
+        self.assertEquals(self.published, [])
+
+    def test_batch_of_one(self):
+        scheduler = self.get_scheduler(0.05)
+
+        self.on_job_executed(scheduler, 1, SCHEDULER.JOB_TYPE.ONE_TIME)
+        scheduler.flush_job_batch()
+
+        # A single execution is sent and deactivated the same way it would be without batching
+        self.assertEquals(len(self.invoked), 1)
+        self.assertEquals(self.invoked[0]['action'], SCHEDULER_MSG.JOB_EXECUTED.value)
+        self.assertEquals(self.invoked[0]['name'], 'job-1')
+        self.assertEquals(self.published[0]['service'], 'zato.scheduler.job.set-active-status')
+        self.assertEquals(self.published[0]['payload'], {'id':1, 'is_active':False})
+
+    def test_flush_empty(self):
+        scheduler = self.get_scheduler(0.05)
+        scheduler.flush_job_batch()
+
+        self.assertEquals(self.invoked, [])
+        self.assertEquals(self.published, [])
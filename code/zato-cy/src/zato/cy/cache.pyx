@@ -10,23 +10,26 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 import inspect
 from datetime import datetime
 from decimal import Decimal
-from sys import getsizeof, maxint
+from heapq import heapify, heappop, heappush
+from sys import getsizeof, maxint, maxunicode
 
 # Cython
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
-    PyDict_Values
+    PyDict_Size, PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
-from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
-from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
-from cpython.sequence cimport PySequence_ITEM
+from cpython.object cimport PyObject
 from libc.stdint cimport uint64_t
+from libc.stdlib cimport calloc, free
 from posix.time cimport timeval, timezone, gettimeofday
 
 # regex
 from regex import compile as re_compile
 
 # six
-from six import binary_type, integer_types, string_types, text_type
+from six import binary_type, int2byte, integer_types, string_types, text_type, unichr
+
+# sortedcontainers
+from sortedcontainers import SortedList
 
 # Zato
 from zato.common import CACHE as _COMMON_CACHE
@@ -45,6 +48,13 @@ key_types = len_values + integer_types
 class CACHE:
     DEFAULT_SIZE = _COMMON_CACHE.DEFAULT.MAX_SIZE
     MAX_ITEM_SIZE = _COMMON_CACHE.DEFAULT.MAX_ITEM_SIZE
+    MAX_TOTAL_SIZE = _COMMON_CACHE.DEFAULT.MAX_TOTAL_SIZE
+
+    # Minimum number of slots in the positional index, see Cache._rank_rebuild
+    RANK_MIN_CAPACITY = 1024
+
+    # How many stale items the expiry heap may have above the number of entries before it is compacted
+    EXPIRY_HEAP_MAX_STALE = 1024
 
 # ################################################################################################################################
 
@@ -54,6 +64,91 @@ class KeyExpiredError(KeyError):
 
 # ################################################################################################################################
 
+def _as_key_type(data, key_type):
+    """ Converts a pattern to the type of keys it will be compared with, using the same implicit ASCII coercion
+    that str.startswith and str.endswith use when keys and patterns are of different string types.
+    """
+    if isinstance(data, key_type):
+        return data
+    elif key_type is text_type:
+        return data.decode('ascii')
+    else:
+        return data.encode('ascii')
+
+# ################################################################################################################################
+
+def _get_prefix_upper_bound(prefix):
+    """ Returns the smallest string greater than all strings starting with the input prefix or None if there is no such string.
+    """
+    if isinstance(prefix, binary_type):
+        max_ord, to_char = 0xff, int2byte
+    else:
+        max_ord, to_char = maxunicode, unichr
+
+    while prefix:
+        last = ord(prefix[-1:])
+        if last < max_ord:
+            return prefix[:-1] + to_char(last + 1)
+        prefix = prefix[:-1]
+
+# ################################################################################################################################
+
+class KeyIndex(object):
+    """ Sorted indexes of string-like keys that let prefix and suffix lookups cost O(log n + matches) instead of a full scan.
+    Suffixes are looked up as prefixes of reversed keys. Each string type is kept in an index of its own
+    because the two types cannot always be compared with each other.
+    """
+    def __init__(self, keys=None):
+        self.by_prefix_index = {binary_type:SortedList(), text_type:SortedList()}
+        self.by_suffix_index = {binary_type:SortedList(), text_type:SortedList()}
+
+        for key in keys or []:
+            self.add(key)
+
+    def add(self, key):
+        key_type = binary_type if isinstance(key, binary_type) else text_type
+        self.by_prefix_index[key_type].add(key)
+        self.by_suffix_index[key_type].add(key[::-1])
+
+    def remove(self, key):
+        key_type = binary_type if isinstance(key, binary_type) else text_type
+        self.by_prefix_index[key_type].discard(key)
+        self.by_suffix_index[key_type].discard(key[::-1])
+
+    def clear(self):
+        for index in self.by_prefix_index.values() + self.by_suffix_index.values():
+            index.clear()
+
+    def _find(self, indexes, data):
+        out = []
+
+        for key_type, index in indexes.items():
+
+            # A pattern that cannot be converted could not have matched any of keys in that index anyway
+            try:
+                prefix = _as_key_type(data, key_type)
+            except UnicodeError:
+                continue
+
+            upper_bound = _get_prefix_upper_bound(prefix)
+            start = index.bisect_left(prefix)
+            stop = index.bisect_left(upper_bound) if upper_bound is not None else len(index)
+            out.extend(index[start:stop])
+
+        return out
+
+    def find_by_prefix(self, data):
+        """ Returns all keys starting with data.
+        """
+        return self._find(self.by_prefix_index, data)
+
+    def find_by_suffix(self, data):
+        """ Returns all keys ending with data.
+        """
+        return [key[::-1] for key in self._find(self.by_suffix_index, data[::-1])]
+
+# ################################################################################################################################
+
 cdef class Entry:
     """ Represents an individual value stored in a cache.
     """
@@ -84,9 +179,22 @@ cdef class Entry:
         # How many times was this key returned
         public uint64_t hits
 
+        # Approximate size of key and value in bytes
+        public long size
+
         # This entry's position in index
         public long position
 
+        # Neighbours in the cache's recency list - _prev is the more recently used one, _next is the less recently used one
+        Entry _prev
+        Entry _next
+
+        # Recency stamp of this entry in the positional index, the higher the stamp the more recently the entry was used
+        long _stamp
+
+        # Expiration time this entry is scheduled under in the expiry heap, 0.0 if it is not scheduled
+        double _scheduled_at
+
     cpdef dict to_dict(self):
         return {
             'key': self.key,
@@ -98,6 +206,7 @@ cdef class Entry:
             'expiry': self.expiry,
             'expires_at': self.expires_at,
             'hits': self.hits,
+            'size': self.size,
             'position': self.position,
         }
 
@@ -105,16 +214,39 @@ cdef class Entry:
 
 cdef class Cache(object):
     """ An LRU cache that optionally rejects entries bigger than N bytes. Entries can have a TTL assigned - periodic processes
-    will clean up entries older than allowed.
+    will clean up entries older than allowed. Optionally, the total size of all entries can be capped too,
+    in which case least recently used entries are evicted until the cache fits in its budget again.
+
+    If use_key_index is True, string-like keys are also kept in a KeyIndex to make *_by_prefix and *_by_suffix operations
+    independent of the cache's size. Regex and contains-like operations always scan all the keys.
+
+    Entries with a TTL are scheduled in a min-heap ordered by expiration time, so .delete_expired only looks at entries
+    that are due. Extending an entry's expiry does not touch the heap - when the entry is popped, it is simply scheduled again
+    under its new expiration time. Items of entries deleted in the meantime are recognised as stale and skipped.
+
+    Recency is kept in a doubly-linked list of entries, from self._head (most recently used) to self._tail (the next one
+    to be evicted), so moving a key to the head or evicting the oldest one never depends on how many keys there are.
+    Positions of keys, needed for statistics only, are read from a Fenwick tree of recency stamps in O(log n).
     """
     cdef:
         public long max_size
         public long max_item_size
         public bint has_max_item_size
+        public long max_total_size
+        public bint has_max_total_size
+        public long total_size   # Approximate size of all keys and values in bytes
+        public uint64_t evictions # How many entries were evicted to make room for new ones
+        public object _key_index  # A KeyIndex or None if prefix and suffix operations should scan all the keys
+        public list _expiry_heap  # (expires_at, sequence number, entry) tuples of entries with a TTL
+        uint64_t _expiry_seq      # Sequence number of the next item pushed to the heap, so that entries are never compared
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
         public dict _data
-        public list _index
+        Entry _head
+        Entry _tail
+        long *_rank_tree # A Fenwick tree, 1-based, counting live recency stamps
+        long _rank_cap   # How many stamps can be given out before the tree needs to be rebuilt
+        long _rank_next  # Next stamp to give out
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
@@ -127,32 +259,60 @@ cdef class Cache(object):
 
     def __cinit__(self):
         self._data = {}
-        self._index = []
+        self._head = None
+        self._tail = None
+        self._rank_tree = NULL
+        self._rank_cap = 0
+        self._rank_next = 0
         self.hits_per_position = {}
         self._expired_on_op = []
         self.hits = 0
         self.misses = 0
         self.set_ops = 0
         self.get_ops = 0
+        self.total_size = 0
+        self.evictions = 0
+        self._key_index = None
+        self._expiry_heap = []
+        self._expiry_seq = 0
         self._regex_cache = {}
 
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+    def __dealloc__(self):
+        free(self._rank_tree)
+
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True,
+            max_total_size=None, use_key_index=False, lock=None):
         self._lock = lock or RLock()
         self.default_get = object()
         with self._lock:
-            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
+            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_total_size,
+                use_key_index)
 
-    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set):
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_total_size,
+            use_key_index):
         self.max_size = max_size or CACHE.DEFAULT_SIZE
         self.max_item_size = max_item_size or CACHE.MAX_ITEM_SIZE
         self.has_max_item_size = self.max_item_size > 0
+        self.max_total_size = max_total_size or CACHE.MAX_TOTAL_SIZE
+        self.has_max_total_size = self.max_total_size > 0
         self.extend_expiry_on_get = extend_expiry_on_get
         self.extend_expiry_on_set = extend_expiry_on_set
         self.hits_per_position.update(dict((key, 0) for key in xrange(self.max_size)))
 
+        if use_key_index:
+            if self._key_index is None:
+                self._key_index = KeyIndex(key for key in self._data.iterkeys() if isinstance(key, str_types))
+        else:
+            self._key_index = None
+
+        # The budget may have been just lowered
+        if self.has_max_total_size:
+            self._evict_to_budget(None)
+
     def update_config(self, config):
         with self._lock:
-            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set)
+            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('max_total_size'), config.get('use_key_index'))
 
 # ################################################################################################################################
 
@@ -164,11 +324,11 @@ cdef class Cache(object):
             get_to_set_ops = (round(1.0 * self.get_ops / self.set_ops, 1)) if self.set_ops and self.get_ops else 'n/a'
             get_to_set_ops = ' ({})'.format(get_to_set_ops)
 
-            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}>'.format(
+            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}, total_size:{}/{}>'.format(
                 self.__class__.__name__, hex(id(self)), len(self._data), self.max_size,
                 self.hits, self.misses, hits_to_misses,
                 self.get_ops, self.set_ops, get_to_set_ops,
-                self.max_item_size
+                self.max_item_size, self.total_size, self.max_total_size
             )
 
 # ################################################################################################################################
@@ -181,7 +341,7 @@ cdef class Cache(object):
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return PyDict_Size(self._data)
 
 # ################################################################################################################################
 
@@ -198,8 +358,16 @@ cdef class Cache(object):
 # ################################################################################################################################
 
     cpdef list keys_by_position(self):
+        cdef list out = []
+        cdef Entry entry
+
         with self._lock:
-            return list(self._index)
+            entry = self._head
+            while entry is not None:
+                out.append(entry.key)
+                entry = entry._next
+
+        return out
 
 # ################################################################################################################################
 
@@ -228,11 +396,18 @@ cdef class Cache(object):
 # ################################################################################################################################
 
     def get_slice(self, start, stop, step):
+        cdef list entries = []
+        cdef Entry entry
+
         with self._lock:
-            for key in self._index[start:stop:step]:
-                entry = self._data[key]
-                as_dict = entry.to_dict()
-                as_dict['position'] = self._get_index(key)
+            entry = self._head
+            while entry is not None:
+                entries.append(entry)
+                entry = entry._next
+
+            for position in xrange(*slice(start, stop, step).indices(len(entries))):
+                as_dict = entries[position].to_dict()
+                as_dict['position'] = position
                 yield as_dict
 
 # ################################################################################################################################
@@ -241,24 +416,61 @@ cdef class Cache(object):
         """ Clears the cache - removes all entries and associated metadata.
         """
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
+        cdef Entry entry
+        cdef Entry next_entry
+        cdef long position
+
         with self._lock:
+
+            # Break links between entries explicitly so that the garbage collector does not need to find the cycles
+            entry = self._head
+            while entry is not None:
+                next_entry = entry._next
+                entry._prev = None
+                entry._next = None
+                entry = next_entry
+
+            self._head = None
+            self._tail = None
+
+            free(self._rank_tree)
+            self._rank_tree = NULL
+            self._rank_cap = 0
+            self._rank_next = 0
+
+            for position in range(self.max_size):
+                self.hits_per_position[position] = 0
+
             self._data.clear()
-            self._index[:] = []
-            self.hits_per_position.clear()
             self._expired_on_op[:] = []
+            self._expiry_heap = []
+            self._expiry_seq = 0
+
+            if self._key_index is not None:
+                self._key_index.clear()
+
             self.hits = 0
             self.misses = 0
             self.set_ops = 0
             self.get_ops = 0
+            self.total_size = 0
+            self.evictions = 0
 
 # ################################################################################################################################
 
     cdef object _delete(self, object key):
-        cdef object out = self._data[key].value # raise Will KeyError on invalid key so _remove_from_index_by_idx is safe to call
+        cdef Entry entry = <Entry>self._data[key] # Will raise KeyError on invalid key so _unlink is safe to call
         del self._data[key]
-        self._remove_from_index_by_idx(self._get_index(key))
+        self._unlink(entry)
+        self._rank_add(entry._stamp, -1)
+        self.total_size -= entry.size
+        entry._scheduled_at = 0.0
 
-        return out
+        if self._key_index is not None:
+            if isinstance(key, str_types):
+                self._key_index.remove(key)
+
+        return entry.value
 
 # ################################################################################################################################
 
@@ -278,21 +490,12 @@ cdef class Cache(object):
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._find_by_prefix(data):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -306,21 +509,12 @@ cdef class Cache(object):
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._find_by_suffix(data):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -484,38 +678,220 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cdef inline long _get_index(self, object key):
-        """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
+    cdef list _find_by_prefix(self, object data):
+        """ Returns all string-like keys starting with data. Must be called with self._lock held.
         """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
+        if self._key_index is not None:
+            return self._key_index.find_by_prefix(data)
 
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
-                return index_idx
-            index_idx += 1
+        return [key for key in self._data.iterkeys() if isinstance(key, str_types) and key.startswith(data)]
 
 # ################################################################################################################################
 
-    cpdef object index(self, object key):
-        """ Returns position the key given on input currently holds or None if key is not found.
+    cdef list _find_by_suffix(self, object data):
+        """ Returns all string-like keys ending with data. Must be called with self._lock held.
         """
-        with self._lock:
-            if PyDict_Contains(self._data, key):
-                return self._get_index(key)
+        if self._key_index is not None:
+            return self._key_index.find_by_suffix(data)
+
+        return [key for key in self._data.iterkeys() if isinstance(key, str_types) and key.endswith(data)]
+
+# ################################################################################################################################
+
+    cdef inline void _schedule_expiry(self, Entry entry) except *:
+        """ Makes sure that an entry whose expiration time has just been set will be looked at by .delete_expired
+        no later than at that time. Must be called with self._lock held.
+        """
+        # Nothing to do if the entry does not expire or if it is already scheduled at the same or an earlier time
+        if not entry.expires_at:
+            return
+
+        if entry._scheduled_at and entry._scheduled_at <= entry.expires_at:
+            return
+
+        # An item scheduled at a later time may be still in the heap, it will be skipped as stale when popped
+        entry._scheduled_at = entry.expires_at
+        heappush(self._expiry_heap, (entry.expires_at, self._expiry_seq, entry))
+        self._expiry_seq += 1
+
+        if len(self._expiry_heap) > PyDict_Size(self._data) + CACHE.EXPIRY_HEAP_MAX_STALE:
+            self._compact_expiry_heap()
+
+# ################################################################################################################################
+
+    cdef void _compact_expiry_heap(self) except *:
+        """ Rebuilds the expiry heap out of entries currently scheduled, dropping all stale items.
+        Must be called with self._lock held.
+        """
+        cdef list heap = []
+        cdef Entry entry
+
+        for expires_at, seq, entry in self._expiry_heap:
+            if entry._scheduled_at == expires_at:
+                heap.append((expires_at, seq, entry))
+
+        heapify(heap)
+        self._expiry_heap = heap
+
+# ################################################################################################################################
+
+    cdef inline void _link_head(self, Entry entry):
+        """ Makes an entry, not linked to any other one yet, the most recently used one. Must be called with self._lock held.
+        """
+        entry._prev = None
+        entry._next = self._head
+
+        if self._head is not None:
+            self._head._prev = entry
+        else:
+            self._tail = entry
+
+        self._head = entry
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, Entry entry):
+        """ Removes an entry from the recency list, joining its neighbours together. Must be called with self._lock held.
+        """
+        if entry._prev is not None:
+            entry._prev._next = entry._next
+        else:
+            self._head = entry._next
+
+        if entry._next is not None:
+            entry._next._prev = entry._prev
+        else:
+            self._tail = entry._prev
+
+        entry._prev = None
+        entry._next = None
+
+# ################################################################################################################################
+
+    cdef inline void _evict(self, Entry entry) except *:
+        """ Deletes an entry to make room for other ones. Must be called with self._lock held.
+        """
+        self._unlink(entry)
+        self._rank_add(entry._stamp, -1)
+        self.total_size -= entry.size
+        self.evictions += 1
+        entry._scheduled_at = 0.0
+        PyDict_DelItem(self._data, entry.key)
+
+        if self._key_index is not None:
+            if isinstance(entry.key, str_types):
+                self._key_index.remove(entry.key)
+
+# ################################################################################################################################
+
+    cdef void _evict_to_budget(self, Entry keep) except *:
+        """ Evicts least recently used entries until the total size of the cache is within its budget. The entry given
+        on input, if any, is the one that has just been written to and it is never evicted. Must be called with self._lock held.
+        """
+        cdef Entry victim
+
+        while self.total_size > self.max_total_size:
+            victim = self._tail
+
+            if victim is keep:
+                victim = victim._prev
+
+            if victim is None:
+                break
+
+            self._evict(victim)
+
+# ################################################################################################################################
+
+    cdef inline void _rank_add(self, long stamp, long delta):
+        """ Adds delta to the number of live entries holding a given recency stamp.
+        """
+        cdef long idx = stamp + 1
+
+        while idx <= self._rank_cap:
+            self._rank_tree[idx] += delta
+            idx += idx & -idx
+
+# ################################################################################################################################
+
+    cdef inline long _rank_prefix(self, long stamp):
+        """ Returns the number of live entries whose recency stamp is not greater than the one given on input.
+        """
+        cdef long idx = stamp + 1
+        cdef long out = 0
+
+        while idx > 0:
+            out += self._rank_tree[idx]
+            idx -= idx & -idx
+
+        return out
+
+# ################################################################################################################################
+
+    cdef void _rank_rebuild(self) except *:
+        """ Gives out new recency stamps, 0 to n-1, to all entries in the recency list and builds a new tree for them
+        with room for as many stamps again. Since at least n operations are needed to use up that room, the cost of rebuilding
+        is O(1) amortized per operation. Must be called with self._lock held.
+        """
+        cdef Entry entry = self._tail
+        cdef long stamp = 0
+        cdef long new_cap
+        cdef long idx
+        cdef long parent
+        cdef long *tree
+
+        new_cap = max(PyDict_Size(self._data) * 2, CACHE.RANK_MIN_CAPACITY)
+        tree = <long *>calloc(new_cap + 1, sizeof(long))
+
+        if tree is NULL:
+            raise MemoryError()
+
+        while entry is not None:
+            entry._stamp = stamp
+            tree[stamp + 1] = 1
+            stamp += 1
+            entry = entry._prev
+
+        # Linear-time construction - each node pushes its partial sum to its parent
+        for idx in range(1, new_cap + 1):
+            parent = idx + (idx & -idx)
+            if parent <= new_cap:
+                tree[parent] += tree[idx]
+
+        free(self._rank_tree)
+        self._rank_tree = tree
+        self._rank_cap = new_cap
+        self._rank_next = stamp
 
 # ################################################################################################################################
 
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+    cdef inline void _rank_push(self, Entry entry) except *:
+        """ Gives the newest recency stamp to an entry that has just been linked as head of the recency list
+        and is not counted in the tree yet. Must be called with self._lock held.
         """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
+        if self._rank_next >= self._rank_cap:
+            self._rank_rebuild()
+        else:
+            entry._stamp = self._rank_next
+            self._rank_next += 1
+            self._rank_add(entry._stamp, 1)
+
+# ################################################################################################################################
+
+    cdef inline long _get_position(self, Entry entry):
+        """ Returns position of an entry, 0 being the most recently used one. Must be called with self._lock held
+        and only for entries that are in the cache.
+        """
+        return PyDict_Size(self._data) - self._rank_prefix(entry._stamp)
+
+# ################################################################################################################################
 
-        return index_key
+    cpdef object index(self, object key):
+        """ Returns position the key given on input currently holds or None if key is not found.
+        """
+        with self._lock:
+            if PyDict_Contains(self._data, key):
+                return self._get_position(<Entry>PyDict_GetItem(self._data, key))
 
 # ################################################################################################################################
 
@@ -541,11 +917,8 @@ cdef class Cache(object):
         cdef object out = None
         cdef Entry entry
         cdef double _now = self._get_timestamp()
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
-        cdef long hits_per_position
         cdef long len_value
+        cdef long entry_size
 
         if not isinstance(key, _key_types):
             raise ValueError('Key must be an instance of one of {}'.format(key_types))
@@ -556,6 +929,12 @@ cdef class Cache(object):
                 if len_value > self.max_item_size:
                     raise ValueError('Value too long {} > {}'.format(len_value, self.max_item_size))
 
+        entry_size = _getsizeof(key) + _getsizeof(value)
+
+        if self.has_max_total_size:
+            if entry_size > self.max_total_size:
+                raise ValueError('Entry too big {} > {} bytes'.format(entry_size, self.max_total_size))
+
         # Update total # of .set operations
         self.set_ops += 1
 
@@ -568,6 +947,7 @@ cdef class Cache(object):
                 if expiry:
                     entry.expiry = expiry
                     entry.expires_at = _now + expiry
+                    self._schedule_expiry(entry)
             else:
                 # Mark as deleted an entry that has already expired
                 if _now >= entry.expires_at:
@@ -590,13 +970,15 @@ cdef class Cache(object):
             entry.last_write = _now
             out = entry.value
             entry.value = value
+            self.total_size += entry_size - entry.size
+            entry.size = entry_size
 
         # No such key in cache - let's add it.
         else:
 
             # Make sure there is room for the new key
-            if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+            while PyDict_Size(self._data) >= self.max_size:
+                self._evict(self._tail)
 
             # Actually insert entry
             entry = Entry()
@@ -607,11 +989,24 @@ cdef class Cache(object):
             entry.last_write = _now
             entry.prev_write = 0.0
             entry.hits = 0
+            entry.size = entry_size
             entry.expiry = expiry
             entry.expires_at = 0.0 if not expiry else _now + expiry
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._link_head(entry)
+            self._rank_push(entry)
+            self._schedule_expiry(entry)
+            self.total_size += entry_size
+
+            if self._key_index is not None:
+                if isinstance(key, str_types):
+                    self._key_index.add(key)
+
+        # Make sure the cache still fits in its memory budget, if there is one
+        if self.has_max_total_size:
+            if self.total_size > self.max_total_size:
+                self._evict_to_budget(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
@@ -636,16 +1031,18 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
+            for key in self._find_by_prefix(data):
+
+                # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                if not PyDict_Contains(self._data, key):
                     continue
-                if key.startswith(data):
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry.value
-                    self._set(key, value, expiry, None)
+
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry.value
+                self._set(key, value, expiry, None)
 
         return out
 
@@ -660,16 +1057,18 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
+            for key in self._find_by_suffix(data):
+
+                # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                if not PyDict_Contains(self._data, key):
                     continue
-                if key.endswith(data):
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry.value
-                    self._set(key, value, expiry, None)
+
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry.value
+                self._set(key, value, expiry, None)
 
         return out
 
@@ -685,10 +1084,14 @@ cdef class Cache(object):
         cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
 
         with self._lock:
-            for key in self._data.iterkeys():
+            for key in self._data.keys():
                 if not isinstance(key, str_types):
                     continue
                 if regex.match(key):
+                    # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                    if not PyDict_Contains(self._data, key):
+                        continue
+
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
                     if return_found:
@@ -709,10 +1112,14 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
+            for key in self._data.keys():
                 if not isinstance(key, str_types):
                     continue
                 if data in key:
+                    # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                    if not PyDict_Contains(self._data, key):
+                        continue
+
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
                     if return_found:
@@ -733,10 +1140,14 @@ cdef class Cache(object):
         cdef Entry entry
 
         with self._lock:
-            for key in self._data.iterkeys():
+            for key in self._data.keys():
                 if not isinstance(key, str_types):
                     continue
                 if data not in key:
+                    # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                    if not PyDict_Contains(self._data, key):
+                        continue
+
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
                     if return_found:
@@ -758,7 +1169,7 @@ cdef class Cache(object):
         cdef bint use_key
 
         with self._lock:
-            for key in self._data.iterkeys():
+            for key in self._data.keys():
                 if not isinstance(key, str_types):
                     continue
 
@@ -769,6 +1180,10 @@ cdef class Cache(object):
                         break
 
                 if use_key:
+                    # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                    if not PyDict_Contains(self._data, key):
+                        continue
+
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
                     if return_found:
@@ -790,7 +1205,7 @@ cdef class Cache(object):
         cdef bint use_key
 
         with self._lock:
-            for key in self._data.iterkeys():
+            for key in self._data.keys():
                 if not isinstance(key, str_types):
                     continue
 
@@ -801,6 +1216,10 @@ cdef class Cache(object):
                         break
 
                 if use_key:
+                    # An earlier key's update may have evicted this one to keep the cache within its memory budget
+                    if not PyDict_Contains(self._data, key):
+                        continue
+
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
                     if return_found:
@@ -818,9 +1237,8 @@ cdef class Cache(object):
         """
         cdef object _item
         cdef Entry entry
-        cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
+        cdef long index_idx
+        cdef long hits_per_position
         cdef double _now = self._get_timestamp()
 
         try:
@@ -849,7 +1267,7 @@ cdef class Cache(object):
             self.hits += 1
 
             # Current position of that key in index
-            index_idx = self._get_index(key)
+            index_idx = self._get_position(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
@@ -857,11 +1275,12 @@ cdef class Cache(object):
             hits_per_position += 1
             PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
 
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
-
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
+            # Move the entry to the head position unless it already is there
+            if entry is not self._head:
+                self._unlink(entry)
+                self._link_head(entry)
+                self._rank_add(entry._stamp, -1)
+                self._rank_push(entry)
 
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
@@ -900,11 +1319,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    out[key] = self._get(key, self.default_get, details)
+            for key in self._find_by_prefix(data):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -918,11 +1334,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    out[key] = self._get(key, self.default_get, details)
+            for key in self._find_by_suffix(data):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1064,12 +1477,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
+            for key in self._find_by_prefix(data):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1082,12 +1492,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for key in self._data.iterkeys():
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
+            for key in self._find_by_suffix(data):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1223,6 +1630,7 @@ cdef class Cache(object):
                 if expires_at > entry.expires_at:
                     entry.expiry = expiry
                     entry.expires_at = expires_at
+                    self._schedule_expiry(entry)
 
 # ################################################################################################################################
 
@@ -1230,22 +1638,37 @@ cdef class Cache(object):
         """ Deletes all entries expired as of now. Also, deletes all entries possibly found to have expired by .get or .set calls.
         """
         cdef list deleted
+        cdef list heap
         cdef double _now = self._get_timestamp()
-        cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef double scheduled_at
+        cdef Entry entry
 
         with self._lock:
 
             deleted = self._expired_on_op[:]
+            heap = self._expiry_heap
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
-                    self._delete(key)
-                    deleted.append(key)
+            # Visit only entries that were scheduled to expire by now
+            while heap and heap[0][0] <= _now:
+                scheduled_at, _, entry = heappop(heap)
+
+                # The entry was deleted or scheduled at an earlier time in the meantime
+                if entry._scheduled_at != scheduled_at:
+                    continue
+
+                # Expiry was reset so the entry will not expire at all
+                if not entry.expires_at:
+                    entry._scheduled_at = 0.0
+
+                # Expiry was extended after the entry had been scheduled, put it back under its new expiration time
+                elif entry.expires_at > _now:
+                    entry._scheduled_at = entry.expires_at
+                    heappush(heap, (entry.expires_at, self._expiry_seq, entry))
+                    self._expiry_seq += 1
+
+                else:
+                    self._delete(entry.key)
+                    deleted.append(entry.key)
 
             # Collect keys deleted by .get operations
             self._expired_on_op[:] = []
@@ -14,6 +14,9 @@ from logging import getLogger
 from operator import itemgetter
 from uuid import uuid4
 
+# Cython
+from libc.stdint cimport uint64_t
+
 # regex
 from regex import compile as re_compile
 
@@ -31,10 +34,158 @@ logger = getLogger(__name__)
 TRACE1 = 6
 target_separator = ':::'
 
+# How many URL paths and targets to keep in each of CyURLData's caches by default, 0 = no limit
+default_url_cache_max_size = 10000
+
 # ################################################################################################################################
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# Characters that have a special meaning in patterns of match targets - the literal part of each pattern,
+# by which it is indexed in URLRouter, ends right before the first of them.
+_pattern_special = set('{}.^$*+?()[]\\|')
+
+# These ones make the preceding character optional so the literal part cannot include it either,
+# unless it is a curly bracket that starts a variable.
+_pattern_optional = set('{?*')
+
+# Matches variables in patterns, e.g. {user_id}
+_var_pattern = re_compile('\{[a-zA-Z0-9 _\$.\-|=~^\/]+\}')
+
+_first = itemgetter(0)
+
+# ################################################################################################################################
+
+cdef class _LRUEntry(object):
+    cdef:
+        public object key
+        public object value
+        _LRUEntry prev
+        _LRUEntry next
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+# ################################################################################################################################
+
+cdef class LRUCache(object):
+    """ A dictionary-like cache of up to max_size entries. Once it is full, each new entry evicts the least recently used one.
+    Keeps counters of hits, misses and evictions.
+    """
+    cdef:
+        dict _data
+        _LRUEntry _head
+        _LRUEntry _tail
+        public Py_ssize_t max_size
+        public uint64_t hits
+        public uint64_t misses
+        public uint64_t evictions
+
+    def __init__(self, Py_ssize_t max_size=default_url_cache_max_size):
+        self._data = {}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __str__(self):
+        return '<{} at {}, size:{}/{}, hits/misses:{}/{}, evictions:{}>'.format(self.__class__.__name__, hex(id(self)),
+            len(self._data), self.max_size, self.hits, self.misses, self.evictions)
+
+    __repr__ = __str__
+
+# ################################################################################################################################
+
+    cdef _unlink(self, _LRUEntry entry):
+        if entry.prev is not None:
+            entry.prev.next = entry.next
+        else:
+            self._head = entry.next
+
+        if entry.next is not None:
+            entry.next.prev = entry.prev
+        else:
+            self._tail = entry.prev
+
+        entry.prev = entry.next = None
+
+    cdef _link_head(self, _LRUEntry entry):
+        entry.next = self._head
+        if self._head is not None:
+            self._head.prev = entry
+        self._head = entry
+
+        if self._tail is None:
+            self._tail = entry
+
+# ################################################################################################################################
+
+    cpdef get(self, key, default=None):
+        """ Returns a value stored under a given key, making it the most recently used one, or default if there is no such key.
+        """
+        cdef _LRUEntry entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        if entry is not self._head:
+            self._unlink(entry)
+            self._link_head(entry)
+
+        return entry.value
+
+# ################################################################################################################################
+
+    cpdef set(self, key, value):
+        """ Stores a value under a given key, evicting the least recently used entry if the cache is full.
+        """
+        cdef _LRUEntry entry = self._data.get(key)
+
+        if entry is not None:
+            entry.value = value
+            self._unlink(entry)
+        else:
+            if self.max_size > 0 and len(self._data) >= self.max_size:
+                del self._data[self._tail.key]
+                self._unlink(self._tail)
+                self.evictions += 1
+
+            entry = _LRUEntry(key, value)
+            self._data[key] = entry
+
+        self._link_head(entry)
+
+# ################################################################################################################################
+
+    cpdef pop(self, key, default=None):
+        """ Removes a given key and returns its value or default if there is no such key.
+        """
+        cdef _LRUEntry entry = self._data.pop(key, None)
+
+        if entry is None:
+            return default
+
+        self._unlink(entry)
+        return entry.value
+
+# ################################################################################################################################
+
+    cpdef clear(self):
+        """ Removes all entries and resets counters.
+        """
+        self._data.clear()
+        self._head = self._tail = None
+        self.hits = self.misses = self.evictions = 0
+
 # ################################################################################################################################
 
 cdef class Matcher(object):
@@ -99,47 +250,252 @@ cdef class Matcher(object):
 
 # ################################################################################################################################
 
+cdef class _RouterNode(object):
+    """ A node in URLRouter's radix tree - keeps channel items whose literal parts of patterns end exactly at this node.
+    """
+    cdef:
+        public unicode label
+        public dict children
+        public list items
+
+    def __init__(self, unicode label):
+        self.label = label
+        self.children = {}
+        self.items = []
+
+# ################################################################################################################################
+
+cdef unicode get_literal_prefix(unicode pattern):
+    """ Returns the literal part of a match target's pattern - any target matched by the pattern will start with it.
+    """
+    cdef Py_ssize_t idx
+
+    # A top-level alternative may match anything so there is no literal part to speak of
+    if '|' in _var_pattern.sub('', pattern):
+        return ''
+
+    for idx, char in enumerate(pattern):
+        if char in _pattern_special:
+            if char in _pattern_optional and idx and not _var_pattern.match(pattern, idx):
+                idx -= 1
+            return pattern[:idx]
+
+    return pattern
+
+# ################################################################################################################################
+
+cdef class URLRouter(object):
+    """ A radix tree of channel items keyed by the literal parts of their patterns. Walking it along a target yields,
+    in O(target length), only the channels whose patterns can possibly match it, both static and with variables.
+    Each candidate is confirmed by its Matcher, in the order of channel_data, so the results are the same as if
+    the whole of channel_data was scanned.
+    """
+    cdef:
+        public _RouterNode root
+        public dict positions
+        public dict bunches
+        public Py_ssize_t size
+
+    def __init__(self, channel_data=None):
+        self.root = _RouterNode('')
+        self.positions = {}
+        self.bunches = {}
+        self.size = 0
+
+        if channel_data:
+            self.build(channel_data)
+
+# ################################################################################################################################
+
+    cpdef build(self, channel_data):
+        """ Builds the whole tree out of channel items given on input.
+        """
+        self.root = _RouterNode('')
+        self.bunches = {}
+        self.size = 0
+
+        for item in channel_data:
+            self.add(item)
+
+        self.set_positions(channel_data)
+
+# ################################################################################################################################
+
+    cpdef set_positions(self, channel_data):
+        """ Stores indexes of channel items in channel_data, which is the order candidates are tried in.
+        """
+        self.positions = dict([(id(item), idx) for idx, item in enumerate(channel_data)])
+
+# ################################################################################################################################
+
+    cpdef add(self, dict item):
+        """ Adds a channel item to the tree, splitting existing edges as needed.
+        """
+        cdef unicode key = get_literal_prefix(item.get('match_target') or '')
+        cdef unicode label
+        cdef Py_ssize_t pos = 0, idx, max_idx, key_len = len(key)
+        cdef _RouterNode node = self.root, child, middle
+
+        while pos < key_len:
+            child = node.children.get(key[pos])
+
+            # Nothing shares this part of the key yet
+            if child is None:
+                child = _RouterNode(key[pos:])
+                node.children[key[pos]] = child
+                node = child
+                break
+
+            # How much of the edge leading to child is shared with the rest of the key
+            label = child.label
+            max_idx = min(len(label), key_len - pos)
+            idx = 1
+            while idx < max_idx and label[idx] == key[pos + idx]:
+                idx += 1
+
+            # Only a part of the edge is shared - split it in two
+            if idx < len(label):
+                middle = _RouterNode(label[:idx])
+                child.label = label[idx:]
+                middle.children[child.label[0]] = child
+                node.children[key[pos]] = middle
+                child = middle
+
+            node = child
+            pos += idx
+
+        node.items.append(item)
+        self.size += 1
+
+# ################################################################################################################################
+
+    cpdef remove(self, dict item):
+        """ Removes a channel item from the tree, along with any nodes that no longer lead to any items.
+        """
+        cdef unicode key = get_literal_prefix(item.get('match_target') or '')
+        cdef Py_ssize_t pos = 0, idx, key_len = len(key)
+        cdef _RouterNode node = self.root, child
+        cdef list path = []
+
+        while pos < key_len:
+            child = node.children.get(key[pos])
+            if child is None or not key.startswith(child.label, pos):
+                return
+            path.append(node)
+            node = child
+            pos += len(child.label)
+
+        for idx, elem in enumerate(node.items):
+            if elem is item:
+                del node.items[idx]
+                self.bunches.pop(id(item), None)
+                self.size -= 1
+                break
+        else:
+            return
+
+        # Prune leaves that are of no use anymore
+        while path and not node.items and not node.children:
+            parent = path.pop()
+            del parent.children[node.label[0]]
+            node = parent
+
+# ################################################################################################################################
+
+    cpdef get_bunch(self, dict item, _bunchify=bunchify):
+        """ Returns a channel item as a Bunch, creating it only the first time a given item is asked for.
+        """
+        cdef tuple value = self.bunches.get(id(item))
+
+        # Checking identity too makes sure an id of an item no longer in the router is never mistaken for another one's
+        if value is None or value[0] is not item:
+            value = (item, _bunchify(item))
+            self.bunches[id(item)] = value
+
+        return value[1]
+
+# ################################################################################################################################
+
+    cpdef list get_candidates(self, unicode target):
+        """ Returns all channel items whose patterns may match the target, in the order of channel_data.
+        """
+        cdef Py_ssize_t pos = 0, target_len = len(target)
+        cdef _RouterNode node = self.root, child
+        cdef list out = []
+        cdef dict positions = self.positions
+
+        while True:
+            if node.items:
+                out.extend(node.items)
+
+            if pos >= target_len:
+                break
+
+            child = node.children.get(target[pos])
+            if child is None or not target.startswith(child.label, pos):
+                break
+
+            node = child
+            pos += len(child.label)
+
+        # Candidates come from different nodes so they need to be put in the order of channel_data again
+        if len(out) > 1:
+            max_position = len(positions)
+            out = [elem[1] for elem in sorted([(positions.get(id(item), max_position), item) for item in out], key=_first)]
+
+        return out
+
+
+# ################################################################################################################################
+
 cdef class CyURLData(object):
 
     cdef:
         public list channel_data
-        public dict url_path_cache
-        dict url_target_cache
+        public LRUCache url_path_cache
+        public LRUCache url_target_cache
         bint has_trace1
+        public URLRouter router
 
-    def __init__(self, channel_data=None):
+    def __init__(self, channel_data=None, url_cache_max_size=default_url_cache_max_size):
         self.channel_data = channel_data
-        self.url_path_cache = {}
-        self.url_target_cache = {}
+        self.url_path_cache = LRUCache(url_cache_max_size)
+        self.url_target_cache = LRUCache(url_cache_max_size)
         self.has_trace1 = logger.isEnabledFor(TRACE1)
+        self.router = URLRouter(channel_data)
 
 # ################################################################################################################################
 
     cpdef tuple match(self, unicode url_path, unicode soap_action, bint has_soap_action,
-        unicode _target_separator=target_separator, _bunchify=bunchify, _log_trace1=logger.log, _trace1=TRACE1):
+        unicode _target_separator=target_separator, _log_trace1=logger.log, _trace1=TRACE1):
         """ Attemps to match the combination of SOAPt Action and URL path against
         the list of HTTP channel targets.
         """
         cdef bint needs_user, has_target_in_cache=True
         cdef Matcher matcher
         cdef dict item
+        cdef list channel_data = self.channel_data
         cdef object item_bunch
         cdef unicode target
         cdef unicode target_cache_key = (url_path + soap_action) if has_soap_action else url_path
 
-        try:
-            target = self.url_target_cache[target_cache_key]
-        except KeyError:
+        target = self.url_target_cache.get(target_cache_key)
+        if target is None:
             target = '%s%s%s' % (soap_action, _target_separator, url_path)
             has_target_in_cache = False
 
         # Return from cache if already seen
-        try:
-            return {}, self.url_path_cache[target]
-        except KeyError:
+        item_bunch = self.url_path_cache.get(target)
+        if item_bunch is not None:
+            return {}, item_bunch
+        else:
             needs_user = not url_path.startswith('/zato')
 
-            for item in self.channel_data:
+            # Items may have been added to or removed from channel_data directly rather than through the router
+            if self.router.size != len(channel_data):
+                self.router.build(channel_data)
+
+            for item in self.router.get_candidates(target):
                 matcher = item['match_target_compiled']
                 if needs_user and matcher.is_internal:
                     continue
@@ -151,13 +507,13 @@ cdef class CyURLData(object):
 
                     # Cache that target but only if it's a static URL without dynamic variables
                     if (not has_target_in_cache) and matcher.is_static:
-                        self.url_target_cache[target_cache_key] = target
+                        self.url_target_cache.set(target_cache_key, target)
 
-                    item_bunch = _bunchify(item)
+                    item_bunch = self.router.get_bunch(item)
 
                     # Cache that URL if it's a static one, i.e. does not contain dynamically computed variables
                     if matcher.is_static:
-                        self.url_path_cache[target] = item_bunch
+                        self.url_path_cache.set(target, item_bunch)
 
                     return match, item_bunch
 
@@ -189,7 +545,8 @@ cdef class CyURLData(object):
                 url_path = '/zato/{}/{}'.format(prefix, str(uuid4()).replace('-', '/'))
                 channel_data.append(self.get_item(url_path, soap_action))
 
-        self.channel_data = tuple(sorted(channel_data, key=itemgetter('name')))
+        self.channel_data = sorted(channel_data, key=itemgetter('name'))
+        self.router.build(self.channel_data)
 
 # ################################################################################################################################
 
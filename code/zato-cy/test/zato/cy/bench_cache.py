@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures latency of .get and .set in a full cache of a growing size - with LRU bookkeeping that does not depend
+# on how many keys there are, the numbers should stay flat from 1k to 1M entries. Run as: python bench_cache.py [ops]
+
+# stdlib
+import sys
+from random import randint
+from timeit import default_timer
+
+# Zato
+from zato.cache import Cache
+
+# ################################################################################################################################
+
+sizes = (1000, 10000, 100000, 1000000)
+
+# ################################################################################################################################
+
+def bench(max_size, ops):
+
+    c = Cache(max_size)
+    keys = ['key{}'.format(idx) for idx in xrange(max_size)]
+
+    # Fill the cache up so that each further .set of a new key evicts the least recently used one
+    for key in keys:
+        c.set(key, key, 0.0, None)
+
+    # Random reads move keys from anywhere in the cache to the head position
+    to_get = [keys[randint(0, max_size - 1)] for idx in xrange(ops)]
+    start = default_timer()
+    for key in to_get:
+        c.get(key, None, False)
+    get_latency = (default_timer() - start) / ops
+
+    to_set = ['new-key{}'.format(idx) for idx in xrange(ops)]
+    start = default_timer()
+    for key in to_set:
+        c.set(key, key, 0.0, None)
+    set_latency = (default_timer() - start) / ops
+
+    return get_latency, set_latency
+
+# ################################################################################################################################
+
+def main(ops):
+    print('{:>10} {:>12} {:>12}'.format('max_size', 'get [us]', 'set [us]'))
+    for max_size in sizes:
+        get_latency, set_latency = bench(max_size, ops)
+        print('{:>10} {:>12.3f} {:>12.3f}'.format(max_size, get_latency * 1e6, set_latency * 1e6))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+
+# ################################################################################################################################
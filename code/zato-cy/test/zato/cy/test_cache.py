@@ -480,4 +480,235 @@ class CacheTestCace(TestCase):
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_positions_follow_recency(self):
+
+        # More keys and operations than the initial capacity of the positional index so that it is rebuilt a few times
+        max_size = 1500
+        c = Cache(max_size)
+
+        # A list-based model of positions, most recently used key first
+        expected = []
+
+        for idx in range(3000):
+            key = 'key{}'.format(idx)
+            c.set(key, idx, 0.0, None)
+            expected.insert(0, key)
+            del expected[max_size:]
+
+            # Every third time, read a key from the middle of the index
+            if idx % 3 == 0:
+                key = expected[len(expected) // 2]
+                c.get(key, None, False)
+                expected.remove(key)
+                expected.insert(0, key)
+
+        self.assertEquals(len(c), max_size)
+        self.assertListEqual(c.keys_by_position(), expected)
+
+        for position, key in enumerate(expected):
+            self.assertEquals(c.index(key), position)
+
+        positions = [item['position'] for item in c.get_slice(10, 20, 2)]
+        keys = [item['key'] for item in c.get_slice(10, 20, 2)]
+
+        self.assertListEqual(positions, [10, 12, 14, 16, 18])
+        self.assertListEqual(keys, expected[10:20:2])
+
+# ################################################################################################################################
+
+    def test_clear_resets_positions(self):
+
+        c = Cache(2)
+        c.set('key1', 'value1', 0.0, None)
+        c.set('key2', 'value2', 0.0, None)
+        c.get('key1', None, False)
+
+        c.clear()
+
+        self.assertEquals(len(c), 0)
+        self.assertListEqual(c.keys_by_position(), [])
+        self.assertEquals(c.hits_per_position[0], 0)
+        self.assertEquals(c.hits_per_position[1], 0)
+
+        c.set('key3', 'value3', 0.0, None)
+        c.get('key3', None, False)
+
+        self.assertEquals(c.index('key3'), 0)
+        self.assertEquals(c.hits_per_position[0], 1)
+
+# ################################################################################################################################
+
+    def test_max_total_size_evicts_lru(self):
+
+        value = 'a' * 100
+        entry_size = sys.getsizeof('key1') + sys.getsizeof(value)
+
+        # Room for three entries only
+        c = Cache(max_item_size=1000, max_total_size=entry_size * 3)
+
+        c.set('key1', value, 0.0, None)
+        c.set('key2', value, 0.0, None)
+        c.set('key3', value, 0.0, None)
+
+        self.assertEquals(c.total_size, entry_size * 3)
+        self.assertEquals(c.evictions, 0)
+
+        # Reading key1 makes key2 the least recently used one so this is the one to be evicted
+        c.get('key1', None, False)
+        c.set('key4', value, 0.0, None)
+
+        self.assertEquals(len(c), 3)
+        self.assertNotIn('key2', c)
+        self.assertEquals(c.total_size, entry_size * 3)
+        self.assertEquals(c.evictions, 1)
+
+        c.delete('key4')
+        self.assertEquals(c.total_size, entry_size * 2)
+
+        c.clear()
+        self.assertEquals(c.total_size, 0)
+        self.assertEquals(c.evictions, 0)
+
+# ################################################################################################################################
+
+    def test_max_total_size_update_keeps_written_entry(self):
+
+        small, big = 'a' * 10, 'b' * 500
+        c = Cache(max_item_size=1000, max_total_size=sys.getsizeof('key1') + sys.getsizeof(big) + 10)
+
+        c.set('key1', small, 0.0, None)
+        c.set('key2', small, 0.0, None)
+
+        # key1 is the least recently used one but it is the one being written to, so key2 must go instead
+        c.set('key1', big, 0.0, None)
+
+        self.assertListEqual(c.keys(), ['key1'])
+        self.assertEquals(c.get('key1', None, False), big)
+        self.assertEquals(c.evictions, 1)
+
+# ################################################################################################################################
+
+    def test_max_total_size_entry_too_big(self):
+
+        c = Cache(max_item_size=1000, max_total_size=100)
+        self.assertRaises(ValueError, c.set, 'key1', 'a' * 200, 0.0, None)
+        self.assertEquals(len(c), 0)
+        self.assertEquals(c.total_size, 0)
+
+# ################################################################################################################################
+
+    def test_max_total_size_set_many_evicts_matched_keys(self):
+
+        small, big = 'a' * 10, 'b' * 500
+        max_total_size = sys.getsizeof('key1') + sys.getsizeof(big) + 10
+
+        for use_key_index in False, True:
+            for func_name, data in (('set_by_prefix', 'key'), ('set_by_suffix', '1'), ('set_contains', 'ey')):
+
+                c = Cache(max_item_size=1000, max_total_size=max_total_size, use_key_index=use_key_index)
+
+                for key in 'key1', 'key2', 'key3', 'key11':
+                    c.set(key, small, 0.0, None)
+
+                # Each key written to evicts all the other ones, including the matched ones that were not written to yet
+                out = getattr(c, func_name)(data, big, 0.0, True)
+
+                self.assertEquals(len(c), 1)
+                self.assertEquals(out.keys(), c.keys())
+                self.assertEquals(c.get(c.keys()[0], None, False), big)
+
+# ################################################################################################################################
+
+    def test_key_index_prefix_suffix(self):
+
+        mixed_keys = ['user-1-a', 'user-1-b', 'user-12-a', u'user-1-c', 'user-2-a', 'abd', 123, u'user-1']
+        bytes_keys = ['user-1-a', 'abc\xff', 'abc\xff\xff', 'abd\xff', 'ab', 123]
+
+        # Prefix and suffix lookups must return the same results with and without an index
+        for keys, prefix, suffix in (
+            (mixed_keys, 'user-1', '-a'),
+            (mixed_keys, u'user-1-', u'a'),
+            (mixed_keys, '', ''),
+            (mixed_keys, 'zzz', 'zzz'),
+            (bytes_keys, 'abc\xff', '\xff'),
+            (bytes_keys, 'ab', 'b'),
+            ):
+
+            c1 = Cache(use_key_index=False)
+            c2 = Cache(use_key_index=True)
+
+            for c in c1, c2:
+                for key in keys:
+                    c.set(key, key, 0.0, None)
+
+            self.assertEquals(c1.get_by_prefix(prefix, False), c2.get_by_prefix(prefix, False))
+            self.assertEquals(c1.get_by_suffix(suffix, False), c2.get_by_suffix(suffix, False))
+            self.assertEquals(c1.set_by_prefix(prefix, 'new', 0.0, True), c2.set_by_prefix(prefix, 'new', 0.0, True))
+            self.assertEquals(c1.expire_by_suffix(suffix, 10.0), c2.expire_by_suffix(suffix, 10.0))
+            self.assertEquals(c1.delete_by_suffix(suffix, True), c2.delete_by_suffix(suffix, True))
+            self.assertEquals(c1.delete_by_prefix(prefix, True), c2.delete_by_prefix(prefix, True))
+            self.assertEquals(sorted(c1.keys()), sorted(c2.keys()))
+
+        self.assertEquals(sorted(Cache(use_key_index=True).get_by_prefix('user', False)), [])
+
+# ################################################################################################################################
+
+    def test_key_index_follows_deletes_and_evictions(self):
+
+        c = Cache(max_size=2, use_key_index=True)
+        c.set('user-1', 1, 0.0, None)
+        c.set('user-2', 2, 0.0, None)
+        c.set('user-3', 3, 0.0, None) # Evicts user-1
+
+        self.assertEquals(c.get_by_prefix('user-', False), {'user-2':2, 'user-3':3})
+
+        c.delete('user-2')
+        self.assertEquals(c.get_by_prefix('user-', False), {'user-3':3})
+
+        c.clear()
+        self.assertEquals(c.get_by_prefix('user-', False), {})
+
+# ################################################################################################################################
+
+    def test_delete_expired_rescheduled_entries(self):
+
+        c = Cache(extend_expiry_on_get=True)
+        c.set('key1', 'value1', 0.1, None)  # Will be extended by .get below
+        c.set('key2', 'value2', 0.1, None)  # Will have its expiry reset
+        c.set('key3', 'value3', 0.1, None)  # Will expire
+        c.set('key4', 'value4', 0.0, None)  # Never expires but will have an expiry set later on
+        c.set('key5', 'value5', 10.0, None) # Is not due yet
+
+        sleep(0.06)
+        c.get('key1', None, False)
+        c.set('key2', 'value2', 0.0, None)
+        c.expire('key4', 0.03, None)
+
+        sleep(0.06)
+
+        # At this point, key1 was extended, key2 does not expire and key5 is still not due
+        self.assertEquals(sorted(c.delete_expired()), ['key3', 'key4'])
+        self.assertEquals(sorted(c.keys()), ['key1', 'key2', 'key5'])
+
+        sleep(0.06)
+        self.assertEquals(c.delete_expired(), ['key1'])
+        self.assertEquals(sorted(c.keys()), ['key2', 'key5'])
+
+# ################################################################################################################################
+
+    def test_expiry_heap_stale_items_compacted(self):
+
+        c = Cache()
+
+        # Each key is deleted right after it is added so its item in the expiry heap becomes stale
+        for idx in range(10000):
+            key = 'key{}'.format(idx)
+            c.set(key, idx, 60.0, None)
+            c.delete(key)
+
+        self.assertLessEqual(len(c._expiry_heap), 1025)
+        self.assertListEqual(c.delete_expired(), [])
+
 # ################################################################################################################################
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Zato
+from zato.url_dispatcher import CyURLData, LRUCache, Matcher, target_separator, URLRouter
+
+# ################################################################################################################################
+
+def get_item(name, url_path, soap_action=''):
+    match_target = '{}{}{}'.format(soap_action, target_separator, url_path)
+    return {
+        'name': name,
+        'match_target': match_target,
+        'match_target_compiled': Matcher(match_target),
+    }
+
+# ################################################################################################################################
+
+def linear_match(channel_data, url_path, soap_action=''):
+    """ Matches a path the way CyURLData did before it had a router, by trying each channel in turn.
+    """
+    target = '{}{}{}'.format(soap_action, target_separator, url_path)
+    for item in channel_data:
+        match = item['match_target_compiled'].matcher.match(target)
+        if match:
+            return match.groupdict(), item['name']
+    return None, None
+
+# ################################################################################################################################
+
+class URLRouterTestCase(TestCase):
+
+    def get_channel_data(self):
+        return [
+            get_item('a1', '/api/customer/{cid}'),
+            get_item('a2', '/api/customer/{cid}/order/{oid}'),
+            get_item('a3', '/api/customer/list'),
+            get_item('a4', '/api/order/{oid}'),
+            get_item('a5', '/api/v1.0/status'),
+            get_item('a6', '/api/file.{ext}'),
+            get_item('a7', '/static/page'),
+            get_item('a8', '/api/customer/{cid}', 'my-soap-action'),
+            get_item('a9', '/colou?r'),
+            get_item('a10', '/alt/one|:::/alt/two'),
+        ]
+
+# ################################################################################################################################
+
+    def test_match_same_as_linear_scan(self):
+        channel_data = self.get_channel_data()
+        url_data = CyURLData(channel_data)
+
+        paths = [
+            ('/api/customer/123', ''),
+            ('/api/customer/123/order/456', ''),
+            ('/api/customer/list', ''),
+            ('/api/order/789', ''),
+            ('/api/v1.0/status', ''),
+            ('/api/v1x0/status', ''),
+            ('/api/file.json', ''),
+            ('/static/page', ''),
+            ('/static/page/no', ''),
+            ('/api/customer/123', 'my-soap-action'),
+            ('/color', ''),
+            ('/colour', ''),
+            ('/alt/two', ''),
+            ('/not/there', ''),
+            ('/', ''),
+        ]
+
+        for url_path, soap_action in paths:
+            expected_match, expected_name = linear_match(channel_data, url_path, soap_action)
+            match, item = url_data.match(url_path, soap_action, bool(soap_action))
+
+            self.assertEquals(match, expected_match, url_path)
+            self.assertEquals(item.name if item else None, expected_name, url_path)
+
+# ################################################################################################################################
+
+    def test_candidates_follow_channel_data_order(self):
+        channel_data = self.get_channel_data()
+        router = URLRouter(channel_data)
+
+        target = '{}/api/customer/list'.format(target_separator)
+        names = [item['name'] for item in router.get_candidates(target)]
+
+        # '/api/customer/{cid}' is earlier in channel_data so it is tried first, just like in a linear scan.
+        # Patterns with alternatives have no literal part so they are always among candidates.
+        self.assertEquals(names, ['a1', 'a2', 'a3', 'a10'])
+
+        # Changing the order of channel_data changes the order of candidates
+        channel_data.reverse()
+        router.set_positions(channel_data)
+
+        names = [item['name'] for item in router.get_candidates(target)]
+        self.assertEquals(names, ['a10', 'a3', 'a2', 'a1'])
+
+# ################################################################################################################################
+
+    def test_add_remove(self):
+        channel_data = self.get_channel_data()
+        router = URLRouter(channel_data)
+        size = router.size
+
+        target = '{}/api/invoice/1'.format(target_separator)
+        self.assertEquals([elem['name'] for elem in router.get_candidates(target)], ['a10'])
+
+        item = get_item('b1', '/api/invoice/{iid}')
+        channel_data.append(item)
+        router.add(item)
+        router.set_positions(channel_data)
+
+        self.assertEquals(router.size, size + 1)
+        self.assertEquals([elem['name'] for elem in router.get_candidates(target)], ['a10', 'b1'])
+
+        router.remove(item)
+        self.assertEquals(router.size, size)
+        self.assertEquals([elem['name'] for elem in router.get_candidates(target)], ['a10'])
+
+        # Removing an item that is not in the router is a no-op
+        router.remove(item)
+        self.assertEquals(router.size, size)
+
+        # All the other items can still be found
+        for item in channel_data[:-1]:
+            router.remove(item)
+
+        self.assertEquals(router.size, 0)
+        self.assertEquals(router.root.children, {})
+
+# ################################################################################################################################
+
+    def test_channel_data_changed_directly(self):
+        url_data = CyURLData([])
+
+        match, item = url_data.match('/api/customer/123', '', False)
+        self.assertIsNone(match)
+
+        url_data.channel_data.append(get_item('c1', '/api/customer/{cid}'))
+
+        match, item = url_data.match('/api/customer/123', '', False)
+        self.assertEquals(match, {'cid': '123'})
+        self.assertEquals(item.name, 'c1')
+
+# ################################################################################################################################
+
+    def test_item_bunch_created_once(self):
+        url_data = CyURLData([get_item('d1', '/api/customer/{cid}')])
+
+        _, item1 = url_data.match('/api/customer/1', '', False)
+        _, item2 = url_data.match('/api/customer/2', '', False)
+
+        self.assertIs(item1, item2)
+        self.assertEquals(item1.name, 'd1')
+
+# ################################################################################################################################
+
+class LRUCacheTestCase(TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(3)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+
+        # Makes 'a' the most recently used one so 'b' is evicted next
+        self.assertEquals(cache.get('a'), 1)
+        cache.set('d', 4)
+
+        self.assertEquals(len(cache), 3)
+        self.assertNotIn('b', cache)
+        self.assertEquals(cache.get('b', 'default'), 'default')
+        self.assertEquals(cache.evictions, 1)
+        self.assertEquals(cache.hits, 1)
+        self.assertEquals(cache.misses, 1)
+
+        # Updating an existing key does not evict anything
+        cache.set('c', 33)
+        self.assertEquals(cache.get('c'), 33)
+        self.assertEquals(cache.evictions, 1)
+
+# ################################################################################################################################
+
+    def test_pop_clear(self):
+        cache = LRUCache(2)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        self.assertEquals(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEquals(len(cache), 1)
+
+        cache.set('c', 3)
+        cache.set('d', 4)
+        self.assertEquals(sorted(key for key in ('b', 'c', 'd') if key in cache), ['c', 'd'])
+
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.evictions, 0)
+
+        cache.set('e', 5)
+        self.assertEquals(cache.get('e'), 5)
+
+# ################################################################################################################################
+
+    def test_no_limit(self):
+        cache = LRUCache(0)
+
+        for idx in range(100):
+            cache.set(idx, idx)
+
+        self.assertEquals(len(cache), 100)
+        self.assertEquals(cache.evictions, 0)
+
+# ################################################################################################################################
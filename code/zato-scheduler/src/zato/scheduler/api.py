@@ -19,7 +19,7 @@ from crontab import CronTab
 from dateutil.parser import parse
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn_later
 
 # Zato
 from zato.broker import BrokerMessageReceiver
@@ -54,6 +54,14 @@ class Scheduler(BrokerMessageReceiver):
         self.config.on_job_executed_cb = self.on_job_executed
         self.sched = _Scheduler(self.config, self)
 
+        # If job_batch_time is set, executions of jobs that take place within that many seconds are sent to servers
+        # in batches of up to job_batch_size jobs each and one-time jobs among them are deactivated in one go.
+        self.job_batch_time = self.config.job_batch_time
+        self.job_batch_size = self.config.job_batch_size
+        self.job_batch = []
+        self.one_time_batch = []
+        self.job_batch_flush_pending = False
+
         # Broker connection
         self.broker_conn = KVDB(config=self.config.main.broker, decrypt_func=self.config.crypto_manager.decrypt)
         self.broker_conn.init()
@@ -83,6 +91,78 @@ class Scheduler(BrokerMessageReceiver):
         except Exception:
             logger.warn(format_exc())
 
+# ################################################################################################################################
+
+    def get_deactivate_msg(self, id_list):
+        """ Returns a message deactivating one-time jobs from the list of IDs on input.
+        """
+        # A single job is deactivated the same way it is when executions are not batched ..
+        if len(id_list) == 1:
+            service = 'zato.scheduler.job.set-active-status'
+            payload = {'id':id_list[0], 'is_active':False}
+
+        # .. whereas many of them are deactivated in one go.
+        else:
+            service = 'zato.scheduler.job.deactivate-list'
+            payload = {'id_list': id_list}
+
+        return {
+            'action': SERVICE.PUBLISH.value,
+            'service': service,
+            'payload': payload,
+            'cid': new_cid(),
+            'channel': CHANNEL.SCHEDULER_AFTER_ONE_TIME,
+            'data_format': DATA_FORMAT.JSON,
+        }
+
+# ################################################################################################################################
+
+    def add_to_job_batch(self, msg, one_time_id):
+        """ Adds a job execution request to the current batch, scheduling the batch to be sent if it is the first one in it.
+        """
+        self.job_batch.append(msg)
+
+        if one_time_id is not None:
+            self.one_time_batch.append(one_time_id)
+
+        if not self.job_batch_flush_pending:
+            self.job_batch_flush_pending = True
+            spawn_later(self.job_batch_time, self.flush_job_batch)
+
+# ################################################################################################################################
+
+    def flush_job_batch(self):
+        """ Sends to servers all the job execution requests collected so far.
+        """
+        self.job_batch_flush_pending = False
+
+        job_batch, self.job_batch = self.job_batch, []
+        one_time_batch, self.one_time_batch = self.one_time_batch, []
+
+        try:
+            for idx in xrange(0, len(job_batch), self.job_batch_size):
+                jobs = job_batch[idx:idx + self.job_batch_size]
+
+                # A batch of one is sent as a regular message
+                if len(jobs) == 1:
+                    msg = jobs[0]
+                else:
+                    msg = {
+                        'action': SCHEDULER_MSG.JOB_EXECUTED_BATCH.value,
+                        'jobs': jobs,
+                    }
+
+                self.broker_client.invoke_async(msg)
+
+            if _has_debug:
+                logger.debug('Sent a batch of %d job execution request(s)', len(job_batch))
+
+            if one_time_batch:
+                self.broker_client.publish(self.get_deactivate_msg(one_time_batch))
+
+        except Exception:
+            logger.warn('Could not send a batch of job execution requests, e:`%s`', format_exc())
+
 # ################################################################################################################################
 
     def on_job_executed(self, ctx, extra_data_format=ZATO_NONE):
@@ -103,6 +183,12 @@ class Scheduler(BrokerMessageReceiver):
         if extra_data_format != ZATO_NONE:
             msg['data_format'] = extra_data_format
 
+        # Executions are batched ..
+        if self.job_batch_time:
+            self.add_to_job_batch(msg, ctx['id'] if ctx['type'] == SCHEDULER.JOB_TYPE.ONE_TIME else None)
+            return
+
+        # .. or each of them is sent immediately.
         self.broker_client.invoke_async(msg)
 
         if _has_debug:
@@ -112,15 +198,7 @@ class Scheduler(BrokerMessageReceiver):
 
         # Now, if it was a one-time job, it needs to be deactivated.
         if ctx['type'] == SCHEDULER.JOB_TYPE.ONE_TIME:
-            msg = {
-                'action': SERVICE.PUBLISH.value,
-                'service': 'zato.scheduler.job.set-active-status',
-                'payload': {'id':ctx['id'], 'is_active':False},
-                'cid': new_cid(),
-                'channel': CHANNEL.SCHEDULER_AFTER_ONE_TIME,
-                'data_format': DATA_FORMAT.JSON,
-            }
-            self.broker_client.publish(msg)
+            self.broker_client.publish(self.get_deactivate_msg([ctx['id']]))
 
 # ################################################################################################################################
 
@@ -10,7 +10,11 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import datetime
+from calendar import timegm
+from heapq import heapify, heappop, heappush
+from itertools import count
 from logging import getLogger
+from time import time
 from traceback import format_exc
 
 # datetime
@@ -19,6 +23,7 @@ from dateutil.rrule import rrule, SECONDLY
 # gevent
 import gevent # Imported directly so it can be mocked out in tests
 from gevent import lock, sleep
+from gevent.event import Event
 
 # paodate
 from paodate import Delta
@@ -212,6 +217,24 @@ class Job(object):
         """
         return spawn_greenlet(*args, **kwargs)
 
+    def fire(self, spawn):
+        """ Runs a single iteration of the job, i.e. invokes its callback in a new greenlet using the spawn function given
+        on input, and, if this was the last iteration allowed, stops the job.
+        """
+        self.current_run += 1
+
+        # Perhaps we've already been executed enough times
+        if self.max_repeats and self.current_run == self.max_repeats:
+            self.keep_running = False
+            self.max_repeats_reached = True
+            self.max_repeats_reached_at = datetime.datetime.utcnow()
+
+            if self.on_max_repeats_reached_cb:
+                self.on_max_repeats_reached_cb(self)
+
+        # Invoke callback in a new greenlet so it doesn't block the current one.
+        spawn(self.callback, **{'ctx':self.get_context()})
+
     def main_loop(self):
 
         logger.info('Job entering main loop `%s`', self)
@@ -221,19 +244,7 @@ class Job(object):
         try:
             while self.keep_running:
                 try:
-                    self.current_run += 1
-
-                    # Perhaps we've already been executed enough times
-                    if self.max_repeats and self.current_run == self.max_repeats:
-                        self.keep_running = False
-                        self.max_repeats_reached = True
-                        self.max_repeats_reached_at = datetime.datetime.utcnow()
-
-                        if self.on_max_repeats_reached_cb:
-                            self.on_max_repeats_reached_cb(self)
-
-                    # Invoke callback in a new greenlet so it doesn't block the current one.
-                    self._spawn(self.callback, **{'ctx':self.get_context()})
+                    self.fire(self._spawn)
 
                 except Exception, e:
                     logger.warn(format_exc(e))
@@ -284,6 +295,136 @@ class Job(object):
 
 # ################################################################################################################################
 
+def _get_timestamp(value):
+    """ Converts a naive UTC datetime object to a UNIX timestamp.
+    """
+    return timegm(value.utctimetuple()) + value.microsecond / 1000000.0
+
+# ################################################################################################################################
+
+class TimerHeap(object):
+    """ Runs all the jobs from a single dispatcher greenlet that sleeps until the next job is due, as opposed to
+    each job having a greenlet of its own. Jobs are kept in a heap of [next_fire_time, sequence, job] entries -
+    removing a job only marks its entry as such and the entry is discarded when it reaches the top of the heap,
+    or when the heap is compacted, whichever comes first.
+    """
+    def __init__(self, max_sleep_time=60):
+        self.heap = []
+        self.entries = {} # Job name -> its current entry in the heap
+        self.removed = 0
+        self.sequence = count()
+        self.wakeup = Event()
+        self.keep_running = True
+
+        # Even if no job is due, the dispatcher wakes up every max_sleep_time seconds, e.g. in case system time changed
+        self.max_sleep_time = max_sleep_time
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _push(self, job, fire_at):
+        entry = [fire_at, next(self.sequence), job]
+        self.entries[job.name] = entry
+        heappush(self.heap, entry)
+
+        # The dispatcher needs to recompute for how long to sleep if this job is now the first one to run
+        if self.heap[0] is entry:
+            self.wakeup.set()
+
+    def add(self, job):
+        """ Schedules a job to run at its start_time, replacing any other job of the same name.
+        """
+        if not job.start_time:
+            logger.warn('Job `%s` cannot start without start_time set', job.name)
+            return
+
+        self.remove(job.name)
+        self._push(job, _get_timestamp(job.start_time))
+
+    def remove(self, name):
+        """ Unschedules a job by its name, returns True if there was such a job.
+        """
+        entry = self.entries.pop(name, None)
+        if not entry:
+            return False
+
+        entry[-1] = None
+        self.removed += 1
+
+        # Rebuild the heap if most of it is made up of removed entries
+        if self.removed > 1000 and self.removed * 2 > len(self.heap):
+            self.heap = [elem for elem in self.heap if elem[-1] is not None]
+            heapify(self.heap)
+            self.removed = 0
+
+        return True
+
+    def get_next_fire_time(self, job, fire_at, now):
+        """ Returns the time a job should run next at. Interval-based jobs are scheduled relative to the previous time
+        they were due rather than to now, so that they do not drift, unless they are so late that this time is in the past,
+        in which case missed executions are skipped.
+        """
+        if job.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED:
+            next_fire_at = fire_at + job.interval.in_seconds
+            return next_fire_at if next_fire_at > now else now + job.interval.in_seconds
+        else:
+            return now + job.get_sleep_time(datetime.datetime.utcnow())
+
+    def run_due(self, now, _spawn=gevent.spawn, _one_time=SCHEDULER.JOB_TYPE.ONE_TIME):
+        """ Runs all jobs whose time has come and schedules their next executions.
+        """
+        entries = self.entries
+
+        # Note that self.heap is not kept in a local variable because it may be compacted by a callback of a job
+        while self.heap and self.heap[0][0] <= now:
+            entry = heappop(self.heap)
+            fire_at, _, job = entry
+
+            # Removed in the meantime
+            if job is None:
+                self.removed -= 1
+                continue
+
+            try:
+                if job.keep_running:
+                    job.fire(_spawn)
+            except Exception, e:
+                logger.warn(format_exc(e))
+
+            # The job may have been removed or replaced while it was running
+            if entries.get(job.name) is not entry:
+                continue
+
+            if job.keep_running and job.type != _one_time:
+                self._push(job, self.get_next_fire_time(job, fire_at, now))
+            else:
+                del entries[job.name]
+
+    def run(self, _time=time):
+        """ The dispatcher's main loop.
+        """
+        logger.info('Timer heap dispatcher starting')
+
+        while self.keep_running:
+            try:
+                self.wakeup.clear()
+                self.run_due(_time())
+
+                timeout = self.heap[0][0] - _time() if self.heap else self.max_sleep_time
+                if timeout > 0:
+                    self.wakeup.wait(min(timeout, self.max_sleep_time))
+
+            except Exception, e:
+                logger.warn(format_exc(e))
+
+        logger.info('Timer heap dispatcher stopped')
+
+    def stop(self):
+        self.keep_running = False
+        self.wakeup.set()
+
+# ################################################################################################################################
+
 class Scheduler(object):
     def __init__(self, config, api):
         self.config = config
@@ -303,6 +444,9 @@ class Scheduler(object):
         self._add_scheduler_jobs = config._add_scheduler_jobs
         self.job_log = getattr(logger, config.job_log_level)
 
+        # If set, all jobs are run by a single dispatcher greenlet instead of each job having its own one
+        self.timer_heap = TimerHeap() if getattr(config, 'use_timer_heap', False) else None
+
     def on_max_repeats_reached(self, job):
         with self.lock:
             job.is_active = False
@@ -351,6 +495,9 @@ class Scheduler(object):
             del self.job_greenlets[name]
             found = True
 
+        if self.timer_heap is not None and self.timer_heap.remove(name):
+            found = True
+
         return found
 
     def _unschedule_stop(self, job, message):
@@ -427,11 +574,15 @@ class Scheduler(object):
         return spawn_greenlet(*args, **kwargs)
 
     def spawn_job(self, job):
-        """ Spawns a job's greenlet. Must be called with self.lock held.
+        """ Spawns a job's greenlet or adds the job to the timer heap. Must be called with self.lock held.
         """
         job.callback = self.on_job_executed
         job.on_max_repeats_reached_cb = self.on_max_repeats_reached
-        self.job_greenlets[job.name] = self._spawn(job.run)
+
+        if self.timer_heap is not None:
+            self.timer_heap.add(job)
+        else:
+            self.job_greenlets[job.name] = self._spawn(job.run)
 
     def add_startup_jobs(self):
         sleep(40) # To make sure that at least one server is running if the environment was started from quickstart scripts
@@ -453,6 +604,9 @@ class Scheduler(object):
             _sleep = self.sleep
             _sleep_time = self.sleep_time
 
+            if self.timer_heap is not None:
+                gevent.spawn(self.timer_heap.run)
+
             with self.lock:
                 for job in sorted(self.jobs.itervalues()):
                     if job.max_repeats_reached:
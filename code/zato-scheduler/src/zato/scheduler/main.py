@@ -22,6 +22,9 @@ from traceback import format_exc
 import cloghandler
 cloghandler = cloghandler # For pyflakes
 
+# Paste
+from paste.util.converters import asbool
+
 # YAML
 import yaml
 
@@ -50,6 +53,12 @@ def main():
     config.main = get_config(repo_location, 'scheduler.conf')
     config.main.odb.fs_sql_config = get_config(repo_location, 'sql.conf', needs_user_config=False)
 
+    # Scheduler engine and how job executions are sent to servers
+    scheduler_config = config.main.get('scheduler', {})
+    config.use_timer_heap = asbool(scheduler_config.get('use_timer_heap', False))
+    config.job_batch_time = float(scheduler_config.get('job_batch_time', 0))
+    config.job_batch_size = int(scheduler_config.get('job_batch_size', 100))
+
     # Make all paths absolute
     if config.main.crypto.use_tls:
         config.main.crypto.ca_certs_location = absjoin(repo_location, config.main.crypto.ca_certs_location)
@@ -49,6 +49,9 @@ class Config(object):
         self.broker_client = None
         self._add_startup_jobs = True
         self._add_scheduler_jobs = True
+        self.use_timer_heap = False
+        self.job_batch_time = 0
+        self.job_batch_size = 100
 
 # ################################################################################################################################
 
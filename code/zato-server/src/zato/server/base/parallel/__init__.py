@@ -59,14 +59,13 @@ from zato.server.base.parallel.config import ConfigLoader
 from zato.server.base.parallel.http import HTTPHandler
 from zato.server.base.parallel.wmq import WMQIPC
 from zato.server.pickup import PickupManager
+from zato.server.stats import ServiceTimingStore, set_indexed_since
 
 # ################################################################################################################################
 
 logger = logging.getLogger(__name__)
 kvdb_logger = logging.getLogger('zato_kvdb')
 
-megabyte = 10**6
-
 # ################################################################################################################################
 
 class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTPHandler, WMQIPC):
@@ -131,10 +130,11 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.zato_lock_manager = None
         self.pid = None
         self.sync_internal = None
+        self.service_timing = None # type: ServiceTimingStore
         self.ipc_api = IPCAPI(False)
         self.ipc_forwarder = IPCAPI(True)
         self.wmq_ipc_tcp_port = None
-        self.fifo_response_buffer_size = None # Will be in megabytes
+        self.wmq_session = None
         self.is_first_worker = None
         self.shmem_size = -1.0
         self.server_startup_ipc = ServerStartupIPC()
@@ -305,24 +305,6 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         # Static config files
         self.static_config = StaticConfig(os.path.join(self.repo_location, 'static'))
 
-        # Key-value DB
-        kvdb_config = get_kvdb_config_for_log(self.fs_server_config.kvdb)
-        kvdb_logger.info('Worker config `%s`', kvdb_config)
-
-        self.kvdb.config = self.fs_server_config.kvdb
-        self.kvdb.server = self
-        self.kvdb.decrypt_func = self.crypto_manager.decrypt
-        self.kvdb.init()
-
-        kvdb_logger.info('Worker config `%s`', kvdb_config)
-
-        # Lua programs, both internal and user defined ones.
-        for name, program in self.get_lua_programs():
-            self.kvdb.lua_container.add_lua_program(name, program)
-
-        # TimeUtil needs self.kvdb so it can be set now
-        self.time_util = TimeUtil(self.kvdb)
-
         # Service sources
         self.service_sources = []
         for name in open(os.path.join(self.repo_location, self.fs_server_config.main.service_sources)):
@@ -339,13 +321,33 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
             self.user_config[get_user_config_name(file_name)] = conf
 
-        # Convert size of FIFO response buffers to megabytes
-        self.fifo_response_buffer_size = int(float(self.fs_server_config.misc.fifo_response_buffer_size) * megabyte)
-
         is_first, locally_deployed = self.maybe_on_first_worker(server, self.kvdb.conn)
 
         return is_first, locally_deployed
 
+# ################################################################################################################################
+
+    def set_up_kvdb(self):
+        """ Initializes connections to the key-value DB. Needed before configuration is read because its current version
+        is kept in the key-value DB.
+        """
+        kvdb_config = get_kvdb_config_for_log(self.fs_server_config.kvdb)
+        kvdb_logger.info('Worker config `%s`', kvdb_config)
+
+        self.kvdb.config = self.fs_server_config.kvdb
+        self.kvdb.server = self
+        self.kvdb.decrypt_func = self.crypto_manager.decrypt
+        self.kvdb.init()
+
+        kvdb_logger.info('Worker config `%s`', kvdb_config)
+
+        # Lua programs, both internal and user defined ones.
+        for name, program in self.get_lua_programs():
+            self.kvdb.lua_container.add_lua_program(name, program)
+
+        # TimeUtil needs self.kvdb so it can be set now
+        self.time_util = TimeUtil(self.kvdb)
+
 # ################################################################################################################################
 
     def set_up_odb(self):
@@ -421,6 +423,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
                     self.cluster.name, self.pid, 's' if use_tls else '', self.preferred_address,
             self.port)
 
+        # Key-value DB
+        self.set_up_kvdb()
+
         # Reads in all configuration from ODB
         self.worker_store = WorkerStore(self.config, self)
         self.worker_store.invoke_matcher.read_config(self.fs_server_config.invoke_patterns_allowed)
@@ -468,6 +473,16 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs())
         self.worker_store.set_broker_client(self.broker_client)
 
+        # Processing times of services, aggregated in RAM if a flush interval is given
+        self.service_timing = ServiceTimingStore(self.kvdb.conn,
+            int(self.fs_server_config.get('stats', {}).get('timing_flush_interval', 0)))
+
+        if self.service_timing.flush_interval:
+            spawn_greenlet(self.service_timing.run)
+
+        # Statistics keys written from now on are indexed so empty indexes need not be followed by a scan for the keys
+        set_indexed_since(self.kvdb.conn, datetime.utcnow())
+
         self._after_init_accepted(locally_deployed)
 
         self.odb.server_up_down(server.token, SERVER_UP_STATUS.RUNNING, True, self.host,
@@ -653,7 +668,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         # Underlying IPC needs strings on input instead of None
         request = request or ''
 
-        for pid in pids:
+        def _invoke_pid(pid):
             response = {
                 'is_ok': False,
                 'pid_data': None,
@@ -670,6 +685,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             finally:
                 out[pid] = response
 
+        # All the processes are invoked concurrently so the whole takes as long as the slowest one instead of the sum of all
+        gevent.joinall([gevent.spawn(_invoke_pid, pid) for pid in pids])
+
         return out
 
 # ################################################################################################################################
@@ -677,7 +695,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
     def invoke_by_pid(self, service, request, target_pid, *args, **kwargs):
         """ Invokes a service in a worker process by the latter's PID.
         """
-        return self.ipc_api.invoke_by_pid(service, request, target_pid, self.fifo_response_buffer_size, *args, **kwargs)
+        return self.ipc_api.invoke_by_pid(service, request, target_pid, *args, **kwargs)
 
 # ################################################################################################################################
 
@@ -829,6 +847,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             # Close all POSIX IPC structures
             self.server_startup_ipc.close()
 
+            # Store SSO session renewals that were not saved yet
+            if self.is_sso_enabled:
+                self.sso_api.user.session.flush_renewals()
+
             self.invoke('zato.channel.web-socket.client.delete-by-server')
             self.invoke('zato.channel.web-socket.client.delete-by-server')
 
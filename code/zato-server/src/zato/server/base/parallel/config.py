@@ -10,6 +10,9 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from contextlib import closing
+from cPickle import dumps, HIGHEST_PROTOCOL, loads
+from logging import getLogger
+from traceback import format_exc
 import os
 
 # Paste
@@ -17,13 +20,30 @@ from paste.util.converters import asbool
 
 # Zato
 from zato.bunch import Bunch
-from zato.common import MISC, SECRETS
+from zato.common import KVDB, MISC, SECRETS
+from zato.distlock import LockTimeout
 from zato.server.config import ConfigDict
 from zato.server.message import JSONPointerStore, NamespaceStore, XPathStore
 from zato.url_dispatcher import Matcher
 
 # ################################################################################################################################
 
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+# All the configuration that set_up_odb_config reads into ConfigDict objects, kept in configuration snapshots
+odb_config_dicts = ('cassandra_conn', 'cassandra_query', 'search_es', 'search_solr', 'sms_twilio', 'cloud_openstack_swift',
+    'cloud_aws_s3', 'service', 'definition_amqp', 'definition_wmq', 'channel_amqp', 'channel_stomp', 'channel_wmq', 'out_amqp',
+    'cache_builtin', 'cache_memcached', 'out_ftp', 'out_wmq', 'out_odoo', 'out_sap', 'out_plain_http', 'out_soap', 'out_sql',
+    'out_stomp', 'channel_zmq', 'out_zmq', 'channel_web_socket', 'generic_connection', 'notif_cloud_openstack_swift',
+    'notif_sql', 'apikey', 'aws', 'basic_auth', 'jwt', 'ntlm', 'oauth', 'openstack_security', 'rbac_permission', 'rbac_role',
+    'rbac_client_role', 'rbac_role_permission', 'tls_ca_cert', 'tls_channel_sec', 'tls_key_cert', 'wss', 'vault_conn_sec',
+    'xpath_sec', 'msg_ns', 'xpath', 'json_pointer', 'pubsub_endpoint', 'pubsub_topic', 'pubsub_subscription', 'email_smtp',
+    'email_imap')
+
+# ################################################################################################################################
+
 class ConfigLoader(object):
     """ Loads server's configuration.
     """
@@ -36,6 +56,46 @@ class ConfigLoader(object):
         self.component_enabled.stats = asbool(self.fs_server_config.component_enabled.stats)
         self.component_enabled.slow_response = asbool(self.fs_server_config.component_enabled.slow_response)
 
+        # Configuration kept in ODB, possibly read from a snapshot of it built by another process of this server
+        if asbool(self.fs_server_config.misc.get('use_config_snapshot', True)):
+            self.set_up_odb_config_from_snapshot(server)
+        else:
+            self.set_up_odb_config(server)
+
+        # Matchers cannot be serialized so they are never kept in snapshots
+        for hs_item in self.config.http_soap:
+            hs_item['match_target_compiled'] = Matcher(hs_item['match_target'])
+
+        # SimpleIO
+        # In preparation for a SIO rewrite, we loaded SIO config from a file
+        # but actual code paths require the pre-3.0 format so let's prepare it here.
+        self.config.simple_io = ConfigDict('simple_io', Bunch())
+
+        int_exact = self.sio_config.int.exact
+        int_suffix = self.sio_config.int.suffix
+        bool_prefix = self.sio_config.bool.prefix
+
+        self.config.simple_io['int_parameters'] = int_exact if isinstance(int_exact, list) else [int_exact]
+        self.config.simple_io['int_parameter_suffixes'] = int_suffix if isinstance(int_suffix, list) else [int_suffix]
+        self.config.simple_io['bool_parameter_prefixes'] = bool_prefix if isinstance(bool_prefix, list) else [bool_prefix]
+
+        # Pub/sub
+        self.config.pubsub = Bunch()
+
+        # Message paths
+        self.config.msg_ns_store = NamespaceStore()
+        self.config.json_pointer_store = JSONPointerStore()
+        self.config.xpath_store = XPathStore()
+
+        # Assign config to worker
+        self.worker_store.worker_config = self.config
+
+# ################################################################################################################################
+
+    def set_up_odb_config(self, server):
+        """ Reads into self.config all the configuration kept in ODB.
+        """
+
         #
         # Cassandra - start
         #
@@ -322,7 +382,6 @@ class ConfigLoader(object):
                 hs_item[key] = getattr(item, key)
 
             hs_item['match_target'] = '{}{}{}'.format(hs_item['soap_action'], MISC.SEPARATOR, hs_item['url_path'])
-            hs_item['match_target_compiled'] = Matcher(hs_item['match_target'])
 
             http_soap.append(hs_item)
 
@@ -340,22 +399,6 @@ class ConfigLoader(object):
         query = self.odb.get_json_pointer_list(server.cluster.id, True)
         self.config.json_pointer = ConfigDict.from_query('json_pointer', query, decrypt_func=self.decrypt)
 
-        # SimpleIO
-        # In preparation for a SIO rewrite, we loaded SIO config from a file
-        # but actual code paths require the pre-3.0 format so let's prepare it here.
-        self.config.simple_io = ConfigDict('simple_io', Bunch())
-
-        int_exact = self.sio_config.int.exact
-        int_suffix = self.sio_config.int.suffix
-        bool_prefix = self.sio_config.bool.prefix
-
-        self.config.simple_io['int_parameters'] = int_exact if isinstance(int_exact, list) else [int_exact]
-        self.config.simple_io['int_parameter_suffixes'] = int_suffix if isinstance(int_suffix, list) else [int_suffix]
-        self.config.simple_io['bool_parameter_prefixes'] = bool_prefix if isinstance(bool_prefix, list) else [bool_prefix]
-
-        # Pub/sub
-        self.config.pubsub = Bunch()
-
         # Pub/sub - endpoints
         query = self.odb.get_pubsub_endpoint_list(server.cluster.id, True)
         self.config.pubsub_endpoint = ConfigDict.from_query('pubsub_endpoint', query, decrypt_func=self.decrypt)
@@ -376,13 +419,114 @@ class ConfigLoader(object):
         query = self.odb.get_email_imap_list(server.cluster.id, True)
         self.config.email_imap = ConfigDict.from_query('email_imap', query, decrypt_func=self.decrypt)
 
-        # Message paths
-        self.config.msg_ns_store = NamespaceStore()
-        self.config.json_pointer_store = JSONPointerStore()
-        self.config.xpath_store = XPathStore()
+# ################################################################################################################################
 
-        # Assign config to worker
-        self.worker_store.worker_config = self.config
+    def get_config_version(self):
+        """ Returns the current version of configuration, changed each time any object in ODB is created, updated or deleted.
+        """
+        return self.kvdb.conn.get(KVDB.CONFIG_VERSION) or '0'
+
+    def bump_config_version(self):
+        """ Makes all configuration snapshots outdated.
+        """
+        self.kvdb.conn.incr(KVDB.CONFIG_VERSION)
+
+# ################################################################################################################################
+
+    def _get_config_snapshot_path(self):
+        work_dir = os.path.normpath(os.path.join(self.repo_location, self.fs_server_config.hot_deploy.work_dir))
+        return os.path.join(work_dir, 'config-snapshot.dat')
+
+# ################################################################################################################################
+
+    def set_up_odb_config_from_snapshot(self, server):
+        """ Reads configuration from a snapshot built by the first process of this server to start, unless the server
+        was restarted since then or configuration changed in the meantime, in which case it is read from ODB and a new snapshot
+        is saved for other processes to use.
+        """
+        path = self._get_config_snapshot_path()
+        lock = self.zato_lock_manager('config-snapshot-{}'.format(self.deployment_key),
+            ttl=self.deployment_lock_timeout, block=self.deployment_lock_timeout)
+
+        try:
+            lock.acquire()
+        except LockTimeout:
+            logger.warn('Could not obtain configuration snapshot lock, reading configuration from ODB')
+            self.set_up_odb_config(server)
+            return
+
+        try:
+            # Read the version before ODB is, so that any change in between makes the snapshot outdated
+            version = self.get_config_version()
+
+            if self._load_config_snapshot(path, version):
+                logger.info('Configuration read from snapshot `%s` (version %s)', path, version)
+            else:
+                self.set_up_odb_config(server)
+                self._save_config_snapshot(path, version)
+        finally:
+            lock.release()
+
+# ################################################################################################################################
+
+    def _get_config_snapshot_header(self, version):
+        return '{} {}\n'.format(version, self.deployment_key)
+
+# ################################################################################################################################
+
+    def _load_config_snapshot(self, path, version):
+        """ Assigns configuration from a snapshot to self.config and returns True if there is a current snapshot.
+        """
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with open(path, 'rb') as f:
+
+                # Before anything is decrypted, confirm that the snapshot is current
+                if f.readline() != self._get_config_snapshot_header(version):
+                    return False
+
+                snapshot = loads(self.crypto_manager.decrypt(f.read()))
+
+        except Exception, e:
+            logger.warn('Could not read configuration snapshot `%s`, e:`%s`', path, format_exc(e))
+            return False
+
+        for attr_name, (name, impl) in snapshot['config_dicts'].items():
+            setattr(self.config, attr_name, ConfigDict(name, impl))
+
+        self.config.http_soap = snapshot['http_soap']
+
+        return True
+
+# ################################################################################################################################
+
+    def _save_config_snapshot(self, path, version):
+        """ Saves configuration read from ODB to a snapshot. Secrets in configuration are already decrypted which is why
+        the whole snapshot is encrypted and readable to the current user only.
+        """
+        config_dicts = {}
+
+        for attr_name in odb_config_dicts:
+            config_dict = getattr(self.config, attr_name)
+            config_dicts[attr_name] = (config_dict.name, config_dict._impl)
+
+        try:
+            data = dumps({'config_dicts': config_dicts, 'http_soap': self.config.http_soap}, HIGHEST_PROTOCOL)
+            data = self.crypto_manager.encrypt(data)
+
+            # Other processes may be reading the current snapshot so a new one is saved under a temporary name first
+            tmp_path = '{}.{}'.format(path, os.getpid())
+
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(self._get_config_snapshot_header(version))
+                f.write(data)
+
+            os.rename(tmp_path, path)
+
+        except Exception, e:
+            logger.warn('Could not save configuration snapshot `%s`, e:`%s`', path, format_exc(e))
 
 # ################################################################################################################################
 
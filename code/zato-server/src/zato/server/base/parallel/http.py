@@ -13,6 +13,7 @@ from datetime import datetime
 from httplib import INTERNAL_SERVER_ERROR, responses
 from logging import getLogger, INFO
 from traceback import format_exc
+from types import GeneratorType
 
 # pytz
 from pytz import UTC
@@ -38,8 +39,7 @@ class HTTPHandler(object):
     """ Handles incoming HTTP requests.
     """
     def on_wsgi_request(self, wsgi_environ, start_response, _new_cid=new_cid, _local_zone=get_localzone(),
-        _utcnow=datetime.utcnow, _INFO=INFO, _UTC=UTC, _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT,
-        _no_remote_address=NO_REMOTE_ADDRESS, **kwargs):
+        _utcnow=datetime.utcnow, _UTC=UTC, _no_remote_address=NO_REMOTE_ADDRESS, _generator_type=GeneratorType, **kwargs):
         """ Handles incoming HTTP requests.
         """
         cid = kwargs.get('cid', _new_cid())
@@ -85,20 +85,53 @@ class HTTPHandler(object):
         if isinstance(payload, unicode):
             payload = payload.encode('utf-8')
 
-        if self.needs_access_log:
+        # A generator of chunks means that the response is streamed - since there is no Content-Length header,
+        # the WSGI server will use chunked transfer encoding to send it. Access log is written once all of it is sent.
+        if isinstance(payload, _generator_type):
+            return self._stream_response(payload, cid, request_ts_utc, request_ts_local, remote_addr, channel_name, wsgi_environ)
 
-            self.access_logger_log(_INFO, '', None, None, {
-                'remote_ip': remote_addr,
-                'cid_resp_time': '%s/%s' % (cid, (_utcnow() - request_ts_utc).total_seconds()),
-                'channel_name': channel_name,
-                'req_timestamp_utc': request_ts_utc.strftime(_ACCESS_LOG_DT_FORMAT),
-                'req_timestamp': request_ts_local.strftime(_ACCESS_LOG_DT_FORMAT),
-                'method': wsgi_environ['REQUEST_METHOD'],
-                'path': wsgi_environ['PATH_INFO'],
-                'http_version': wsgi_environ['SERVER_PROTOCOL'],
-                'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                'response_size': len(payload),
-                'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
-            })
+        if self.needs_access_log:
+            self._log_access(cid, request_ts_utc, request_ts_local, remote_addr, channel_name, wsgi_environ, len(payload))
 
         return [payload]
+
+# ################################################################################################################################
+
+    def _stream_response(self, payload, cid, request_ts_utc, request_ts_local, remote_addr, channel_name, wsgi_environ):
+        """ Yields all chunks of a streamed response, keeping track of how many bytes were sent, for the access log.
+        """
+        response_size = 0
+
+        try:
+            for chunk in payload:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                response_size += len(chunk)
+                yield chunk
+
+        except Exception, e:
+            logger.error('Could not stream response, cid:`%s`, e:`%s`', cid, format_exc(e))
+            raise
+
+        finally:
+            if self.needs_access_log:
+                self._log_access(cid, request_ts_utc, request_ts_local, remote_addr, channel_name, wsgi_environ, response_size)
+
+# ################################################################################################################################
+
+    def _log_access(self, cid, request_ts_utc, request_ts_local, remote_addr, channel_name, wsgi_environ, response_size,
+        _utcnow=datetime.utcnow, _INFO=INFO, _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT):
+
+        self.access_logger_log(_INFO, '', None, None, {
+            'remote_ip': remote_addr,
+            'cid_resp_time': '%s/%s' % (cid, (_utcnow() - request_ts_utc).total_seconds()),
+            'channel_name': channel_name,
+            'req_timestamp_utc': request_ts_utc.strftime(_ACCESS_LOG_DT_FORMAT),
+            'req_timestamp': request_ts_local.strftime(_ACCESS_LOG_DT_FORMAT),
+            'method': wsgi_environ['REQUEST_METHOD'],
+            'path': wsgi_environ['PATH_INFO'],
+            'http_version': wsgi_environ['SERVER_PROTOCOL'],
+            'status_code': wsgi_environ['zato.http.response.status'].split()[0],
+            'response_size': response_size,
+            'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
+        })
@@ -19,7 +19,8 @@ from traceback import format_exc
 from gevent import sleep
 
 # requests
-from requests import get, post
+from requests import get, Session
+from requests.adapters import HTTPAdapter
 
 # Zato
 from zato.common import IPC, WebSphereMQCallData
@@ -80,7 +81,9 @@ class WMQIPC(object):
             'server_name': self.name,
             'server_path': '/zato/internal/callback/wmq',
             'base_dir': self.base_dir,
-            'logging_conf_path': self.logging_conf_path
+            'logging_conf_path': self.logging_conf_path,
+            'callback_batch_size': int(self.fs_server_config.ibm_mq.get('callback_batch_size', 100)),
+            'callback_batch_time': float(self.fs_server_config.ibm_mq.get('callback_batch_time', 0.01)),
         }), self.pid)
 
         # Start IBM MQ connector in a sub-process
@@ -124,6 +127,11 @@ class WMQIPC(object):
             'id': id
         })
 
+# ################################################################################################################################
+
+    def _get_wmq_call_data(self, response):
+        return WebSphereMQCallData(unhexlify(response['msg_id']).strip(), unhexlify(response['correlation_id']).strip())
+
 # ################################################################################################################################
 
     def send_wmq_message(self, msg):
@@ -134,9 +142,43 @@ class WMQIPC(object):
 
         # If we are here, it means that there was no error because otherwise an exception
         # would have been raised by invoke_wmq_connector.
-        response = loads(response.text)
+        return self._get_wmq_call_data(loads(response.text))
 
-        return WebSphereMQCallData(unhexlify(response['msg_id']).strip(), unhexlify(response['correlation_id']).strip())
+# ################################################################################################################################
+
+    def send_wmq_message_batch(self, msg_list):
+        """ Sends multiple messages to the connector in one request. Returns a list of WebSphereMQCallData objects,
+        in the same order that messages were given in, with an Exception object in place of each message that could not be sent.
+        """
+        self._check_enabled()
+
+        response = self.invoke_wmq_connector({
+            'action': OUTGOING.WMQ_SEND_BATCH.value,
+            'msg_list': msg_list,
+        })
+
+        out = []
+        for item in loads(response.text):
+            out.append(Exception(item['error']) if 'error' in item else self._get_wmq_call_data(item))
+
+        return out
+
+# ################################################################################################################################
+
+    def _get_wmq_session(self):
+        """ Returns a requests session to the connector, creating it first if needed. The session keeps connections open
+        so that no new TCP connection is established for each message, and credentials are looked up only once.
+        """
+        if not self.wmq_session:
+            pool_size = int(self.fs_server_config.ibm_mq.get('ipc_pool_size', 20))
+
+            session = Session()
+            session.auth = self.get_wmq_credentials()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+            self.wmq_session = session
+
+        return self.wmq_session
 
 # ################################################################################################################################
 
@@ -144,7 +186,7 @@ class WMQIPC(object):
         self._check_enabled()
 
         address = address_pattern.format(self.wmq_ipc_tcp_port, 'api')
-        response = post(address, data=dumps(msg), auth=self.get_wmq_credentials())
+        response = self._get_wmq_session().post(address, data=dumps(msg))
 
         if not response.ok:
             if raise_on_error:
@@ -84,6 +84,13 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
+# Broker messages that change configuration kept in ODB, i.e. ones after which snapshots of it are outdated
+config_change_actions = set(code for code, name in code_to_name.items()
+    if name.endswith(('_CREATE', '_EDIT', '_DELETE', '_CREATE_EDIT', '_CHANGE_PASSWORD', '_CREATE_SERVICE'))
+        and 'STATE_CHANGED' not in name)
+
+# ################################################################################################################################
+
 class GeventWorker(GunicornGeventWorker):
     def __init__(self, *args, **kwargs):
         self.deployment_key = '{}.{}'.format(datetime.utcnow().isoformat(), uuid4().hex)
@@ -327,6 +334,19 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         # TODO: Fix it, worker doesn't need to accept all the messages
         return True
 
+# ################################################################################################################################
+
+    def on_broker_msg(self, msg, _config_change_actions=config_change_actions):
+
+        # Configuration snapshots need to be built anew after any change to configuration
+        if msg.get('action') in _config_change_actions:
+            try:
+                self.server.bump_config_version()
+            except Exception, e:
+                logger.warn('Could not bump configuration version, e:`%s`', format_exc(e))
+
+        super(WorkerStore, self).on_broker_msg(msg)
+
 # ################################################################################################################################
 
     def _update_queue_build_cap(self, item):
@@ -1398,6 +1418,19 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
     def on_broker_msg_SCHEDULER_JOB_EXECUTED(self, msg, args=None):
         return self.on_message_invoke_service(msg, CHANNEL.SCHEDULER, 'SCHEDULER_JOB_EXECUTED', args)
 
+    def _on_job_executed_in_batch(self, msg, args):
+        try:
+            self.on_broker_msg_SCHEDULER_JOB_EXECUTED(self.preprocess_msg(msg), args)
+        except Exception:
+            logger.warn('Could not handle job execution `%r`, e:`%s`', msg, format_exc())
+
+    def on_broker_msg_SCHEDULER_JOB_EXECUTED_BATCH(self, msg, args=None):
+        """ Invokes services of all the jobs whose executions the scheduler sent in a single message,
+        each in a greenlet of its own, as though each execution had been received separately.
+        """
+        for item in msg['jobs']:
+            gevent.spawn(self._on_job_executed_in_batch, item, args)
+
     def on_broker_msg_CHANNEL_ZMQ_MESSAGE_RECEIVED(self, msg, args=None):
         return self.on_message_invoke_service(msg, CHANNEL.ZMQ, 'CHANNEL_ZMQ_MESSAGE_RECEIVED', args)
 
@@ -2072,13 +2105,14 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         except Exception, e:
             response = format_exc(e)
             status = failure
-        finally:
-            data = '{};{}'.format(status, response)
+
+        # No reply_to means that the request was sent in background and no one waits for the response
+        if not msg.reply_to:
+            return
 
         try:
-            with open(msg.reply_to_fifo, 'wb') as fifo:
-                fifo.write(data)
+            self.server.ipc_api.send_response(msg.reply_to, msg.request_id, status, response)
         except Exception:
-            logger.warn('Could not write to FIFO, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
+            logger.warn('Could not send IPC response, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
 
 # ################################################################################################################################
@@ -119,6 +119,19 @@ class AMQP(WorkerImpl):
 
         return self.amqp_api.invoke(def_name, out_name, msg, exchange, routing_key, properties, headers)
 
+    def amqp_invoke_many(self, msg_list, out_name, exchange='/', routing_key=None, properties=None, headers=None,
+            confirm=False, confirm_window=100, confirm_timeout=10):
+        """ Sends a list of messages through a named outgoing connection, all of them with the same exchange, routing key,
+        properties and headers, reusing one producer and AMQP channel. If confirm is True, publisher confirms are used
+        with up to confirm_window messages awaiting confirmation at a time. Returns a list of outcomes, one for each
+        message, each either True or an exception explaining why the message could not be published.
+        """
+        with self.update_lock:
+            def_name = self.amqp_out_name_to_def[out_name]
+
+        return self.amqp_api.invoke_many(def_name, out_name, msg_list, exchange, routing_key, properties, headers,
+            confirm, confirm_window, confirm_timeout)
+
     def _amqp_invoke_async(self, *args, **kwargs):
         try:
             self.amqp_invoke(*args, **kwargs)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from logging import getLogger
+
+# Zato
+from zato.server.base.worker.common import WorkerImpl
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+class SSO(WorkerImpl):
+    """ Callbacks for messages related to SSO.
+    """
+
+# ################################################################################################################################
+
+    def on_broker_msg_SSO_SESSION_CACHE_INVALIDATE(self, msg):
+        """ Removes a user's sessions from the local cache after that user logged out or changed in any way.
+        """
+        if self.server.is_sso_enabled and msg.source_worker_id != self.server.worker_id:
+            self.server.sso_api.user.session.invalidate_user(msg.user_id, False)
+
+# ################################################################################################################################
@@ -9,10 +9,12 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import deque, OrderedDict
 from datetime import datetime, timedelta
 from exceptions import IOError, OSError
 from logging import getLogger
-from socket import error as socket_error
+from socket import error as socket_error, timeout as socket_timeout
+from time import time
 from traceback import format_exc
 
 # amqp
@@ -20,9 +22,10 @@ from amqp.exceptions import ConnectionError as AMQPConnectionError
 
 # gevent
 from gevent import sleep, spawn
+from gevent.pool import Pool
 
 # Kombu
-from kombu import Connection, Consumer as _Consumer, pools, Queue
+from kombu import Connection, Consumer as _Consumer, pools, Producer, Queue
 from kombu.transport.pyamqp import Connection as PyAMQPConnection, Transport
 
 # Zato
@@ -45,6 +48,16 @@ no_ack = {
     AMQP.ACK_MODE.REJECT.id: True,
 }
 
+# With a dispatch pool, on_amqp_message returns True for messages that are to be acknowledged, _REJECT for ones that are
+# to be rejected, False for ones that services already acknowledged or rejected themselves and None if a service failed.
+_REJECT = 'reject'
+
+# ################################################################################################################################
+
+class NotConfirmed(Exception):
+    """ Raised, or returned in results of bulk publishing, if a broker did not confirm it accepted a message.
+    """
+
 # ################################################################################################################################
 
 class _AMQPMessage(object):
@@ -56,6 +69,39 @@ class _AMQPMessage(object):
 
 # ################################################################################################################################
 
+class _AckState(object):
+    """ Keeps track of messages dispatched to a pool of greenlets by a consumer, so that they can be acknowledged in batches,
+    using multiple=True, once all the messages received before them have been handled too. Delivery tags are unique only
+    within an AMQP channel which is why a new object is created each time a consumer's connection is established anew.
+    """
+    __slots__ = ('delivery_tags', 'done', 'by_routing_key', 'ack_msg', 'ack_received_at', 'ack_since', 'has_unsettled')
+
+    def __init__(self):
+
+        # Delivery tags of all messages not handled yet, in the order they were received in
+        self.delivery_tags = deque()
+
+        # Delivery tag -> (message, time it was received at, whether it needs to be acknowledged or rejected by us)
+        self.done = {}
+
+        # Routing key -> messages waiting for other ones with the same routing key to be handled first
+        self.by_routing_key = {}
+
+        # The newest message that can be acknowledged, along with all the ones before it
+        self.ack_msg = None
+
+        # When each message waiting to be acknowledged was received
+        self.ack_received_at = []
+
+        # When the first message waiting to be acknowledged was handled
+        self.ack_since = None
+
+        # Set to True if there was a message that was not acknowledged nor rejected because of an error,
+        # in which case multiple=True cannot be used anymore because it would acknowledge that message too.
+        self.has_unsettled = False
+
+# ################################################################################################################################
+
 class _AMQPProducers(object):
     """ Encapsulates information about producers used by outgoing AMQP connection to send messages to a broker.
     Each outgoing connection has one _AMQPProducers object assigned.
@@ -104,12 +150,162 @@ class Consumer(object):
         self.is_connected = False # Instance-level flag indicating whether we have an active connection now.
         self.timeout = 0.35
 
+        # If there is a dispatch pool, messages are handled concurrently and acknowledged in batches
+        self.dispatch_pool_size = int(self.config.get('dispatch_pool_size') or 0)
+        self.preserve_order = bool(self.config.get('preserve_order'))
+        self.ack_batch_size = int(self.config.get('ack_batch_size') or 100)
+        self.ack_batch_time = float(self.config.get('ack_batch_time') or 0.05)
+        self.pool = Pool(self.dispatch_pool_size) if self.dispatch_pool_size else None
+        self.ack_state = _AckState()
+
+        # Metrics
+        self.in_flight = 0
+        self.acks_sent = 0
+        self.msgs_acked = 0
+        self.ack_latency_total = 0.0
+        self.ack_latency_max = 0.0
+
     def _on_amqp_message(self, body, msg):
+        if self.pool is not None:
+            return self._dispatch(body, msg)
+
         try:
             return self.on_amqp_message(body, msg, self.name, self.config)
         except Exception, e:
             logger.warn(format_exc(e))
 
+# ################################################################################################################################
+
+    def _dispatch(self, body, msg, _time=time):
+        """ Hands a message over to the dispatch pool, blocking until there is a free greenlet in it. If messages are to be
+        handled in order, and there is already one with the same routing key being handled, the message waits for its turn.
+        """
+        ack_state = self.ack_state
+        ack_state.delivery_tags.append(msg.delivery_tag)
+        received_at = _time()
+        self.in_flight += 1
+
+        if self.preserve_order:
+            routing_key = msg.delivery_info.get('routing_key')
+            waiting = ack_state.by_routing_key.get(routing_key)
+
+            if waiting is not None:
+                waiting.append((body, msg, received_at))
+                return
+            else:
+                ack_state.by_routing_key[routing_key] = deque()
+        else:
+            routing_key = None
+
+        self.pool.spawn(self._handle, ack_state, routing_key, body, msg, received_at)
+
+# ################################################################################################################################
+
+    def _handle(self, ack_state, routing_key, body, msg, received_at):
+        """ Invokes the channel's service for a message and, if order is to be preserved, for each message with the same
+        routing key that arrived in the meantime.
+        """
+        while True:
+            try:
+                needs_ack = self.on_amqp_message(body, msg, self.name, self.config, True)
+            except Exception, e:
+                needs_ack = None
+                logger.warn(format_exc(e))
+
+            self.in_flight -= 1
+            ack_state.done[msg.delivery_tag] = (msg, received_at, needs_ack)
+
+            if not self.preserve_order:
+                return
+
+            waiting = ack_state.by_routing_key[routing_key]
+            if waiting:
+                body, msg, received_at = waiting.popleft()
+            else:
+                del ack_state.by_routing_key[routing_key]
+                return
+
+# ################################################################################################################################
+
+    def _send_ack(self, ack_state, _time=time):
+        """ Acknowledges the newest message that can be acknowledged along with all the ones received before it.
+        """
+        ack_state.ack_msg.ack(multiple=True)
+        now = _time()
+
+        for received_at in ack_state.ack_received_at:
+            latency = now - received_at
+            self.ack_latency_total += latency
+            self.ack_latency_max = max(self.ack_latency_max, latency)
+
+        self.acks_sent += 1
+        self.msgs_acked += len(ack_state.ack_received_at)
+
+        ack_state.ack_msg = None
+        ack_state.ack_received_at = []
+        ack_state.ack_since = None
+
+# ################################################################################################################################
+
+    def flush_acks(self, force=False, _time=time):
+        """ Acknowledges messages handled so far if there are enough of them, if they have been waiting long enough
+        or if told to regardless of either. Must be called from the consumer's own greenlet only because the channel
+        must not be written to by more than one greenlet at a time.
+        """
+        ack_state = self.ack_state
+        delivery_tags = ack_state.delivery_tags
+        done = ack_state.done
+        now = _time()
+
+        # Go through all the messages that were handled, in the order they were received in ..
+        while delivery_tags and delivery_tags[0] in done:
+            msg, received_at, needs_ack = done.pop(delivery_tags.popleft())
+
+            # .. skip ones that were already acknowledged or rejected by their services ..
+            if needs_ack is False:
+                continue
+
+            # .. reject the ones that need it - this does not affect acknowledging the others with multiple=True ..
+            if needs_ack == _REJECT:
+                msg.reject()
+                continue
+
+            # .. and leave unacknowledged the ones that failed, as they would be without a dispatch pool.
+            if needs_ack is None:
+                if ack_state.ack_msg:
+                    self._send_ack(ack_state)
+                ack_state.has_unsettled = True
+                continue
+
+            ack_state.ack_msg = msg
+            ack_state.ack_received_at.append(received_at)
+            ack_state.ack_since = ack_state.ack_since or now
+
+            # With an unsettled message in the channel, each message needs to be acknowledged individually
+            if ack_state.has_unsettled:
+                msg.ack()
+                self.acks_sent += 1
+                self.msgs_acked += 1
+                ack_state.ack_msg = None
+                ack_state.ack_received_at = []
+                ack_state.ack_since = None
+
+        if ack_state.ack_msg:
+            if force or len(ack_state.ack_received_at) >= self.ack_batch_size or now - ack_state.ack_since >= self.ack_batch_time:
+                self._send_ack(ack_state)
+
+# ################################################################################################################################
+
+    def get_metrics(self):
+        return {
+            'in_flight': self.in_flight,
+            'awaiting_ack': len(self.ack_state.done) + len(self.ack_state.ack_received_at),
+            'acks_sent': self.acks_sent,
+            'msgs_acked': self.msgs_acked,
+            'ack_latency_total': self.ack_latency_total,
+            'ack_latency_max': self.ack_latency_max,
+        }
+
 # ################################################################################################################################
 
     def _get_consumer(self, _no_ack=no_ack, _gevent_sleep=sleep):
@@ -133,6 +329,9 @@ class Consumer(object):
                         self.config.consumer_tag_prefix, get_component_name('amqp-consumer')))
                 consumer.qos(prefetch_size=0, prefetch_count=self.config.prefetch_count, apply_global=False)
                 consumer.consume()
+
+                # Delivery tags of messages from previous connections, if any, cannot be acknowledged anymore
+                self.ack_state = _AckState()
             except Exception, e:
                 err_conn_attempts += 1
                 noun = 'attempts' if err_conn_attempts > 1 else 'attempt'
@@ -174,11 +373,20 @@ class Consumer(object):
 
                     connection = consumer.connection
 
+                    # Acknowledge messages handled by the dispatch pool so far, and if there are any still waiting
+                    # to be acknowledged, do not wait for new messages longer than until they need to be.
+                    if self.pool is not None:
+                        self.flush_acks()
+                        ack_state = self.ack_state
+                        drain_timeout = self.ack_batch_time if (ack_state.done or ack_state.ack_msg) else timeout
+                    else:
+                        drain_timeout = timeout
+
                     # Do not assume the consumer still has the connection, it may have been already closed, we don't know.
                     # Unfortunately, the only way to check it is to invoke the method and catch AttributeError
                     # if connection is already None.
                     try:
-                        connection.drain_events(timeout=timeout)
+                        connection.drain_events(timeout=drain_timeout)
                     except AttributeError:
                         consumer = self._get_consumer()
 
@@ -218,6 +426,14 @@ class Consumer(object):
                                 consumer = self._get_consumer()
                                 self.is_connected = True
 
+            # Give messages being handled a moment to complete and acknowledge all the ones that did
+            if self.pool is not None:
+                self.pool.join(timeout)
+                try:
+                    self.flush_acks(True)
+                except Exception, e:
+                    logger.warn('Could not acknowledge messages when stopping consumer `%s`, e:`%s`', self.name, format_exc(e))
+
             if connection:
                 logger.info('Closing connection for `%s`', consumer)
                 connection.close()
@@ -318,9 +534,10 @@ class ConnectorAMQP(Connector):
 
 # ################################################################################################################################
 
-    def on_amqp_message(self, body, msg, channel_name, channel_config, _AMQPMessage=_AMQPMessage, _CHANNEL_AMQP=CHANNEL.AMQP,
-        _RECEIVED='RECEIVED', _ZATO_ACK_MODE_ACK=AMQP.ACK_MODE.ACK.id):
-        """ Invoked each time a message is taken off an AMQP queue.
+    def on_amqp_message(self, body, msg, channel_name, channel_config, needs_ack_batch=False, _AMQPMessage=_AMQPMessage,
+        _CHANNEL_AMQP=CHANNEL.AMQP, _RECEIVED='RECEIVED', _ZATO_ACK_MODE_ACK=AMQP.ACK_MODE.ACK.id):
+        """ Invoked each time a message is taken off an AMQP queue. If needs_ack_batch is True, messages are neither
+        acknowledged nor rejected here, instead our caller is told what to do with each, as described for _REJECT.
         """
         self.on_message_callback(
             channel_config['service_name'], body, channel=_CHANNEL_AMQP,
@@ -332,11 +549,18 @@ class ConnectorAMQP(Connector):
                 'amqp_msg': msg,
             }})
 
-        if msg._state == _RECEIVED:
-            if channel_config['ack_mode'] == _ZATO_ACK_MODE_ACK:
-                msg.ack()
-            else:
-                msg.reject()
+        # The service has already acknowledged or rejected the message itself
+        if msg._state != _RECEIVED:
+            return False
+
+        if channel_config['ack_mode'] == _ZATO_ACK_MODE_ACK:
+            if needs_ack_batch:
+                return True
+            msg.ack()
+        else:
+            if needs_ack_batch:
+                return _REJECT
+            msg.reject()
 
 # ################################################################################################################################
 
@@ -355,6 +579,10 @@ class ConnectorAMQP(Connector):
         config.conn_class = self._get_conn_class('channel/{}'.format(config.name))
         config.conn_url = self.config.conn_url
 
+        # Options kept in opaque attributes, if the channel was read from ODB rather than received in a broker message
+        for key, value in (config.get('opaque1') or {}).items():
+            config.setdefault(key, value)
+
 # ################################################################################################################################
 
     def create_channels(self):
@@ -496,6 +724,40 @@ class ConnectorAMQP(Connector):
 
         logger.info('Deleted channel `%s` from AMQP connector `%s`', config.name, self.config.name)
 
+# ################################################################################################################################
+
+    def get_channel_metrics(self, channel_name):
+        # type: (str)
+        """ Returns metrics of all consumers of a given channel, i.e. how many messages they are handling now
+        and how long it takes to acknowledge them.
+        """
+        out = {
+            'consumers': 0,
+            'in_flight': 0,
+            'awaiting_ack': 0,
+            'acks_sent': 0,
+            'msgs_acked': 0,
+            'ack_latency_mean': 0.0,
+            'ack_latency_max': 0.0,
+        }
+
+        ack_latency_total = 0.0
+
+        for consumer in self._consumers.get(channel_name, []):
+            metrics = consumer.get_metrics()
+            out['consumers'] += 1
+            out['in_flight'] += metrics['in_flight']
+            out['awaiting_ack'] += metrics['awaiting_ack']
+            out['acks_sent'] += metrics['acks_sent']
+            out['msgs_acked'] += metrics['msgs_acked']
+            out['ack_latency_max'] = max(out['ack_latency_max'], metrics['ack_latency_max'])
+            ack_latency_total += metrics['ack_latency_total']
+
+        if out['msgs_acked']:
+            out['ack_latency_mean'] = ack_latency_total / out['msgs_acked']
+
+        return out
+
 # ################################################################################################################################
 
     def _create_outconn(self, config):
@@ -552,10 +814,10 @@ class ConnectorAMQP(Connector):
 
 # ################################################################################################################################
 
-    def invoke(self, out_name, msg, exchange='/', routing_key=None, properties=None, headers=None,
-            _default_out_keys=_default_out_keys, **kwargs):
-        # type: (str, str, str, str, dict, dict, Any, Any)
-        """ Synchronously publishes a message to an AMQP broker.
+    def _get_publish_kwargs(self, out_name, exchange, routing_key, properties, _default_out_keys=_default_out_keys):
+        # type: (str, str, str, dict, Any) -> dict
+        """ Returns kwargs to publish messages through an outgoing connection with, based on user input falling back
+        to the defaults as specified in the outgoing connection's configuration.
         """
         with self.lock:
             outconn_config = self.outconns[out_name]
@@ -564,12 +826,7 @@ class ConnectorAMQP(Connector):
         if not outconn_config['is_active']:
             raise Inactive('Connection is inactive `{}` ({})'.format(out_name, self._get_conn_string(False)))
 
-        acquire_block = kwargs.pop('acquire_block', True)
-        acquire_timeout = kwargs.pop('acquire_block', None)
-
-        # Dictionary of kwargs is built based on user input falling back to the defaults
-        # as specified in the outgoing connection's configuration.
-        properties = properties or {}
+        properties = dict(properties) if properties else {}
         kwargs = {'exchange':exchange, 'routing_key':routing_key}
 
         for key in _default_out_keys:
@@ -583,7 +840,134 @@ class ConnectorAMQP(Connector):
         if properties:
             kwargs.update(properties)
 
+        return kwargs
+
+# ################################################################################################################################
+
+    def invoke(self, out_name, msg, exchange='/', routing_key=None, properties=None, headers=None, **kwargs):
+        # type: (str, str, str, str, dict, dict, Any)
+        """ Synchronously publishes a message to an AMQP broker.
+        """
+        acquire_block = kwargs.pop('acquire_block', True)
+        acquire_timeout = kwargs.pop('acquire_timeout', None)
+
+        kwargs = self._get_publish_kwargs(out_name, exchange, routing_key, properties)
+
         with self._producers[out_name].acquire(acquire_block, acquire_timeout) as producer:
             return producer.publish(msg, headers=headers, **kwargs)
 
+# ################################################################################################################################
+
+    def invoke_many(self, out_name, msg_list, exchange='/', routing_key=None, properties=None, headers=None, confirm=False,
+            confirm_window=100, confirm_timeout=10, **kwargs):
+        # type: (str, list, str, str, dict, dict, bool, int, float, Any) -> list
+        """ Synchronously publishes a list of messages to an AMQP broker, using a single producer and AMQP channel
+        for all of them. If confirm is True, publisher confirms are used - up to confirm_window messages are published
+        before waiting for the broker to confirm the oldest ones and confirm_timeout is how many seconds to wait for
+        confirmations after the last message is published. Returns a list of outcomes, one for each message - True if
+        a message was published (and confirmed, if requested) or an exception explaining why it was not.
+        """
+        acquire_block = kwargs.pop('acquire_block', True)
+        acquire_timeout = kwargs.pop('acquire_timeout', None)
+
+        kwargs = self._get_publish_kwargs(out_name, exchange, routing_key, properties)
+        out = [None] * len(msg_list)
+
+        with self._producers[out_name].acquire(acquire_block, acquire_timeout) as producer:
+
+            if not confirm:
+                for idx, msg in enumerate(msg_list):
+                    try:
+                        producer.publish(msg, headers=headers, **kwargs)
+                    except Exception, e:
+                        # The AMQP channel cannot be used anymore, so none of the remaining messages will be published
+                        out[idx:] = [e] * (len(msg_list) - idx)
+                        break
+                    else:
+                        out[idx] = True
+
+                return out
+
+            # Publisher confirms are enabled for an AMQP channel as a whole and cannot be disabled later on,
+            # which is why a new one is opened instead of using the producer's own channel, shared with other publishers.
+            connection = producer.connection
+            channel = connection.channel()
+
+            try:
+                self._publish_confirm(connection, channel, out, msg_list, headers, kwargs, confirm_window, confirm_timeout)
+            finally:
+                try:
+                    channel.close()
+                except Exception, e:
+                    logger.info('Could not close AMQP channel of outconn `%s`, e:`%s`', out_name, format_exc(e))
+
+        return out
+
+# ################################################################################################################################
+
+    def _publish_confirm(self, connection, channel, out, msg_list, headers, kwargs, confirm_window, confirm_timeout,
+            _time=time):
+        # type: (Connection, object, list, list, dict, dict, int, float)
+
+        # Delivery tag -> index of a message that was published but not confirmed yet. Delivery tags of confirmations
+        # start from 1 in each AMQP channel and are assigned in the order messages are published in.
+        pending = OrderedDict()
+
+        def on_confirm(delivery_tag, multiple, is_ok):
+            if multiple:
+                while pending:
+                    tag = next(iter(pending))
+                    if tag > delivery_tag:
+                        break
+                    out[pending.pop(tag)] = True if is_ok else NotConfirmed('Message rejected by broker')
+            else:
+                idx = pending.pop(delivery_tag, None)
+                if idx is not None:
+                    out[idx] = True if is_ok else NotConfirmed('Message rejected by broker')
+
+        channel.events['basic_ack'].add(lambda delivery_tag, multiple: on_confirm(delivery_tag, multiple, True))
+        channel.events['basic_nack'].add(lambda delivery_tag, multiple: on_confirm(delivery_tag, multiple, False))
+        channel.confirm_select()
+
+        batch_producer = Producer(channel)
+        error = None
+
+        for idx, msg in enumerate(msg_list):
+
+            # Wait until there is room in the window before publishing more
+            while len(pending) >= confirm_window:
+                try:
+                    connection.drain_events(timeout=confirm_timeout)
+                except socket_timeout:
+                    error = NotConfirmed('Message not confirmed within {}s'.format(confirm_timeout))
+                    break
+
+            if error:
+                out[idx:] = [error] * (len(msg_list) - idx)
+                break
+
+            try:
+                batch_producer.publish(msg, headers=headers, **kwargs)
+            except Exception, e:
+                out[idx:] = [e] * (len(msg_list) - idx)
+                error = e
+                break
+            else:
+                pending[idx + 1] = idx
+
+        # Wait for confirmations of all the messages still pending, unless the channel is already known not to work
+        if not error:
+            until = _time() + confirm_timeout
+            while pending:
+                now = _time()
+                if now >= until:
+                    break
+                try:
+                    connection.drain_events(timeout=until - now)
+                except socket_timeout:
+                    break
+
+        for idx in pending.itervalues():
+            out[idx] = error or NotConfirmed('Message not confirmed within {}s'.format(confirm_timeout))
+
 # ################################################################################################################################
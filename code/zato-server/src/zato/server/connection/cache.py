@@ -9,8 +9,15 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from json import dumps, loads
 from logging import getLogger
 from traceback import format_exc
+from zlib import compress, decompress
+
+# Bunch
+from bunch import Bunch
 
 # gevent
 from gevent import sleep, spawn
@@ -54,12 +61,23 @@ builtin_ops = [
 ]
 
 builtin_op_to_broker_msg = {}
+builtin_op_to_sync_func_name = {}
 
 for builtin_op in builtin_ops:
     common_key = getattr(CACHE.STATE_CHANGED, builtin_op)
     broker_msg_value = getattr(CACHE_BROKER_MSG, 'BUILTIN_STATE_CHANGED_{}'.format(builtin_op)).value
 
     builtin_op_to_broker_msg[common_key] = broker_msg_value
+    builtin_op_to_sync_func_name[common_key] = 'sync_after_{}'.format(builtin_op.lower())
+
+# Single-key operations that replace a key's value - any earlier operation on the same key buffered in a sync batch
+# becomes redundant once one of these is added to the batch.
+_sync_batch_value_ops = (CACHE.STATE_CHANGED.SET, CACHE.STATE_CHANGED.DELETE)
+
+# Parts of keys under which operations are buffered in a sync batch
+_sync_batch_value = 'value'
+_sync_batch_expiry = 'expiry'
+_sync_batch_other = 'other'
 
 # ################################################################################################################################
 
@@ -74,9 +92,14 @@ class Cache(object):
     def __init__(self, config):
         self.config = config
         self.after_state_changed_callback = self.config.after_state_changed_callback
-        self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self.after_state_changed_batch_callback = self.config.get('after_state_changed_batch_callback')
+        self.sync_batch = OrderedDict()
+        self.sync_batch_seq = 0
+        self.has_sync_batch_loop = False
+        self.keep_running = True
+        self._set_sync_method()
         self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
-            self.config.extend_expiry_on_set)
+            self.config.extend_expiry_on_set, self.config.get('max_total_size'), self.config.get('use_key_index'))
         spawn(self._delete_expired)
 
 # ################################################################################################################################
@@ -172,7 +195,7 @@ class Cache(object):
         meta_ref = {'key':key, 'value':value, 'expiry':expiry} if self.needs_sync else None
         value = self.impl.set(key, value, expiry, meta_ref)
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self.after_state_changed(_OP, self.config.name, meta_ref)
 
         return value
 
@@ -185,7 +208,7 @@ class Cache(object):
         """
         out = self.impl.set_by_prefix(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -198,7 +221,7 @@ class Cache(object):
         """
         out = self.impl.set_by_suffix(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -211,7 +234,7 @@ class Cache(object):
         """
         out = self.impl.set_by_regex(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -224,7 +247,7 @@ class Cache(object):
         """
         out = self.impl.set_contains(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -237,7 +260,7 @@ class Cache(object):
         """
         out = self.impl.set_not_contains(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -250,7 +273,7 @@ class Cache(object):
         """
         out = self.impl.set_contains_all(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -263,7 +286,7 @@ class Cache(object):
         """
         out = self.impl.set_contains_any(key, value, expiry, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'value':value, 'expiry':expiry})
 
         return out
 
@@ -279,7 +302,7 @@ class Cache(object):
                 raise
         else:
             if self.needs_sync:
-                spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+                self.after_state_changed(_OP, self.config.name, {'key':key})
 
             return value
 
@@ -291,7 +314,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_prefix(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -303,7 +326,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_suffix(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -315,7 +338,7 @@ class Cache(object):
         """
         out = self.impl.delete_by_regex(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -327,7 +350,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -339,7 +362,7 @@ class Cache(object):
         """
         out = self.impl.delete_not_contains(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -351,7 +374,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains_all(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -363,7 +386,7 @@ class Cache(object):
         """
         out = self.impl.delete_contains_any(key, return_found)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+            self.after_state_changed(_OP, self.config.name, {'key':key})
 
         return out
 
@@ -376,7 +399,7 @@ class Cache(object):
         found_key = self.impl.expire(key, expiry, meta_ref)
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self.after_state_changed(_OP, self.config.name, meta_ref)
 
         return found_key
 
@@ -387,7 +410,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_prefix(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -398,7 +421,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_suffix(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -409,7 +432,7 @@ class Cache(object):
         """
         out = self.impl.expire_by_regex(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -420,7 +443,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -431,7 +454,7 @@ class Cache(object):
         """
         out = self.impl.expire_not_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -442,7 +465,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains_all(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -453,7 +476,7 @@ class Cache(object):
         """
         out = self.impl.expire_contains_any(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key, 'expiry':expiry})
+            self.after_state_changed(_OP, self.config.name, {'key':key, 'expiry':expiry})
 
         return out
 
@@ -507,21 +530,133 @@ class Cache(object):
         self.impl.clear()
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _CLEAR, self.config.name, {})
+            self.after_state_changed(_CLEAR, self.config.name, {})
 
 # ################################################################################################################################
 
     def update_config(self, config):
-        self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self.config.update(config)
+        self._set_sync_method()
         self.impl.update_config(config)
 
+# ################################################################################################################################
+
+    def close(self):
+        """ Stops background greenlets of a cache that is being deleted. State changes not sent out yet are discarded
+        because other worker processes delete their copies of this cache too.
+        """
+        self.keep_running = False
+        self.sync_batch.clear()
+
+# ################################################################################################################################
+
+    def _set_sync_method(self, _no_sync=CACHE.SYNC_METHOD.NO_SYNC.id, _in_batches=CACHE.SYNC_METHOD.IN_BATCHES.id):
+        """ Sets up synchronization of state changes with other worker processes according to current configuration.
+        """
+        self.needs_sync = self.config.sync_method != _no_sync
+        self.sync_in_batches = self.config.sync_method == _in_batches
+        self.sync_batch_window = (self.config.get('sync_batch_window') or CACHE.DEFAULT.SYNC_BATCH_WINDOW) / 1000.0
+
+        if self.sync_in_batches:
+            self.after_state_changed = self._add_to_sync_batch
+            if not self.has_sync_batch_loop:
+                self.has_sync_batch_loop = True
+                spawn(self._send_sync_batches)
+        else:
+            self.after_state_changed = self._spawn_after_state_changed
+
+# ################################################################################################################################
+
+    def _spawn_after_state_changed(self, op, cache_name, data):
+        """ Publishes a state change to other worker processes in a new greenlet, one message per change.
+        """
+        spawn(self.after_state_changed_callback, op, cache_name, data)
+
+# ################################################################################################################################
+
+    def _add_to_sync_batch(self, op, cache_name, data, _CLEAR=CACHE.STATE_CHANGED.CLEAR,
+        _EXPIRE=CACHE.STATE_CHANGED.EXPIRE, _value_ops=_sync_batch_value_ops, _value=_sync_batch_value,
+        _expiry=_sync_batch_expiry, _other=_sync_batch_other):
+        """ Buffers a state change until the next batch is sent out. A set or delete of a key supersedes all changes
+        to this key buffered so far, an expire supersedes the previous expire only. A clear supersedes everything.
+        Other operations are kept in the order they were made in.
+        """
+        if op in _value_ops:
+            key = data['key']
+            self.sync_batch.pop((key, _value), None)
+            self.sync_batch.pop((key, _expiry), None)
+            batch_key = (key, _value)
+
+        elif op == _EXPIRE:
+            key = data['key']
+            self.sync_batch.pop((key, _expiry), None)
+            batch_key = (key, _expiry)
+
+        else:
+            if op == _CLEAR:
+                self.sync_batch.clear()
+            self.sync_batch_seq += 1
+            batch_key = (self.sync_batch_seq, _other)
+
+        self.sync_batch[batch_key] = (op, data)
+
+# ################################################################################################################################
+
+    def _flush_sync_batch(self):
+        """ Sends out all state changes buffered so far, if there are any.
+        """
+        if self.sync_batch:
+            batch, self.sync_batch = self.sync_batch, OrderedDict()
+            self.after_state_changed_batch_callback(self.config.name, batch.values())
+
+# ################################################################################################################################
+
+    def _send_sync_batches(self, _sleep=sleep):
+        """ Invokes in its own greenlet in background to send out buffered state changes each sync_batch_window seconds,
+        for as long as the cache is configured to synchronize in batches.
+        """
+        try:
+            while self.sync_in_batches and self.keep_running:
+                try:
+                    _sleep(self.sync_batch_window)
+                    self._flush_sync_batch()
+                except Exception, e:
+                    logger.warn('Exception while sending sync batch %s', format_exc(e))
+                    _sleep(2)
+
+            # Sync method was changed - send out anything that may be still buffered, unless the cache was closed
+            if self.keep_running:
+                self._flush_sync_batch()
+
+        except Exception, e:
+            logger.warn('Exception in _send_sync_batches loop %s', format_exc(e))
+
+        finally:
+            self.has_sync_batch_loop = False
+
+# ################################################################################################################################
+
+    @property
+    def total_size(self):
+        """ Approximate size of all keys and values in the cache, in bytes.
+        """
+        return self.impl.total_size
+
+# ################################################################################################################################
+
+    @property
+    def evictions(self):
+        """ How many entries were evicted from the cache to make room for new ones.
+        """
+        return self.impl.evictions
+
 # ################################################################################################################################
 
     def _delete_expired(self, interval=5, _sleep=sleep):
         """ Invokes in its own greenlet in background to delete expired cache entries.
         """
         try:
-            while True:
+            while self.keep_running:
                 try:
                     _sleep(interval)
                     deleted = self.impl.delete_expired()
@@ -684,6 +819,20 @@ class Cache(object):
         """
         self.impl.clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, batch, _CLEAR=CACHE.STATE_CHANGED.CLEAR, _sync_func_name=builtin_op_to_sync_func_name):
+        """ Invoked by Cache API to synchronizes this worker's cache after a batch of operations in another worker process.
+        """
+        for op, data in batch:
+            try:
+                if op == _CLEAR:
+                    self.sync_after_clear()
+                else:
+                    getattr(self, _sync_func_name[op])(Bunch(data))
+            except Exception, e:
+                logger.warn('Could not sync `%s` in cache `%s`, data:`%s`, e:`%s`', op, self.config.name, data, format_exc(e))
+
 # ################################################################################################################################
 
 class _NotConfiguredAPI(object):
@@ -726,12 +875,35 @@ class CacheAPI(object):
             logger.warn('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
                 op, cache_name, data, format_exc(e))
 
+# ################################################################################################################################
+
+    def after_state_changed_batch(self, cache_name, batch, _action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        """ Callback method invoked by each cache that synchronizes with other worker processes in batches.
+        The whole batch is sent in one compressed broker message.
+        """
+        try:
+            self.server.broker_client.publish({
+                'action': _action,
+                'cache_name': cache_name,
+                'source_worker_id': self.server.worker_id,
+                'data': b64encode(compress(dumps(batch))),
+            })
+        except Exception, e:
+            logger.warn('Could not run after_state_changed_batch in cache `%s`, batch:`%s`, e:`%s`',
+                cache_name, batch, format_exc(e))
+
 # ################################################################################################################################
 
     def _create_builtin(self, config):
         """ A low-level method building a bCache object for built-in caches. Must be called with self.lock held.
         """
         config.after_state_changed_callback = self.after_state_changed
+        config.after_state_changed_batch_callback = self.after_state_changed_batch
+
+        # Options kept in opaque attributes, if the cache was read from ODB rather than received in a broker message
+        for key, value in (config.get('opaque1') or {}).items():
+            config.setdefault(key, value)
+
         return Cache(config)
 
 # ################################################################################################################################
@@ -812,6 +984,7 @@ class CacheAPI(object):
 
         if cache_type == CACHE.TYPE.BUILTIN:
             self._clear(cache_type, name)
+            cache.close()
         else:
             cache.disconnect_all()
 
@@ -850,10 +1023,20 @@ class CacheAPI(object):
 
 # ################################################################################################################################
 
-    def get_size(self, cache_type, name):
-        """ Returns current size, the number of entries, in a given cache.
+    def get_size(self, cache_type, name, details=False):
+        """ Returns current size, the number of entries, in a given cache. If details is True, returns a dictionary
+        with the number of entries, their approximate size in bytes and how many entries have been evicted so far.
         """
-        return len(self.caches[cache_type][name])
+        cache = self.caches[cache_type][name]
+
+        if details:
+            return {
+                'current_size': len(cache),
+                'current_size_bytes': cache.total_size,
+                'evictions': cache.evictions,
+            }
+
+        return len(cache)
 
 # ################################################################################################################################
 
@@ -988,4 +1171,11 @@ class CacheAPI(object):
         """
         self.caches[cache_type][data.cache_name].sync_after_clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, cache_type, data):
+        """ Synchronizes the state of this worker's cache after a batch of operations in another worker process.
+        """
+        self.caches[cache_type][data.cache_name].sync_after_batch(loads(decompress(b64decode(data.data))))
+
 # ################################################################################################################################
@@ -408,10 +408,24 @@ class ConnectorStore(object):
         # type: (str, Any, Any)
         return self.connectors[name].invoke(*args, **kwargs)
 
+    def invoke_many(self, name, *args, **kwargs):
+        # type: (str, Any, Any)
+        return self.connectors[name].invoke_many(*args, **kwargs)
+
 # ################################################################################################################################
 
     def notify_pubsub_message(self, name, *args, **kwargs):
         # type: (str, Any, Any)
         return self.connectors[name].notify_pubsub_message(*args, **kwargs)
 
+# ################################################################################################################################
+
+    def get_metrics(self, name):
+        # type: (str)
+        return self.connectors[name].get_metrics()
+
+    def get_channel_metrics(self, name, channel_name):
+        # type: (str, str)
+        return self.connectors[name].get_channel_metrics(channel_name)
+
 # ################################################################################################################################
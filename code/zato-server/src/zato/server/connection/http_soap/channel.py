@@ -15,6 +15,8 @@ from gzip import GzipFile
 from hashlib import sha256
 from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
 from traceback import format_exc
+from types import GeneratorType
+from zlib import compressobj, DEFLATED, MAX_WBITS, Z_DEFAULT_COMPRESSION
 
 # anyjson
 from anyjson import dumps, loads
@@ -53,6 +55,21 @@ _status_too_many_requests = b'{} {}'.format(TOO_MANY_REQUESTS, HTTP_RESPONSES[TO
 
 # ################################################################################################################################
 
+def gzip_chunks(chunks, _compressobj=compressobj, _Z_DEFAULT_COMPRESSION=Z_DEFAULT_COMPRESSION, _DEFLATED=DEFLATED):
+    """ Compresses an iterable of chunks into gzip format as the chunks are produced.
+    """
+    # 16 + MAX_WBITS makes zlib write the gzip header and trailer
+    compressor = _compressobj(_Z_DEFAULT_COMPRESSION, _DEFLATED, 16 + MAX_WBITS)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+# ################################################################################################################################
+
 status_response = {}
 for code, response in HTTP_RESPONSES.items():
     status_response[code] = b'{} {}'.format(code, response)
@@ -191,7 +208,8 @@ class RequestDispatcher(object):
 
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store, _status_response=status_response,
         no_url_match=(None, False), _response_404=response_404, _has_debug=_has_debug,
-        _http_soap_action='HTTP_SOAPACTION', _stringio=StringIO, _gzipfile=GzipFile):
+        _http_soap_action='HTTP_SOAPACTION', _stringio=StringIO, _gzipfile=GzipFile, _generator_type=GeneratorType,
+        _gzip_chunks=gzip_chunks):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
         configuration is one of the technical account or HTTP basic auth,
         the security validation is being performed. Otherwise, that step
@@ -273,15 +291,20 @@ class RequestDispatcher(object):
 
                 if channel_item['content_encoding'] == 'gzip':
 
-                    s = _stringio()
-                    with _gzipfile(fileobj=s, mode='w') as f:
-                        f.write(response.payload)
-                    response.payload = s.getvalue()
-                    s.close()
+                    # Streamed responses are compressed chunk by chunk
+                    if isinstance(response.payload, _generator_type):
+                        response.payload = _gzip_chunks(response.payload)
+                    else:
+                        s = _stringio()
+                        with _gzipfile(fileobj=s, mode='w') as f:
+                            f.write(response.payload)
+                        response.payload = s.getvalue()
+                        s.close()
 
                     wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
 
-                # Finally return payload to the client
+                # Finally return payload to the client - note that it may be a generator of chunks if output is streamed,
+                # in which case it will be sent using chunked transfer encoding.
                 return response.payload
 
             except Exception, e:
@@ -464,7 +487,7 @@ class RequestHandler(object):
 # ################################################################################################################################
 
     def handle(self, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config, post_data,
-            path_info, soap_action, channel_type=CHANNEL.HTTP_SOAP, _response_404=response_404):
+            path_info, soap_action, channel_type=CHANNEL.HTTP_SOAP, _response_404=response_404, _generator_type=GeneratorType):
         """ Create a new instance of a service and invoke it.
         """
         service, is_active = self.server.service_store.new_instance(channel_item.service_impl_name)
@@ -496,6 +519,11 @@ class RequestHandler(object):
 
         # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
         if channel_item['cache_type']:
+
+            # A streamed response needs to be read in full before it can be cached
+            if isinstance(response.payload, _generator_type):
+                response.payload = b''.join(response.payload)
+
             self.set_response_in_cache(channel_item, cache_key, response)
 
         # Having used the cache or not, we can return the response now
@@ -553,6 +581,13 @@ class RequestHandler(object):
             if not isinstance(response.payload, basestring):
                 if isinstance(response.payload, dict) and data_format in (DATA_FORMAT.JSON, DATA_FORMAT.DICT):
                     response.payload = dumps(response.payload)
+
+                # Repeated JSON output from services with SimpleIO.output_stream set is serialized in chunks
+                # while it is being sent to the client.
+                elif getattr(response.payload, 'zato_output_stream', False) and data_format == DATA_FORMAT.JSON \
+                        and transport != URL_TYPE.SOAP:
+                    response.payload = response.payload.iter_json()
+
                 else:
                     response.payload = response.payload.getvalue() if response.payload else ''
 
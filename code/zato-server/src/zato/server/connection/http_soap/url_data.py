@@ -30,7 +30,7 @@ from zato.common.dispatch import dispatcher
 from zato.common.util import parse_tls_channel_security_definition, update_apikey_username_to_channel
 from zato.server.connection.http_soap import Forbidden, Unauthorized
 from zato.server.jwt import JWT
-from zato.url_dispatcher import CyURLData, Matcher
+from zato.url_dispatcher import CyURLData, default_url_cache_max_size, Matcher
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +48,9 @@ class URLData(CyURLData, OAuthDataStore):
                  openstack_config=None, xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, \
                  vault_conn_sec_config=None, kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None,
                  jwt_secret=None, vault_conn_api=None):
-        super(URLData, self).__init__(channel_data)
+        misc_config = worker.server.fs_server_config.get('misc') or {}
+        super(URLData, self).__init__(channel_data,
+            int(misc_config.get('http_url_cache_max_size', default_url_cache_max_size)))
         self.worker = worker
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -70,6 +72,12 @@ class URLData(CyURLData, OAuthDataStore):
         self.vault_conn_api = vault_conn_api
         self.rbac_auth_type_hooks = self.worker.server.fs_server_config.rbac.auth_type_hook
 
+        # One JWT backend for the whole worker, along with its cache of tokens validated already
+        self.jwt = JWT(self.kvdb, self.odb, self.jwt_secret,
+            int(misc_config.get('jwt_local_cache_size', 10000)),
+            float(misc_config.get('jwt_local_cache_ttl', 5)),
+            float(misc_config.get('jwt_renew_interval', 0))) if self.jwt_secret else None
+
         self.sec_config_getter = Bunch()
         self.sec_config_getter[SEC_DEF_TYPE.BASIC_AUTH] = self.basic_auth_get
         self.sec_config_getter[SEC_DEF_TYPE.APIKEY] = self.apikey_get
@@ -256,7 +264,7 @@ class URLData(CyURLData, OAuthDataStore):
                 return False
 
         token = authorization.split('Bearer ', 1)[1]
-        result = JWT(self.kvdb, self.odb, self.jwt_secret).validate(sec_def.username, token.encode('utf8'))
+        result = self.jwt.validate(sec_def.username, token.encode('utf8'))
 
         if not result.valid:
             if enforce_auth:
@@ -630,7 +638,8 @@ class URLData(CyURLData, OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
-            self.channel_data.pop(match_idx)
+            self.router.remove(self.channel_data.pop(match_idx))
+            self.router.set_positions(self.channel_data)
 
 # ################################################################################################################################
 
@@ -846,6 +855,12 @@ class URLData(CyURLData, OAuthDataStore):
         with self.url_sec_lock:
             return self.jwt_config.get(name)
 
+    def _clear_jwt_local(self):
+        """ Makes tokens cached locally be validated anew after a JWT security definition changed.
+        """
+        if self.jwt:
+            self.jwt.clear_local()
+
     def on_broker_msg_SECURITY_JWT_CREATE(self, msg, *args):
         """ Creates a new JWT security definition.
         """
@@ -859,6 +874,7 @@ class URLData(CyURLData, OAuthDataStore):
             del self.jwt_config[msg.old_name]
             self._update_jwt(msg.name, msg)
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
+            self._clear_jwt_local()
 
     def on_broker_msg_SECURITY_JWT_DELETE(self, msg, *args):
         """ Deletes a JWT security definition.
@@ -867,6 +883,7 @@ class URLData(CyURLData, OAuthDataStore):
             self._delete_channel_data('jwt', msg.name)
             del self.jwt_config[msg.name]
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT, True)
+            self._clear_jwt_local()
 
     def on_broker_msg_SECURITY_JWT_CHANGE_PASSWORD(self, msg, *args):
         """ Changes password of a JWT security definition.
@@ -874,6 +891,7 @@ class URLData(CyURLData, OAuthDataStore):
         with self.url_sec_lock:
             self.jwt_config[msg.name]['config']['password'] = msg.password
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
+            self._clear_jwt_local()
 
 # ################################################################################################################################
 
@@ -1131,6 +1149,7 @@ class URLData(CyURLData, OAuthDataStore):
         channel_data.extend(internal_services)
 
         self.channel_data[:] = channel_data
+        self.router.set_positions(self.channel_data)
 
 # ################################################################################################################################
 
@@ -1183,7 +1202,9 @@ class URLData(CyURLData, OAuthDataStore):
         Clears out URL cache for that entry, if it existed at all.
         """
         match_target = '{}{}{}'.format(msg.soap_action, MISC.SEPARATOR, msg.url_path)
-        self.channel_data.append(self._channel_item_from_msg(msg, match_target, old_data))
+        channel_item = self._channel_item_from_msg(msg, match_target, old_data)
+        self.channel_data.append(channel_item)
+        self.router.add(channel_item)
         self.url_sec[match_target] = self._sec_info_from_msg(msg)
         self.url_path_cache.pop(match_target, None)
         self.sort_channel_data()
@@ -1204,6 +1225,7 @@ class URLData(CyURLData, OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             old_data = self.channel_data.pop(match_idx)
+            self.router.remove(old_data)
         else:
             old_data = {}
 
@@ -1213,7 +1235,7 @@ class URLData(CyURLData, OAuthDataStore):
         # Delete from URL cache
         self.url_path_cache.pop(old_match_target, None)
 
-        # Re-sort all elements to match against
+        # Re-sort all elements to match against, this also updates their positions in the router
         self.sort_channel_data()
 
         return old_data
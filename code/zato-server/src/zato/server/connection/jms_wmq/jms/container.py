@@ -29,18 +29,20 @@ from json import dumps, loads
 from logging import DEBUG, Formatter, getLogger, StreamHandler
 from logging.handlers import RotatingFileHandler
 from os import getppid, path
+from Queue import Empty, Queue
+from SocketServer import ThreadingMixIn
 from thread import start_new_thread
 from threading import RLock
-from time import sleep
+from time import sleep, time
 from traceback import format_exc
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, ServerHandler, WSGIRequestHandler, WSGIServer
 import httplib
 
 # Bunch
 from bunch import bunchify
 
 # Requests
-from requests import post
+from requests import Session
 
 # YAML
 import yaml
@@ -90,6 +92,101 @@ _rc_not_authorized = 2035 # pymqi.CMQC.MQRC_NOT_AUTHORIZED
 
 # ################################################################################################################################
 
+class _KeepAliveServerHandler(ServerHandler):
+    """ Responds in HTTP/1.1 so that servers can keep their connections to us open across requests.
+    """
+    http_version = '1.1'
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    """ Handles all the requests sent over a connection rather than only the first one, as WSGIRequestHandler does.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        while True:
+            self.raw_requestline = self.rfile.readline(65537)
+
+            # Connection closed by the other side
+            if not self.raw_requestline:
+                return
+
+            if not self.parse_request():
+                return
+
+            handler = _KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+            handler.request_handler = self
+            handler.run(self.server.get_app())
+
+            if self.close_connection:
+                return
+
+    def log_message(self, *ignored):
+        """ Each request is logged by the container already.
+        """
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """ Each connection is handled in a thread of its own so that connections of all server processes are served at once.
+    """
+    daemon_threads = True
+
+def make_keep_alive_server(host, port, app):
+    return make_server(host, port, app, _ThreadingWSGIServer, _KeepAliveRequestHandler)
+
+# ################################################################################################################################
+
+class CallbackBatcher(object):
+    """ Sends messages taken off queues to a server in batches, each batch in one HTTP request over a persistent connection.
+    A batch is sent once it has batch_size messages or when batch_time seconds have elapsed since its first message arrived.
+    """
+    def __init__(self, address, auth, batch_size, batch_time, logger):
+        self.address = address
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self.logger = logger
+        self.queue = Queue()
+        self.keep_running = False
+
+        self.session = Session()
+        self.session.auth = auth
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def get_batch(self, _time=time):
+        """ Blocks until at least one message is available and returns all the ones that make up the next batch.
+        """
+        batch = [self.queue.get()]
+        until = _time() + self.batch_time
+
+        while len(batch) < self.batch_size:
+            timeout = until - _time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def send(self, batch):
+        try:
+            response = self.session.post(self.address, data=dumps({'msg_list': batch}))
+            if not response.ok:
+                self.logger.warn('Could not deliver %d message(s) to server, response:`%s`', len(batch), response.text)
+        except Exception:
+            self.logger.warn('Could not deliver %d message(s) to server, e:`%s`', len(batch), format_exc())
+
+    def run(self):
+        while self.keep_running:
+            self.send(self.get_batch())
+
+    def start(self):
+        self.keep_running = True
+        start_new_thread(self.run, ())
+
+# ################################################################################################################################
+
 class Response(object):
     def __init__(self, status=_http_200, data=b'', content_type='text/json'):
         self.status = status
@@ -160,8 +257,7 @@ class WebSphereMQChannel(object):
                         return
 
                     if msg:
-                        start_new_thread(_invoke_callback, (
-                            _MessageCtx(msg, self.id, self.queue_name, self.service_name, self.data_format),))
+                        _invoke_callback(_MessageCtx(msg, self.id, self.queue_name, self.service_name, self.data_format))
 
                 except NoMessageAvailableException as e:
                     if self.has_debug:
@@ -226,6 +322,7 @@ class ConnectionContainer(object):
         self.server_port = None
         self.server_path = None
         self.server_address = 'http://127.0.0.1:{}{}'
+        self.callback_batcher = None
 
         self.lock = RLock()
         self.logger = None
@@ -259,6 +356,10 @@ class ConnectionContainer(object):
         self.server_path = config.server_path
         self.server_address = self.server_address.format(self.server_port, self.server_path)
 
+        # Messages taken off queues are delivered to the server in batches
+        self.callback_batcher = CallbackBatcher(self.server_address, self.server_auth,
+            config.get('callback_batch_size', 100), config.get('callback_batch_time', 0.01), None)
+
         with open(config.logging_conf_path) as f:
             logging_config = yaml.load(f)
 
@@ -267,6 +368,7 @@ class ConnectionContainer(object):
             logging_config = default_logging_config
 
         self.set_up_logging(logging_config)
+        self.callback_batcher.logger = self.logger
 
 # ################################################################################################################################
 
@@ -295,14 +397,14 @@ class ConnectionContainer(object):
 
 # ################################################################################################################################
 
-    def on_mq_message_received(self, msg_ctx, _post=post):
-        _post(self.server_address, data=dumps({
+    def on_mq_message_received(self, msg_ctx):
+        self.callback_batcher.put({
             'msg': msg_ctx.mq_msg.to_dict(),
             'channel_id': msg_ctx.channel_id,
             'queue_name': msg_ctx.queue_name,
             'service_name': msg_ctx.service_name,
             'data_format': msg_ctx.data_format,
-        }), auth=self.server_auth)
+        })
 
 # ################################################################################################################################
 
@@ -562,6 +664,27 @@ class ConnectionContainer(object):
                 self.logger.warn(exc)
                 return Response(_http_503, exc)
 
+# ################################################################################################################################
+
+    def _on_OUTGOING_WMQ_SEND_BATCH(self, msg):
+        """ Sends a batch of messages to remote IBM MQ queues, returning a result of each send, in the same order.
+        """
+        out = []
+
+        for item in msg.msg_list:
+            try:
+                response = self._on_OUTGOING_WMQ_SEND(item)
+            except Exception:
+                self.logger.warn(format_exc())
+                out.append({'error': format_exc()})
+            else:
+                if response.status == _http_200:
+                    out.append(loads(response.data))
+                else:
+                    out.append({'error': response.data})
+
+        return Response(data=dumps(out))
+
 # ################################################################################################################################
 
     def _on_CHANNEL_WMQ_CREATE(self, msg):
@@ -683,7 +806,9 @@ class ConnectionContainer(object):
 # ################################################################################################################################
 
     def run(self):
-        server = make_server(self.host, self.port, self.on_wsgi_request)
+        self.callback_batcher.start()
+
+        server = make_keep_alive_server(self.host, self.port, self.on_wsgi_request)
         server.serve_forever()
 
 # ################################################################################################################################
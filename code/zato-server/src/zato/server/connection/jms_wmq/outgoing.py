@@ -40,6 +40,25 @@ class WMQFacade(object):
             'delivery_mode': delivery_mode,
         })
 
+# ################################################################################################################################
+
+    def send_batch(self, msg_list, outconn_name, queue_name, correlation_id='', msg_id='', reply_to='', expiration=None,
+        priority=None, delivery_mode=None):
+        """ Puts multiple messages on an IBM MQ MQ queue at once. Returns a list of results, one for each message,
+        which is either a WebSphereMQCallData object or an Exception if that particular message could not be sent.
+        """
+        return self.service.server.send_wmq_message_batch([{
+            'data': msg,
+            'outconn_name': outconn_name,
+            'queue_name': queue_name,
+            'correlation_id': correlation_id,
+            'msg_id': msg_id,
+            'reply_to': reply_to,
+            'expiration': expiration,
+            'priority': priority,
+            'delivery_mode': delivery_mode,
+        } for msg in msg_list])
+
 # ################################################################################################################################
 
     def conn(self):
@@ -9,12 +9,16 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import deque
 from copy import deepcopy
 from datetime import datetime, timedelta
 from errno import EADDRINUSE
+from heapq import heappop, heappush
 from httplib import BAD_REQUEST, INTERNAL_SERVER_ERROR, NOT_FOUND, responses
+from itertools import count
 from logging import getLogger
 from socket import error as SocketError
+from time import time
 from traceback import format_exc
 from urlparse import urlparse
 
@@ -22,7 +26,8 @@ from urlparse import urlparse
 from bunch import bunchify
 
 # gevent
-from gevent import sleep, socket, spawn
+from gevent import iwait, socket, spawn, Timeout
+from gevent.event import AsyncResult, Event
 from gevent.lock import RLock
 
 # pyrapidjson
@@ -85,6 +90,7 @@ class WebSocket(_WebSocket):
         self.config = config
         self.initial_http_wsgi_environ = wsgi_environ
         self.has_session_opened = False
+        self.session_opened = Event()
         self._token = None
         self.update_lock = RLock()
         self.pub_client_id = 'ws.{}'.format(new_cid())
@@ -111,8 +117,8 @@ class WebSocket(_WebSocket):
         for name in _wsgi_drop_keys:
             self.initial_http_wsgi_environ.pop(name, None)
 
-        # Responses to previously sent requests - keyed by request IDs
-        self.responses_received = {}
+        # Results that responses to previously sent requests will be set in - keyed by request IDs
+        self.responses_expected = {}
 
         _local_address = self.sock.getsockname()
         self._local_address = '{}:{}'.format(_local_address[0], _local_address[1])
@@ -278,6 +284,7 @@ class WebSocket(_WebSocket):
                 self.token = 'ws.token.{}'.format(self_token)
 
                 self.has_session_opened = True
+                self.session_opened.set()
                 self.ext_client_id = request.ext_client_id
                 self.ext_client_name = request.ext_client_name
 
@@ -300,51 +307,33 @@ class WebSocket(_WebSocket):
 
 # ################################################################################################################################
 
-    def send_background_pings(self, ping_extend=30):
-        try:
-            while self.stream:
-
-                # Sleep for N seconds before sending a ping but check if we are connected upfront because
-                # we could have disconnected in between while and sleep calls.
-                sleep(ping_extend)
-
-                # Ok, still connected
-                if self.stream:
-                    try:
-                        response = self.invoke_client(new_cid(), None, False)
-                    except RuntimeError:
-                        logger.warn('Closing connection due to `%s`', format_exc())
-                        self.on_socket_terminated()
-
-                    with self.update_lock:
-                        if response:
-                            self.pings_missed = 0
-                            self.ping_last_response_time = datetime.utcnow()
-                            self.token.extend(ping_extend)
-                        else:
-                            # self._peer_address, action, self._local_address, self.config.name
-                            self.pings_missed += 1
-                            if self.pings_missed < self.pings_missed_threshold:
-                                logger.warn(
-                                    'Peer %s (%s) missed %s/%s ping messages from %s (%s). Last response time: %s{}'.format(
-                                        ' UTC' if self.ping_last_response_time else ''),
-                                    self._peer_address, self._peer_fqdn, self.pings_missed, self.pings_missed_threshold,
-                                    self._local_address, self.config.name, self.ping_last_response_time)
-                            else:
-                                self.on_forbidden('missed {}/{} ping messages'.format(
-                                    self.pings_missed, self.pings_missed_threshold))
-
-                # No stream = already disconnected, we can quit
-                else:
-                    return
+    def on_ping_response(self, ping_extend, _now=datetime.utcnow):
+        """ Invoked by the channel's keep-alive manager when the client responded to a ping.
+        """
+        with self.update_lock:
+            self.pings_missed = 0
+            self.ping_last_response_time = _now()
+            self.token.extend(ping_extend)
 
-        except Exception, e:
-            logger.warn(format_exc(e))
+    def on_ping_missed(self):
+        """ Invoked by the channel's keep-alive manager when the client did not respond to a ping in time.
+        """
+        with self.update_lock:
+            self.pings_missed += 1
+            if self.pings_missed < self.pings_missed_threshold:
+                logger.warn(
+                    'Peer %s (%s) missed %s/%s ping messages from %s (%s). Last response time: %s{}'.format(
+                        ' UTC' if self.ping_last_response_time else ''),
+                    self._peer_address, self._peer_fqdn, self.pings_missed, self.pings_missed_threshold,
+                    self._local_address, self.config.name, self.ping_last_response_time)
+            else:
+                self.on_forbidden('missed {}/{} ping messages'.format(
+                    self.pings_missed, self.pings_missed_threshold))
 
 # ################################################################################################################################
 
     def register_auth_client(self):
-        """ Registers peer in ODB and sets up background pings to keep its connection alive.
+        """ Registers peer in ODB and has the channel's keep-alive manager ping it to keep its connection alive.
         Called only if authentication succeeded.
         """
         self.sql_ws_client_id = self.invoke_service(new_cid(), 'zato.channel.web-socket.client.create', {
@@ -360,7 +349,7 @@ class WebSocket(_WebSocket):
             'channel_name': self.config.name,
         }, needs_response=True).ws_client_id
 
-        spawn(self.send_background_pings)
+        self.container.keep_alive.add(self)
 
 # ################################################################################################################################
 
@@ -475,32 +464,36 @@ class WebSocket(_WebSocket):
 
 # ################################################################################################################################
 
-    def _wait_for_event(self, wait_time, condition_callable, _now=datetime.utcnow, _delta=timedelta,
-                        _sleep=sleep, *args, **kwargs):
-        now = _now()
-        until = now + _delta(seconds=wait_time)
-
-        while now < until:
-
-            response = condition_callable(*args, **kwargs)
-            if response:
-                return response
-            else:
-                _sleep(0.01)
-                now = _now()
-
-# ################################################################################################################################
+    def _set_client_response(self, request_id, response):
+        """ Wakes up the greenlet waiting for a response to request_id, if there is any still waiting for it.
+        The entry is left in place - it is always removed by whoever waits for the response.
+        """
+        result = self.responses_expected.get(request_id)
+        if result:
+            result.set(response)
+        else:
+            logger.info('Ignoring response to `%s` which was not expected or came too late (%s)', request_id, self.pub_client_id)
 
     def _handle_client_response(self, cid, msg):
-        self.responses_received[msg.in_reply_to] = msg
+        self._set_client_response(msg.in_reply_to, msg)
 
-    def _has_client_response(self, request_id):
-        return self.responses_received.get(request_id)
+    def _expect_client_response(self, request_id):
+        """ Registers a request that a response will be waited for. Must be called before the request is sent
+        so that the response is not lost if it arrives before the sender starts to wait for it.
+        Returns the AsyncResult that the response will be set in.
+        """
+        result = self.responses_expected[request_id] = AsyncResult()
+        return result
 
     def _wait_for_client_response(self, request_id, wait_time=5):
         """ Wait until a response from client arrives and return it or return None if there is no response up to wait_time.
         """
-        return self._wait_for_event(wait_time, self._has_client_response, request_id=request_id)
+        try:
+            return self.responses_expected[request_id].get(timeout=wait_time)
+        except Timeout:
+            return None
+        finally:
+            self.responses_expected.pop(request_id, None)
 
 # ################################################################################################################################
 
@@ -575,7 +568,7 @@ class WebSocket(_WebSocket):
         which is a timestamp object. If self.has_session_opened is not True by that time, connection to the remote end
         is closed.
         """
-        if self._wait_for_event(self.config.new_token_wait_time, lambda: self.has_session_opened):
+        if self.session_opened.wait(self.config.new_token_wait_time):
             return
 
         # We get here if self.has_session_opened has not been set to True by self.create_session_by
@@ -588,9 +581,18 @@ class WebSocket(_WebSocket):
         if any was produced in the expected time.
         """
         msg = _Class(cid, request)
-        (self.send if use_send else self.ping)(msg.serialize())
+        needs_response = _Class is not PubSubClientInvokeRequest
+
+        if needs_response:
+            self._expect_client_response(msg.id)
+
+        try:
+            (self.send if use_send else self.ping)(msg.serialize())
+        except Exception:
+            self.responses_expected.pop(msg.id, None)
+            raise
 
-        if _Class is not PubSubClientInvokeRequest:
+        if needs_response:
             response = self._wait_for_client_response(msg.id)
             if response:
                 return response if isinstance(response, bool) else response.data # It will be bool in pong responses
@@ -609,6 +611,7 @@ class WebSocket(_WebSocket):
         logger.info('Closing connection from %s (%s) to %s (%s %s %s)',
             self._peer_address, self._peer_fqdn, self._local_address, self.ext_client_id, self.config.name, self.pub_client_id)
 
+        self.container.keep_alive.remove(self)
         self.unregister_auth_client()
         del self.container.clients[self.pub_client_id]
 
@@ -621,7 +624,166 @@ class WebSocket(_WebSocket):
         # Pretend it's an actual response from the client,
         # we cannot use in_reply_to because pong messages are 1:1 copies of ping ones.
         # TODO: Use lxml for XML eventually but for now we are always using JSON
-        self.responses_received[_loads(msg.data)['meta']['id']] = True
+        self._set_client_response(_loads(msg.data)['meta']['id'], True)
+
+# ################################################################################################################################
+
+class KeepAliveManager(object):
+    """ Pings all the authenticated clients of a WebSocket channel from a single greenlet. Connections are kept in a heap
+    of [next_ping_time, sequence, connection] entries and all the connections whose time has come are pinged in one batch,
+    after which responses to all the pings from the batch are awaited together.
+    """
+    def __init__(self, name, ping_interval=30, ping_wait_time=5, batch_size=500, rtt_samples=1000):
+        self.name = name
+        self.ping_interval = ping_interval
+        self.ping_wait_time = ping_wait_time
+        self.batch_size = batch_size
+        self.heap = []
+        self.entries = {} # pub_client_id -> its current entry in the heap
+        self.sequence = count()
+        self.wakeup = Event()
+        self.keep_running = True
+        self.is_running = False
+
+        # Metrics
+        self.pings_sent = 0
+        self.pings_missed = 0
+        self.ping_rtt = deque(maxlen=rtt_samples) # In seconds
+
+    def add(self, web_socket, _time=time):
+        """ Starts to ping a connection, the first ping is sent after ping_interval seconds.
+        """
+        self.remove(web_socket)
+
+        entry = [_time() + self.ping_interval, next(self.sequence), web_socket]
+        self.entries[web_socket.pub_client_id] = entry
+        heappush(self.heap, entry)
+
+        # The dispatcher is started with the first connection to ping
+        if not self.is_running:
+            self.is_running = True
+            spawn(self.run)
+
+    def remove(self, web_socket):
+        """ Stops pinging a connection, its entry will be discarded when it reaches the top of the heap.
+        """
+        entry = self.entries.pop(web_socket.pub_client_id, None)
+        if entry:
+            entry[-1] = None
+
+    def run(self, _time=time):
+        logger.info('Keep-alive manager starting for `%s`', self.name)
+
+        while self.keep_running:
+            try:
+                now = _time()
+                batch = []
+
+                while self.heap and self.heap[0][0] <= now and len(batch) < self.batch_size:
+                    entry = heappop(self.heap)
+                    web_socket = entry[-1]
+
+                    # Already removed
+                    if web_socket is None:
+                        continue
+
+                    # Next pings are scheduled regardless of whether clients respond to the ones sent now
+                    batch.append(web_socket)
+                    entry[0] = now + self.ping_interval
+                    heappush(self.heap, entry)
+
+                if batch:
+                    spawn(self.ping_batch, batch)
+
+                # More connections may be due already if the batch was full
+                if self.heap and self.heap[0][0] <= _time():
+                    continue
+
+                self.wakeup.clear()
+                self.wakeup.wait(self.heap[0][0] - _time() if self.heap else self.ping_interval)
+
+            except Exception, e:
+                logger.warn(format_exc(e))
+
+        logger.info('Keep-alive manager stopped for `%s`', self.name)
+
+    def ping_batch(self, batch, _new_cid=new_cid, _Class=ClientInvokeRequest, _time=time):
+        """ Sends pings to all the connections from a batch and waits for all of their responses together.
+        """
+        pending = {} # AsyncResult -> (web_socket, request_id, sent_at)
+
+        for web_socket in batch:
+
+            # No stream = already disconnected
+            if not web_socket.stream:
+                self.remove(web_socket)
+                continue
+
+            msg = _Class(_new_cid(), None)
+            result = web_socket._expect_client_response(msg.id)
+
+            try:
+                web_socket.ping(msg.serialize())
+            except RuntimeError:
+                web_socket.responses_expected.pop(msg.id, None)
+                logger.warn('Closing connection due to `%s`', format_exc())
+                web_socket.on_socket_terminated()
+            except Exception, e:
+                web_socket.responses_expected.pop(msg.id, None)
+                logger.warn(format_exc(e))
+            else:
+                pending[result] = (web_socket, msg.id, _time())
+
+        self.pings_sent += len(pending)
+
+        # Responses are received in whatever order they arrive in
+        for result in iwait(pending.keys(), timeout=self.ping_wait_time):
+            web_socket, request_id, sent_at = pending.pop(result)
+            web_socket.responses_expected.pop(request_id, None)
+            self.ping_rtt.append(_time() - sent_at)
+            self._on_ping_response(web_socket)
+
+        # Anything left did not respond in time
+        self.pings_missed += len(pending)
+
+        for web_socket, request_id, _ in pending.itervalues():
+            web_socket.responses_expected.pop(request_id, None)
+
+            # The connection may have been closed in the meantime
+            if web_socket.pub_client_id in self.entries:
+                self._on_ping_missed(web_socket)
+
+    def _on_ping_response(self, web_socket):
+        try:
+            web_socket.on_ping_response(self.ping_interval)
+        except Exception, e:
+            logger.warn(format_exc(e))
+
+    def _on_ping_missed(self, web_socket):
+        try:
+            web_socket.on_ping_missed()
+        except Exception, e:
+            logger.warn(format_exc(e))
+
+    def get_metrics(self):
+        """ Returns metrics of pings sent to clients, including round-trip times of the latest ones, in milliseconds.
+        """
+        ping_rtt = sorted(self.ping_rtt)
+        len_ping_rtt = len(ping_rtt)
+
+        return {
+            'connections': len(self.entries),
+            'pings_sent': self.pings_sent,
+            'pings_missed': self.pings_missed,
+            'ping_rtt_min': ping_rtt[0] * 1000 if ping_rtt else 0,
+            'ping_rtt_mean': sum(ping_rtt) / len_ping_rtt * 1000 if ping_rtt else 0,
+            'ping_rtt_p99': ping_rtt[min(int(len_ping_rtt * 0.99), len_ping_rtt - 1)] * 1000 if ping_rtt else 0,
+            'ping_rtt_max': ping_rtt[-1] * 1000 if ping_rtt else 0,
+        }
+
+    def stop(self):
+        self.keep_running = False
+        self.wakeup.set()
 
 # ################################################################################################################################
 
@@ -630,6 +792,7 @@ class WebSocketContainer(WebSocketWSGIApplication):
     def __init__(self, config, *args, **kwargs):
         self.config = config
         self.clients = {}
+        self.keep_alive = KeepAliveManager(config.name, config.get('ping_interval', 30))
         super(WebSocketContainer, self).__init__(*args, **kwargs)
 
     def make_websocket(self, sock, protocols, extensions, environ):
@@ -658,6 +821,12 @@ class WebSocketContainer(WebSocketWSGIApplication):
     def notify_pubsub_message(self, cid, pub_client_id, request):
         return self.clients[pub_client_id].notify_pubsub_message(cid, request)
 
+    def get_metrics(self):
+        metrics = self.keep_alive.get_metrics()
+        metrics['connections_total'] = len(self.clients)
+
+        return metrics
+
 # ################################################################################################################################
 
 class WebSocketServer(WSGIServer):
@@ -684,6 +853,9 @@ class WebSocketServer(WSGIServer):
     def notify_pubsub_message(self, cid, pub_client_id, request):
         return self.application.notify_pubsub_message(cid, pub_client_id, request)
 
+    def get_metrics(self):
+        return self.application.get_metrics()
+
 # ################################################################################################################################
 
 class ChannelWebSocket(Connector):
@@ -703,6 +875,7 @@ class ChannelWebSocket(Connector):
                 raise
 
     def _stop(self):
+        self.server.application.keep_alive.stop()
         self.server.stop(3)
 
     def get_log_details(self):
@@ -714,4 +887,7 @@ class ChannelWebSocket(Connector):
     def notify_pubsub_message(self, cid, pub_client_id, request):
         return self.server.notify_pubsub_message(cid, pub_client_id, request)
 
+    def get_metrics(self):
+        return self.server.get_metrics()
+
 # ################################################################################################################################
@@ -10,9 +10,11 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import uuid
+from collections import OrderedDict
 from contextlib import closing
 from datetime import datetime
 from logging import getLogger
+from time import time
 
 # Bunch
 from bunch import bunchify, Bunch
@@ -33,20 +35,72 @@ logger = getLogger(__name__)
 
 # ################################################################################################################################
 
+class LocalToken(object):
+    """ A token that was already validated, kept in a worker's local cache.
+    """
+    __slots__ = ('data', 'expires_at', 'renewed_at')
+
+    def __init__(self, data, expires_at, renewed_at):
+        self.data = data
+        self.expires_at = expires_at
+        self.renewed_at = renewed_at
+
+# ################################################################################################################################
+
 class JWT(object):
     """ JWT authentication backend.
+
+    Tokens that were validated are kept in a bounded local cache for local_cache_ttl seconds so that for that long
+    they do not need to be looked up in KVDB, decrypted and decoded again. If renew_interval is given, token expiration
+    in KVDB is extended at most once in that many seconds rather than on each request.
     """
     ALGORITHM = 'HS256'
 
 # ################################################################################################################################
 
-    def __init__(self, kvdb, odb, secret):
+    def __init__(self, kvdb, odb, secret, local_cache_size=0, local_cache_ttl=0, renew_interval=0):
         self.odb = odb
         self.cache = RobustCache(kvdb, odb)
 
         self.secret = secret
         self.fernet = Fernet(self.secret)
 
+        self.local_cache = OrderedDict()
+        self.local_cache_size = local_cache_size
+        self.local_cache_ttl = local_cache_ttl
+        self.renew_interval = renew_interval
+
+# ################################################################################################################################
+
+    def _get_local(self, token, now):
+        """ Returns a token from the local cache unless it is not there or it expired already.
+        """
+        local = self.local_cache.pop(token, None)
+        if local and local.expires_at > now:
+
+            # Popped and added anew to mark it as the most recently used one
+            self.local_cache[token] = local
+            return local
+
+    def _set_local(self, token, token_data, now):
+        """ Adds a token to the local cache, evicting the least recently used ones if the cache is full.
+        """
+        local = LocalToken(token_data, now + min(self.local_cache_ttl, token_data.ttl), now)
+
+        if self.local_cache_size:
+            self.local_cache.pop(token, None)
+            self.local_cache[token] = local
+
+            while len(self.local_cache) > self.local_cache_size:
+                self.local_cache.popitem(last=False)
+
+        return local
+
+    def clear_local(self):
+        """ Removes all the tokens from the local cache, e.g. after a security definition changed.
+        """
+        self.local_cache.clear()
+
 # ################################################################################################################################
 
     def _lookup_jwt(self, username, password):
@@ -98,15 +152,30 @@ class JWT(object):
             4. decode
             5. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
             5. return "valid" + the token contents
+
+        Steps 1-4 are skipped for tokens found in the local cache and step 5 is throttled if renew_interval is set.
         """
-        if self.cache.get(token):
-            decrypted = self.fernet.decrypt(token)
-            token_data = bunchify(jwt.decode(decrypted, self.secret))
+        now = time()
+        local = self._get_local(token, now)
+
+        if not local:
+            if self.cache.get(token):
+                decrypted = self.fernet.decrypt(token)
+                local = self._set_local(token, bunchify(jwt.decode(decrypted, self.secret)), now)
+
+                # Expiration is renewed below, whether it was requested to be throttled or not
+                local.renewed_at = 0
+
+        if local:
+            token_data = local.data
 
             if token_data.username == expected_username:
 
-                # Renew the token expiration
-                self.cache.put(token, token, token_data.ttl, async=True)
+                # Renew the token expiration, but no more often than renew_interval, if set, which cannot exceed half of the TTL
+                if now - local.renewed_at >= min(self.renew_interval, token_data.ttl / 2):
+                    local.renewed_at = now
+                    self.cache.put(token, token, token_data.ttl, async=True)
+
                 return Bunch(valid=True, token=token_data)
 
             else:
@@ -118,8 +187,9 @@ class JWT(object):
 # ################################################################################################################################
 
     def delete(self, token):
-        """ Deletes a token in both KVDB and ODB.
+        """ Deletes a token in both KVDB and ODB, as well as in the local cache.
         """
+        self.local_cache.pop(token, None)
         self.cache.delete(token)
 
 # ################################################################################################################################
@@ -307,10 +307,11 @@ class InRAMSyncBacklog(object):
     """
     def __init__(self, pubsub):
         self.pubsub = pubsub # type: PubSub
-        self.sub_key_to_msg_id = {} # Sub key  -> Msg ID set --- What messages are available for a given subcriber
-        self.msg_id_to_sub_key = {} # Msg ID   -> Sub key set  - What subscribers are interested in a given message
-        self.msg_id_to_msg = {}     # Msg ID   -> Message data - What is the actual contents of each message
-        self.topic_msg_id = {}      # Topic ID -> Msg ID set --- What messages are available for each topic (no matter sub_key)
+        self.sub_key_to_msg_id = {}  # Sub key  -> Msg ID set --- What messages are available for a given subcriber
+        self.msg_id_to_sub_key = {}  # Msg ID   -> Sub key set  - What subscribers are interested in a given message
+        self.msg_id_to_msg = {}      # Msg ID   -> Message data - What is the actual contents of each message
+        self.topic_msg_id = {}       # Topic ID -> Msg ID set --- What messages are available for each topic (no matter sub_key)
+        self.msg_id_to_topic_id = {} # Msg ID   -> Topic ID ----- What topic a given message was published to
         self.lock = RLock()
 
         # Start in background a cleanup task that deletes all expired and removed messages
@@ -328,6 +329,9 @@ class InRAMSyncBacklog(object):
             len_messages = len(messages)
             topic_messages = self.topic_msg_id.setdefault(topic_id, set())
 
+            # Sub keys that the messages were actually stored for
+            msg_sub_keys = []
+
             # Try to append the messages for each of their subscribers ..
             for sub_key in sub_keys:
 
@@ -342,6 +346,7 @@ class InRAMSyncBacklog(object):
                 # .. otherwise, we make it known that the sub_key is interested in this message ..
                 sub_key_msg = self.sub_key_to_msg_id.setdefault(sub_key, set())
                 sub_key_msg.update(msg_ids)
+                msg_sub_keys.append(sub_key)
 
             # For each message given on input, store its actual contents ..
             for msg in messages:
@@ -355,9 +360,10 @@ class InRAMSyncBacklog(object):
                 if 'priority' not in msg:
                     msg['priority'] = _default_pri
 
-                # .. add a reverse mapping, from message ID to sub_key ..
+                # .. add reverse mappings, from message ID to sub_key and to topic ..
                 msg_sub_key = self.msg_id_to_sub_key.setdefault(msg['pub_msg_id'], set())
-                msg_sub_key.update(sub_keys)
+                msg_sub_key.update(msg_sub_keys)
+                self.msg_id_to_topic_id[msg['pub_msg_id']] = topic_id
 
             # .. and add a reference to it to the topic.
             topic_messages.update(msg_ids)
@@ -387,35 +393,50 @@ class InRAMSyncBacklog(object):
 
 # ################################################################################################################################
 
-    def _delete_messages(self, msg_list):
-        """ Low-level implementation of self.delete_messages - must be called with self.lock held.
+    def _delete_msg_id(self, msg_id):
+        """ Deletes a single message from all the in-RAM structures, using reverse mappings to visit only the topic
+        and sub_keys that the message belongs to. Must be called with self.lock held. Returns a tuple of flags indicating
+        in which of the structures the message was found.
         """
-        logger.info('Deleting non-GD messages `%s`', msg_list)
-
-        for msg_id in list(msg_list):
-
-            found_to_sub_key = self.msg_id_to_sub_key.pop(msg_id, None)
-            found_to_msg = self.msg_id_to_msg.pop(msg_id, None)
+        found_to_sub_key = self.msg_id_to_sub_key.pop(msg_id, None)
+        found_to_msg = self.msg_id_to_msg.pop(msg_id, None)
+        topic_id = self.msg_id_to_topic_id.pop(msg_id, None)
 
-            _has_topic_msg = False # Was the ID found for at least one topic
-            _has_sk_msg = False     # Ditto but for sub_keys
+        _has_topic_msg = False # Was the ID found for its topic
+        _has_sk_msg = False     # Ditto but for sub_keys
 
-            for _topic_msg_set in self.topic_msg_id.itervalues():
-                try:
-                    _topic_msg_set.remove(msg_id)
-                except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
-                else:
-                    _has_topic_msg = True
+        topic_msg_set = self.topic_msg_id.get(topic_id)
+        if topic_msg_set is not None:
+            try:
+                topic_msg_set.remove(msg_id)
+            except KeyError:
+                pass # This is fine, msg_id was already deleted from this topic
+            else:
+                _has_topic_msg = True
 
-            for _sk_msg_set in self.sub_key_to_msg_id.itervalues():
+        for sub_key in found_to_sub_key or ():
+            sk_msg_set = self.sub_key_to_msg_id.get(sub_key)
+            if sk_msg_set is not None:
                 try:
-                    _sk_msg_set.remove(msg_id)
+                    sk_msg_set.remove(msg_id)
                 except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
+                    pass # This is fine, msg_id was already deleted for this sub_key
                 else:
                     _has_sk_msg = True
 
+        return found_to_sub_key, found_to_msg, _has_topic_msg, _has_sk_msg
+
+# ################################################################################################################################
+
+    def _delete_messages(self, msg_list):
+        """ Low-level implementation of self.delete_messages - must be called with self.lock held.
+        """
+        logger.info('Deleting non-GD messages `%s`', msg_list)
+
+        for msg_id in list(msg_list):
+
+            found_to_sub_key, found_to_msg, _has_topic_msg, _has_sk_msg = self._delete_msg_id(msg_id)
+
             if not found_to_sub_key:
                 logger.warn('Message not found (msg_id_to_sub_key) %s', msg_id)
                 logger_zato.warn('Message not found (msg_id_to_sub_key) %s', msg_id)
@@ -494,6 +515,7 @@ class InRAMSyncBacklog(object):
 
             # .. first, direct mappings ..
             del self.msg_id_to_msg[msg_id]
+            self.msg_id_to_topic_id.pop(msg_id, None)
 
             logger.info('Deleting msg from mapping dict `%s`', msg_id)
 
@@ -513,6 +535,12 @@ class InRAMSyncBacklog(object):
                     sub_key_to_msg_id.remove(msg_id)
                 except KeyError:
                     pass # OK, message was not found for this sub_key
+                else:
+                    msg_sub_keys = self.msg_id_to_sub_key.get(msg_id)
+                    if msg_sub_keys is not None:
+                        msg_sub_keys.discard(sub_key)
+                        if not msg_sub_keys:
+                            del self.msg_id_to_sub_key[msg_id]
 
                 # .. now delete the sub_key either because we are explicitly told to (e.g. during unsubscribe)
                 if delete_sub:# or (not sub_key_to_msg_id):
@@ -589,7 +617,9 @@ class InRAMSyncBacklog(object):
                     # .. if the list is empty, it means that there no some subscribers left for that message,
                     # in which case we may deleted references to this message from other look-up structures.
                     if not current_subs:
-                        del self.msg_id_to_msg[msg_id]
+                        del self.msg_id_to_sub_key[msg_id]
+                        self.msg_id_to_msg.pop(msg_id, None)
+                        self.msg_id_to_topic_id.pop(msg_id, None)
                         topic_msg = self.topic_msg_id[topic_id]
                         topic_msg.remove(msg_id)
 
@@ -631,25 +661,15 @@ class InRAMSyncBacklog(object):
                                 msg['pub_msg_id'], msg['topic_name'], publisher.name, msg['pub_time'], msg['expiration'])
 
                             # .. and append it to the list of messages to be deleted.
-                            expired_msg.append((msg['pub_msg_id'], msg['topic_id']))
+                            expired_msg.append(msg['pub_msg_id'])
 
                     # For logging what was done
                     len_expired = len(expired_msg)
 
-                    # Iterate over all the expired messages found and delete them from in-RAM structures
-                    for msg_id, topic_id in expired_msg:
-
-                        # Get all sub_keys waiting for these messages and delete the message from each one,
-                        # but note that there may be possibly no subscribers at all if the message was published
-                        # to a topic without any subscribers.
-                        for sub_key in self.msg_id_to_sub_key.pop(msg_id):
-                            self.sub_key_to_msg_id[sub_key].remove(msg_id)
-
-                        # Remove all references to the message from topic
-                        self.topic_msg_id[topic_id].remove(msg_id)
-
-                        # And finally, remove the message's contents
-                        del self.msg_id_to_msg[msg_id]
+                    # Iterate over all the expired messages found and delete them from in-RAM structures - note that
+                    # there may be possibly no subscribers at all if the message was published to a topic without any.
+                    for msg_id in expired_msg:
+                        self._delete_msg_id(msg_id)
 
                 suffix = 's' if (len_expired==0 or len_expired > 1) else ''
                 logger.info('In-RAM. Deleted %s pub/sub message%s. Left:%s' % (len_expired, suffix, len(self.msg_id_to_msg)))
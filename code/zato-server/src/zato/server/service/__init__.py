@@ -47,6 +47,8 @@ from zato.server.pattern.invoke_retry import InvokeRetry
 from zato.server.pattern.parallel import ParallelExec
 from zato.server.pubsub import PubSub
 from zato.server.service.reqresp import AMQPRequestData, Cloud, Outgoing, Request, Response, WebSphereMQRequestData
+from zato.server.service.reqresp.sio import NO_SIO_CONFIG_LIST, SIOPlan
+from zato.server.stats import add_to_index as add_to_stats_index
 
 # Not used here in this module but it's convenient for callers to be able to import everything from a single namespace
 from zato.server.service.reqresp.sio import AsIs, CSV, Boolean, Dict, Float, ForceType, Integer, List, ListOfDicts, Nested, \
@@ -145,10 +147,10 @@ class ChannelSecurityInfo(object):
 # ################################################################################################################################
 
 class AMQPFacade(object):
-    """ Introduced solely to let service access outgoing connections through self.out.amqp.invoke/_async
-    rather than self.out.amqp_invoke/_async. The .send method is kept for pre-3.0 backward-compatibility.
+    """ Introduced solely to let service access outgoing connections through self.out.amqp.invoke/_async/_many
+    rather than self.out.amqp_invoke/_async/_many. The .send method is kept for pre-3.0 backward-compatibility.
     """
-    __slots__ = ('send', 'invoke', 'invoke_async')
+    __slots__ = ('send', 'invoke', 'invoke_async', 'invoke_many')
 
 # ################################################################################################################################
 
@@ -195,6 +197,7 @@ class Service(object):
     _out_plain_http = None
 
     _req_resp_freq = 0
+    _sio_plan = None # type: SIOPlan
     _has_before_job_hooks = None
     _has_after_job_hooks = None
     _before_job_hooks = []
@@ -347,13 +350,31 @@ class Service(object):
 
         # self.is_sio attribute is set by ServiceStore during deployment
         if self.has_sio:
+            sio_plan = self._get_sio_plan()
             self.request.init(True, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ,
-                self.server.encrypt)
-            self.response.init(self.cid, self.SimpleIO, self.data_format)
+                self.server.encrypt, sio_plan)
+            self.response.init(self.cid, self.SimpleIO, self.data_format, sio_plan)
 
         # Cache is always enabled
         self.cache = self._worker_store.cache_api
 
+    def _get_sio_plan(self):
+        """ Returns the SimpleIO definition compiled for the current SimpleIO config, compiling it first if the one created
+        during deployment is missing or was compiled for another config.
+        """
+        simple_io_config = self.request.simple_io_config
+        if not simple_io_config:
+            return
+
+        sio_plan = self._sio_plan
+        if not (sio_plan and sio_plan.is_valid_for(self.SimpleIO,
+                simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST),
+                simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST),
+                simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST))):
+            sio_plan = self.__class__._sio_plan = SIOPlan(self.SimpleIO, simple_io_config)
+
+        return sio_plan
+
     def set_response_data(self, service, _raw_types=(basestring, dict, list, tuple, EtreeElement, ObjectifiedElement), **kwargs):
         response = service.response.payload
         if not isinstance(response, _raw_types):
@@ -665,7 +686,7 @@ class Service(object):
 
     def post_handle(self, _get_response_value=get_response_value, _utcnow=datetime.utcnow,
         _service_time_basic=KVDB.SERVICE_TIME_BASIC, _service_time_raw=KVDB.SERVICE_TIME_RAW,
-        _service_time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE):
+        _service_time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE, _add_to_stats_index=add_to_stats_index):
         """ An internal method executed after the service has completed and has
         a response ready to return. Updates its statistics and, optionally, stores
         a sample request/response pair.
@@ -685,21 +706,34 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
+            minute = self.handle_return_time.strftime('%Y:%m:%d:%H:%M')
+            key = '%s%s:%s' % (_service_time_raw_by_minute, self.name, minute)
+
+            # Processing times are aggregated in RAM and periodically flushed to Redis ..
+            if self.server.service_timing.flush_interval:
+                self.server.service_timing.record(self.name, self.processing_time, self.handle_return_time)
+
+            # .. or each of them is stored in Redis immediately.
+            else:
+                with self.kvdb.conn.pipeline() as pipe:
+
+                    raw_key = '%s%s' % (_service_time_raw, self.name)
+
+                    pipe.hset('%s%s' % (_service_time_basic, self.name), 'last', self.processing_time)
+                    pipe.rpush(raw_key, self.processing_time)
+                    pipe.rpush(key, self.processing_time)
 
-                pipe.hset('%s%s' % (_service_time_basic, self.name), 'last', self.processing_time)
-                pipe.rpush('%s%s' % (_service_time_raw, self.name), self.processing_time)
+                    # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
+                    # to aggregate processing times for a given minute and then it will expire
 
-                key = '%s%s:%s' % (_service_time_raw_by_minute,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
+                    # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
+                    pipe.expire(key, 300)
 
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
+                    # Index the keys so that statistics jobs do not need to look them up with KEYS
+                    _add_to_stats_index(pipe, raw_key, _service_time_raw)
+                    _add_to_stats_index(pipe, key, _service_time_raw_by_minute, minute, 300)
 
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
-                pipe.execute()
+                    pipe.execute()
 
         #
         # Sample requests/responses
@@ -27,11 +27,37 @@ label = 'a built-in cache definition'
 broker_message = CACHE
 broker_message_prefix = 'BUILTIN_'
 list_func = cache_builtin_list
-output_optional_extra = ['current_size', 'cache_id']
+
+# Options of caches that are kept in their opaque attributes
+opaque_attrs = ('max_total_size', 'use_key_index', 'sync_batch_window')
+opaque_io = [Int('max_total_size'), Bool('use_key_index'), Int('sync_batch_window')]
+
+input_optional_extra = opaque_io
+output_optional_extra = ['current_size', 'current_size_bytes', 'evictions', 'cache_id'] + opaque_io
 
 # ################################################################################################################################
 
-instance_hook = common_instance_hook
+def set_opaque_attrs(item, input):
+    opaque1 = dict(item.opaque1 or {})
+    for name in opaque_attrs:
+        value = input.get(name)
+        if value is not None:
+            opaque1[name] = value
+    item.opaque1 = opaque1
+
+# ################################################################################################################################
+
+def get_opaque_attrs(item):
+    opaque1 = item.opaque1 or {}
+    return dict((name, opaque1.get(name)) for name in opaque_attrs)
+
+# ################################################################################################################################
+
+def instance_hook(self, input, instance, attrs):
+    common_instance_hook(self, input, instance, attrs)
+
+    if attrs.is_create_edit:
+        set_opaque_attrs(instance, input)
 
 # ################################################################################################################################
 
@@ -42,7 +68,13 @@ def response_hook(self, input, _ignored, attrs, service_type):
 
     elif service_type == 'get_list':
         for item in self.response.payload:
-            item.current_size = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, item.name)
+            for name, value in get_opaque_attrs(item).items():
+                setattr(item, name, value)
+
+            size = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, item.name, True)
+            item.current_size = size['current_size']
+            item.current_size_bytes = size['current_size_bytes']
+            item.evictions = size['evictions']
 
 # ################################################################################################################################
 
@@ -50,6 +82,10 @@ def broker_message_hook(self, input, instance, attrs, service_type):
     if service_type == 'delete':
         input.cache_type = _COMMON_CACHE.TYPE.BUILTIN
 
+    # Servers receive the options currently in effect, including the ones not given on input this time
+    elif service_type == 'create_edit':
+        input.update(get_opaque_attrs(instance))
+
 # ################################################################################################################################
 
 class Get(AdminService):
@@ -58,11 +94,15 @@ class Get(AdminService):
         input_required = ('cluster_id', 'cache_id')
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
-            Int('current_size'))
+            Int('current_size'), Int('current_size_bytes'), Int('evictions'))
+        output_optional = (Int('max_total_size'), Bool('use_key_index'), Int('sync_batch_window'))
 
     def handle(self):
-        response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
-        response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        cache = self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id)
+
+        response = asdict(cache)
+        response.update(get_opaque_attrs(cache))
+        response.update(self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'], True))
 
         self.response.payload = response
 
@@ -16,10 +16,27 @@ from traceback import format_exc
 from zato.common.broker_message import CHANNEL
 from zato.common.odb.model import ChannelAMQP, Cluster, ConnDefAMQP, Service
 from zato.common.odb.query import channel_amqp_list
+from zato.server.service import Boolean, Float, Integer
 from zato.server.service.internal import AdminService, AdminSIO, GetListAdminSIO
 
 # ################################################################################################################################
 
+# Options of channels that are kept in their opaque attributes
+opaque_attrs = ('dispatch_pool_size', 'preserve_order', 'ack_batch_size', 'ack_batch_time')
+opaque_input = (Integer('dispatch_pool_size'), Boolean('preserve_order'), Integer('ack_batch_size'), Float('ack_batch_time'))
+
+# ################################################################################################################################
+
+def set_opaque_attrs(item, input):
+    opaque1 = dict(item.opaque1 or {})
+    for name in opaque_attrs:
+        value = input.get(name)
+        if value is not None:
+            opaque1[name] = value
+    item.opaque1 = opaque1
+
+# ################################################################################################################################
+
 class GetList(AdminService):
     """ Returns a list of AMQP channels.
     """
@@ -53,7 +70,7 @@ class Create(AdminService):
         response_elem = 'zato_channel_amqp_create_response'
         input_required = ('cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service', 'pool_size',
             'ack_mode','prefetch_count')
-        input_optional = ('data_format',)
+        input_optional = ('data_format',) + opaque_input
         output_required = ('id', 'name')
 
     def handle(self):
@@ -94,6 +111,7 @@ class Create(AdminService):
                 item.ack_mode = input.ack_mode
                 item.prefetch_count = input.prefetch_count
                 item.data_format = input.data_format
+                set_opaque_attrs(item, input)
 
                 session.add(item)
                 session.commit()
@@ -125,7 +143,7 @@ class Edit(AdminService):
         response_elem = 'zato_channel_amqp_edit_response'
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service',
             'pool_size', 'ack_mode','prefetch_count')
-        input_optional = ('data_format',)
+        input_optional = ('data_format',) + opaque_input
         output_required = ('id', 'name')
 
     def handle(self):
@@ -168,6 +186,7 @@ class Edit(AdminService):
                 item.ack_mode = input.ack_mode
                 item.prefetch_count = input.prefetch_count
                 item.data_format = input.data_format
+                set_opaque_attrs(item, input)
 
                 session.add(item)
                 session.commit()
@@ -227,3 +246,22 @@ class Delete(AdminService):
                 raise
 
 # ################################################################################################################################
+
+class GetMetrics(AdminService):
+    """ Returns metrics of an AMQP channel's consumers - how many messages they are handling now,
+    how many are waiting to be acknowledged and how long it takes to acknowledge them.
+    """
+    name = 'zato.channel.amqp.get-metrics'
+
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_channel_amqp_get_metrics_request'
+        response_elem = 'zato_channel_amqp_get_metrics_response'
+        input_required = ('def_name', 'name')
+        output_required = (Integer('consumers'), Integer('in_flight'), Integer('awaiting_ack'), Integer('acks_sent'),
+            Integer('msgs_acked'), Float('ack_latency_mean'), Float('ack_latency_max'))
+
+    def handle(self):
+        input = self.request.input
+        self.response.payload = self.server.worker_store.amqp_api.get_channel_metrics(input.def_name, input.name)
+
+# ################################################################################################################################
@@ -17,6 +17,9 @@ from traceback import format_exc
 # Arrow
 from arrow import get as arrow_get
 
+# gevent
+from gevent import joinall, spawn
+
 # Zato
 from zato.common import CHANNEL
 from zato.common.broker_message import CHANNEL as BROKER_MSG_CHANNEL
@@ -215,8 +218,24 @@ class OnMessageReceived(AdminService):
         request_elem = 'zato_channel_jms_wmq_on_message_received_request'
         response_elem = 'zato_channel_jms_wmq_on_message_received_response'
 
-    def handle(self, _channel=CHANNEL.WEBSPHERE_MQ, ts_format='YYYYMMDDHHmmssSS'):
+    def handle(self):
         request = loads(self.request.raw_request)
+
+        # Connectors deliver messages in batches, each message is handled in a greenlet of its own ..
+        if 'msg_list' in request:
+            joinall([spawn(self._on_message_in_batch, item) for item in request['msg_list']])
+
+        # .. but a single message on input is supported too.
+        else:
+            self._on_message(request)
+
+    def _on_message_in_batch(self, request):
+        try:
+            self._on_message(request)
+        except Exception:
+            self.logger.warn('Could not handle IBM MQ message from queue `%s`, e:`%s`', request['queue_name'], format_exc())
+
+    def _on_message(self, request, _channel=CHANNEL.WEBSPHERE_MQ, ts_format='YYYYMMDDHHmmssSS'):
         msg = request['msg']
         service_name = request['service_name']
 
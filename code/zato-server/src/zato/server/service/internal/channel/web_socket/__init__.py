@@ -16,8 +16,8 @@ from zato.common.broker_message import CHANNEL
 from zato.common.odb.model import ChannelWebSocket, Service as ServiceModel
 from zato.common.odb.query import channel_web_socket_list, channel_web_socket, service
 from zato.common.util import is_port_taken
-from zato.server.service import Int, Service
-from zato.server.service.internal import AdminService
+from zato.server.service import Float, Int, Service
+from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.meta import CreateEditMeta, DeleteMeta, GetListMeta
 
 # ################################################################################################################################
@@ -99,6 +99,22 @@ class InvalidateToken(AdminService):
 
 # ################################################################################################################################
 
+class GetMetrics(AdminService):
+    """ Returns metrics of a WebSocket channel as seen by the current worker process - how many clients are connected
+    and how they respond to pings.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_channel_web_socket_get_metrics_request'
+        response_elem = 'zato_channel_web_socket_get_metrics_response'
+        input_required = ('name',)
+        output_required = (Int('connections'), Int('connections_total'), Int('pings_sent'), Int('pings_missed'),
+            Float('ping_rtt_min'), Float('ping_rtt_mean'), Float('ping_rtt_p99'), Float('ping_rtt_max'))
+
+    def handle(self):
+        self.response.payload = self.server.worker_store.web_socket_api.get_metrics(self.request.input.name)
+
+# ################################################################################################################################
+
 class Start(Service):
     """ Starts a WebSocket channel.
     """
@@ -24,6 +24,7 @@ from zato.common.broker_message import MESSAGE_TYPE, SCHEDULER as SCHEDULER_MSG
 from zato.common.odb.model import Cluster, Job, CronStyleJob, IntervalBasedJob,\
      Service
 from zato.common.odb.query import job_by_name, job_list
+from zato.server.service import List
 from zato.server.service.internal import AdminService, AdminSIO, GetListAdminSIO
 
 # ################################################################################################################################
@@ -354,3 +355,29 @@ class SetActiveStatus(AdminService):
                 raise
 
 # ################################################################################################################################
+
+class DeactivateList(AdminService):
+    """ Deactivates a list of jobs in one update, e.g. all the one-time jobs that the scheduler has just executed.
+    """
+    name = _service_name_prefix + 'deactivate-list'
+
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_scheduler_job_deactivate_list_request'
+        response_elem = 'zato_scheduler_job_deactivate_list_response'
+        input_required = (List('id_list'),)
+
+    def handle(self):
+        with closing(self.odb.session()) as session:
+            try:
+                session.query(Job).\
+                    filter(Job.id.in_(self.request.input.id_list)).\
+                    update({'is_active': False}, synchronize_session=False)
+                session.commit()
+
+            except Exception:
+                session.rollback()
+                self.logger.error('Could not deactivate jobs `%s`, e:`%s`', self.request.input.id_list, format_exc())
+
+                raise
+
+# ################################################################################################################################
@@ -234,7 +234,7 @@ class LogOut(AdminService):
             self.response.payload.result = 'No JWT found'
 
         try:
-            JWTBackend(self.kvdb, self.odb, self.server.fs_server_config.misc.jwt_secret).delete(token)
+            self.server.worker_store.request_dispatcher.url_data.jwt.delete(token)
         except Exception, e:
             self.logger.warn(format_exc(e))
             self.response.status_code = BAD_REQUEST
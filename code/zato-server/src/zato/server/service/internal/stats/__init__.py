@@ -34,6 +34,7 @@ from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import add_to_index, get_keys, get_parent_period, Histogram, pop_histogram
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
@@ -92,20 +93,39 @@ class BaseAggregatingService(AdminService):
         else:
             return 0, 0, 0, 0
 
+    def aggregate_histogram(self, histogram, service_name, times=None):
+        """ Same as aggregate_raw_times but for a histogram of processing times that worker processes flushed to Redis,
+        optionally merged with raw times from processes that store each of them separately.
+        """
+        for value in times or []:
+            histogram.record(int(value))
+
+        if histogram.count:
+            mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
+            return histogram.get_min(), histogram.get_max(), histogram.get_trimmed_mean(mean_percentile), histogram.count
+        else:
+            return 0, 0, 0, 0
+
     def collect_service_stats(self, keys_pattern, key_prefix, key_suffix, total_seconds,
                               suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
 
         service_stats = {}
+        period = key_suffix
         if suffix_needs_colon:
             key_suffix = ':' + key_suffix
 
-        for key in self.kvdb.conn.keys(keys_pattern):
+        for key in get_keys(self.kvdb.conn, key_prefix, period, keys_pattern):
+
+            values = self.kvdb.conn.hgetall(key)
+
+            # The key was in the index but it has already expired
+            if not values:
+                continue
+
             service_name = key.replace(key_prefix, '').replace(key_suffix, '')
             if chop_off_service_name:
                 service_name = service_name[:-3]
 
-            values = self.kvdb.conn.hgetall(key)
-
             stats = service_stats.setdefault(service_name, {})
 
             for name in STATS_KEYS:
@@ -173,13 +193,28 @@ class BaseAggregatingService(AdminService):
             for name in STATS_KEYS:
                 self.hset_aggr_key(aggr_key, name, values[name])
 
+            self.index_aggr_key(aggr_key, key_prefix, key_suffix)
+
+    def get_aggr_expire_after(self):
+        expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24))
+        return expire_after * 60 * 60 # Hours times minutes in an hour and seconds in a minute
+
     def hset_aggr_key(self, aggr_key, hash_key, hash_value):
         self.server.kvdb.conn.hset(aggr_key, hash_key, hash_value)
 
         # Expire the aggregated key after that many hours
-        expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24))
-        expire_after = expire_after * 60 * 60 # Hours times minutes in an hour and seconds in a minute
-        self.server.kvdb.conn.expire(aggr_key, expire_after)
+        self.server.kvdb.conn.expire(aggr_key, self.get_aggr_expire_after())
+
+    def index_aggr_key(self, aggr_key, key_prefix, key_suffix):
+        """ Indexes an aggregated key both by its own period, for it to be read directly, and by the period that its own
+        one belongs to, for it to be further aggregated, e.g. a per-minute key is indexed by its minute and its hour.
+        """
+        expire_after = self.get_aggr_expire_after()
+
+        with self.server.kvdb.conn.pipeline() as pipe:
+            add_to_index(pipe, aggr_key, key_prefix, key_suffix, expire_after)
+            add_to_index(pipe, aggr_key, key_prefix, get_parent_period(key_suffix), expire_after)
+            pipe.execute()
 
 # ##############################################################################
 
@@ -200,29 +235,48 @@ class ProcessRawTimes(BaseAggregatingService):
             key, value = item.split('=')
             config[key] = int(value)
 
-        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
+        for key in get_keys(self.server.kvdb.conn, KVDB.SERVICE_TIME_RAW, '', KVDB.SERVICE_TIME_RAW + '*'):
 
             service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
 
-            current_mean = float(
-                self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
-            current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
-            current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
-
             batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
                 key, service_name, config.max_batch_size)
 
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time', min(current_min, batch_min))
-            self.server.kvdb.conn.hset(
-                KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
+            # Indexed keys stay in the index even if all of their times have been already processed
+            if not batch_total:
+                continue
+
+            self.update_all_time(service_name, batch_min, batch_max, batch_mean)
 
             # Services use RPUSH for storing raw times so we are safe to use LTRIM
             # in order to do away with the already processed ones
             self.server.kvdb.conn.ltrim(key, batch_total, -1)
 
+        # Histograms flushed by worker processes that aggregate processing times in RAM
+        for key in get_keys(self.server.kvdb.conn, KVDB.SERVICE_TIME_SUMMARY, '', KVDB.SERVICE_TIME_SUMMARY + '*'):
+
+            service_name = key.replace(KVDB.SERVICE_TIME_SUMMARY, '')
+            histogram = pop_histogram(self.server.kvdb.conn, key)
+
+            if histogram.count:
+                batch_min, batch_max, batch_mean, _ = self.aggregate_histogram(histogram, service_name)
+                self.update_all_time(service_name, batch_min, batch_max, batch_mean)
+
+    def update_all_time(self, service_name, batch_min, batch_max, batch_mean):
+        """ Merges statistics of a batch of processing times into the all-time ones of a service.
+        """
+        current_mean = float(
+            self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
+        current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
+        current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
+
+        self.server.kvdb.conn.hset(
+           KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
+        self.server.kvdb.conn.hset(
+           KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time', min(current_min, batch_min))
+        self.server.kvdb.conn.hset(
+            KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
+
 # ##############################################################################
 
 class AggregateByMinute(BaseAggregatingService):
@@ -241,12 +295,34 @@ class AggregateByMinute(BaseAggregatingService):
         now = datetime.utcnow()
         key_suffix = (now - timedelta(minutes=2)).strftime('%Y:%m:%d:%H:%M')
 
-        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+        # Service name -> key with its raw times
+        raw_keys = {}
+        for key in get_keys(self.server.kvdb.conn, KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix,
+                '{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+            raw_keys[key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')] = key
+
+        # Service name -> key with its histogram flushed by worker processes
+        summary_keys = {}
+        for key in get_keys(self.server.kvdb.conn, KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE, key_suffix,
+                '{}*:{}'.format(KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE, key_suffix)):
+            summary_keys[key.replace(KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE, '').replace(':' + key_suffix, '')] = key
+
+        for service_name in set(raw_keys) | set(summary_keys):
 
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
+            raw_key = raw_keys.get(service_name)
+            summary_key = summary_keys.get(service_name)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            if summary_key:
+                histogram = Histogram.from_hash(self.server.kvdb.conn.hgetall(summary_key))
+                times = self.server.kvdb.conn.lrange(raw_key, 0, -1) if raw_key else None
+                batch_min, batch_max, batch_mean, batch_total = self.aggregate_histogram(histogram, service_name, times)
+            else:
+                batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(raw_key, service_name)
+
+            # The key was in the index but it has already expired
+            if not batch_total:
+                continue
 
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
@@ -254,8 +330,10 @@ class AggregateByMinute(BaseAggregatingService):
             self.hset_aggr_key(aggr_key, 'usage', batch_total)
             self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
 
-            # Raw per-minute statistics keys will expire by themselves, we don't need
-            # to delete them manually.
+            self.index_aggr_key(aggr_key, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, key_suffix)
+
+            # Raw per-minute statistics and histogram keys will expire by themselves,
+            # we don't need to delete them manually.
 
 class AggregateByHour(BaseAggregatingService):
     """ Creates per-hour stats.
@@ -389,7 +467,16 @@ class StatsReturningService(AdminService):
 
         # 1st pass
         for suffix in suffixes:
-            keys = self.server.kvdb.conn.keys('{}{}:{}'.format(stats_key_prefix, service, suffix))
+
+            # All services from the period ..
+            if service == '*':
+                keys = get_keys(self.server.kvdb.conn, stats_key_prefix, suffix, '{}*:{}'.format(stats_key_prefix, suffix))
+
+            # .. or only the one given on input, assuming there is a key for it at all.
+            else:
+                key = '{}{}:{}'.format(stats_key_prefix, service, suffix)
+                keys = [key] if self.server.kvdb.conn.exists(key) else []
+
             for key in keys:
                 service_name = key.replace(stats_key_prefix, '').replace(':{}'.format(suffix), '')
 
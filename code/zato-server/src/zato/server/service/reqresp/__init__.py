@@ -34,7 +34,8 @@ from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIM
      ZATO_OK
 from zato.common.odb.api import WritableKeyedTuple
 from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.server.service.reqresp.sio import AsIs, convert_param, convert_param_field, convert_sio_field, ForceType, \
+     NO_SIO_CONFIG_LIST, ServiceInput, SIOConverter
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,15 @@ NOT_GIVEN = 'ZATO_NOT_GIVEN'
 
 direct_payload = simple_types + (EtreeElement, ObjectifiedElement)
 
+# How many bytes of JSON to collect before a chunk of streamed output is returned to callers
+default_stream_chunk_size = 65536
+
+# ################################################################################################################################
+
+def _dumps_bytes(value):
+    value = dumps(value)
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
 # ################################################################################################################################
 
 class HTTPRequestData(object):
@@ -111,9 +121,9 @@ class Request(SIOConverter):
         self.cid = None
         self.simple_io_config = simple_io_config or {}
         self.has_simple_io_config = False
-        self.bool_parameter_prefixes = self.simple_io_config.get('bool_parameter_prefixes', [])
-        self.int_parameters = self.simple_io_config.get('int_parameters', [])
-        self.int_parameter_suffixes = self.simple_io_config.get('int_parameter_suffixes', [])
+        self.bool_parameter_prefixes = self.simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST)
+        self.int_parameters = self.simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST)
+        self.int_parameter_suffixes = self.simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST)
         self.is_xml = None
         self.data_format = data_format
         self.transport = transport
@@ -129,8 +139,9 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func):
-        """ Initializes the object with an invocation-specific data.
+    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func, sio_plan=None):
+        """ Initializes the object with an invocation-specific data. If sio_plan is given, it is the SimpleIO definition
+        compiled when the service was deployed (an instance of SIOPlan).
         """
         self.input = ServiceInput()
         self.encrypt_func = encrypt_func
@@ -138,7 +149,7 @@ class Request(SIOConverter):
         if is_sio:
             required_list = getattr(sio, 'input_required', [])
             required_list = [required_list] if isinstance(required_list, basestring) else required_list
-            self.init_flat_sio(cid, sio, data_format, transport, wsgi_environ, required_list)
+            self.init_flat_sio(cid, sio, data_format, transport, wsgi_environ, required_list, sio_plan)
 
         # We merge channel params in if requested even if it's not SIO
         else:
@@ -147,7 +158,7 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init_flat_sio(self, cid, sio, data_format, transport, wsgi_environ, required_list):
+    def init_flat_sio(self, cid, sio, data_format, transport, wsgi_environ, required_list, sio_plan=None):
         """ Initializes flat SIO requests, i.e. not list ones.
         """
         self.is_xml = data_format == SIMPLE_IO.FORMAT.XML
@@ -166,26 +177,39 @@ class Request(SIOConverter):
 
         if self.simple_io_config:
             self.has_simple_io_config = True
-            self.bool_parameter_prefixes = self.simple_io_config.get('bool_parameter_prefixes', [])
-            self.int_parameters = self.simple_io_config.get('int_parameters', [])
-            self.int_parameter_suffixes = self.simple_io_config.get('int_parameter_suffixes', [])
+            self.bool_parameter_prefixes = self.simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST)
+            self.int_parameters = self.simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST)
+            self.int_parameter_suffixes = self.simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST)
         else:
             self.payload = self.raw_request
 
         required_params = {}
 
+        # Use the compiled plan only if it was created for the very SimpleIO definition and configuration used now
+        if sio_plan and not (self.has_simple_io_config and sio_plan.is_valid_for(
+                sio, self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes)):
+            sio_plan = None
+
         if required_list:
 
             # Needs to check for this exact default value to prevent a FutureWarning in 'if not self.payload'
             if self.payload == '' and not self.channel_params:
                 raise ZatoException(cid, 'Missing input')
 
-            required_params.update(self.get_params(
-                required_list, use_channel_params_only, path_prefix, default_value, use_text))
+            if sio_plan:
+                required_params.update(self.get_params_compiled(
+                    sio_plan.input_required, use_channel_params_only, path_prefix, default_value, use_text))
+            else:
+                required_params.update(self.get_params(
+                    required_list, use_channel_params_only, path_prefix, default_value, use_text))
 
         if optional_list:
-            optional_params = self.get_params(
-                optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
+            if sio_plan:
+                optional_params = self.get_params_compiled(
+                    sio_plan.input_optional, use_channel_params_only, path_prefix, default_value, use_text, False)
+            else:
+                optional_params = self.get_params(
+                    optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
         else:
             optional_params = {}
 
@@ -221,6 +245,38 @@ class Request(SIOConverter):
 
         return params
 
+# ################################################################################################################################
+
+    def get_params_compiled(self, fields, use_channel_params_only, path_prefix='', default_value=NO_DEFAULT_VALUE,
+            use_text=True, is_required=True, _convert_param_field=convert_param_field):
+        """ Same as get_params but uses parameters compiled with compile_sio_param.
+        """
+        params = {}
+
+        cid = self.cid
+        payload = '' if use_channel_params_only else self.payload
+        data_format = self.data_format
+        channel_params = self.channel_params
+        has_simple_io_config = self.has_simple_io_config
+        encrypt_func = self.encrypt_func
+        encrypt_secrets = self.encrypt_secrets
+        params_priority = self.params_priority
+
+        for field in fields:
+            try:
+                param_name, value = _convert_param_field(cid, payload, field, data_format, is_required, default_value,
+                    path_prefix, use_text, channel_params, has_simple_io_config, True, encrypt_func, encrypt_secrets,
+                    params_priority)
+                params[param_name] = value
+
+            except Exception, e:
+                msg = 'Caught an exception, param:`{}`, params_to_visit:`{}`, has_simple_io_config:`{}`, e:`{}`'.format(
+                    field[0], [elem[0] for elem in fields], has_simple_io_config, format_exc(e))
+                self.logger.error(msg)
+                raise ParsingException(msg)
+
+        return params
+
 # ################################################################################################################################
 
     def deepcopy(self):
@@ -257,11 +313,12 @@ class SimpleIOPayload(SIOConverter):
     All of the attributes are prefixed with zato_ so that they don't conflict with non-Zato data..
     """
     def __init__(self, zato_cid, data_format, required_list, optional_list, simple_io_config, response_elem, namespace,
-            output_repeated, skip_empty, ignore_skip_empty, allow_empty_required):
+            output_repeated, skip_empty, ignore_skip_empty, allow_empty_required, sio_plan=None, output_stream=False):
         self.zato_cid = zato_cid
         self.zato_data_format = data_format
         self.zato_is_xml = self.zato_data_format == SIMPLE_IO.FORMAT.XML
         self.zato_output = []
+        self.zato_output_stream = output_stream
         self.zato_required = [(True, name) for name in required_list]
         self.zato_optional = [(False, name) for name in optional_list]
         self.zato_output_repeated = output_repeated
@@ -269,27 +326,39 @@ class SimpleIOPayload(SIOConverter):
         self.zato_force_empty_keys = ignore_skip_empty
         self.zato_allow_empty_required = allow_empty_required
         self.zato_meta = {}
-        self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
-        self.int_parameters = simple_io_config.get('int_parameters', [])
-        self.int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', [])
+        self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST)
+        self.int_parameters = simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST)
+        self.int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST)
         self.date_time_format = simple_io_config.get('date_time_format', 'YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM')
         self.response_elem = response_elem
         self.namespace = namespace
 
-        self.zato_all_attrs = set()
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
-            self.zato_all_attrs.add(name)
+        # Output parameters compiled when the service was deployed, if they can be used with the current configuration
+        if sio_plan and sio_plan.is_valid_for(
+                sio_plan.sio, self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes):
+            self.zato_output_fields = sio_plan.output
+            self.zato_all_attrs = sio_plan.output_names
+            self.__dict__.update(sio_plan.output_defaults)
+        else:
+            self.zato_output_fields = None
+            self.zato_all_attrs = set()
+            for name in chain(required_list, optional_list):
+                if isinstance(name, ForceType):
+                    name = name.name
+                self.zato_all_attrs.add(name)
 
-        self.set_expected_attrs(required_list, optional_list)
+            self.set_expected_attrs(required_list, optional_list)
 
     def __setslice__(self, i, j, seq):
         """ Assigns a list of output elements to self.zato_output, so that they
         don't have to be each individually appended. Also sets a flag indicating
         that the payload is actually a list of repeated elements.
+        In streaming mode, seq is kept as-is, e.g. an SQLAlchemy query, to be iterated over only when output is produced.
         """
-        self.zato_output[i:j] = seq
+        if self.zato_output_stream:
+            self.zato_output = seq
+        else:
+            self.zato_output[i:j] = seq
         self.zato_output_repeated = True
 
     def __setitem__(self, key, value):
@@ -359,6 +428,52 @@ class SimpleIOPayload(SIOConverter):
                 self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes, self.zato_skip_empty_keys,
                 None, None, None, self.zato_data_format, True)
 
+    def _getvalue_compiled(self, field, item, is_sa_namedtuple, use_getattr, is_required,
+            _convert_sio_field=convert_sio_field):
+        """ Same as _getvalue but for a parameter compiled with compile_sio_param.
+        """
+        lookup_name = field[1]
+
+        if use_getattr:
+            elem_value = getattr(item, lookup_name, '')
+        else:
+            elem_value = item.get(lookup_name, '')
+
+        if isinstance(elem_value, basestring) and not elem_value:
+            if elem_value == '' and self.zato_allow_empty_required:
+                return ''
+            if is_required:
+                raise ZatoException(self.zato_cid, self._missing_value_log_msg(field[0], item, is_sa_namedtuple, is_required))
+
+        # Leave as-is
+        if field[7]:
+            return elem_value
+        else:
+            return _convert_sio_field(self.zato_cid, field, elem_value, True, self.zato_skip_empty_keys, None, None,
+                self.zato_data_format, True)
+
+    def _set_out_item_compiled(self, out_item, item, is_sa_namedtuple):
+        """ Populates out_item with the values of all output parameters from the compiled plan that item has.
+        """
+        use_getattr = is_sa_namedtuple or self._is_sqlalchemy(item)
+        skip_empty_keys = self.zato_skip_empty_keys
+        is_xml = self.zato_is_xml
+
+        for is_required, is_force_empty, field in self.zato_output_fields:
+            elem_value = self._getvalue_compiled(field, item, is_sa_namedtuple, use_getattr, is_required)
+
+            if not elem_value and elem_value != 0:
+                if skip_empty_keys and not is_force_empty:
+                    continue
+
+            if isinstance(elem_value, basestring):
+                elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
+
+            if is_xml:
+                setattr(out_item, field[1], elem_value)
+            else:
+                out_item[field[1]] = elem_value
+
     def _missing_value_log_msg(self, name, item, is_sa_namedtuple, is_required):
         """ Returns a log message indicating that an element was missing.
         """
@@ -369,9 +484,87 @@ class SimpleIOPayload(SIOConverter):
         return '{} elem:[{}] not found in item:[{}]'.format(
             'Expected' if is_required else 'Optional', name, msg_item)
 
+    def _get_out_item(self, item, is_sa_namedtuple):
+        """ Returns a single item of output, i.e. a dict or an XML element, with all the SimpleIO parameters set.
+        """
+        if self.zato_is_xml:
+            out_item = Element('item')
+        else:
+            out_item = {}
+
+        if self.zato_output_fields is not None:
+            self._set_out_item_compiled(out_item, item, is_sa_namedtuple)
+        else:
+            for is_required, name in chain(self.zato_required, self.zato_optional):
+                leave_as_is = isinstance(name, AsIs)
+                elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
+
+                if not elem_value and elem_value != 0:
+                    if self.zato_skip_empty_keys:
+                        if name not in self.zato_force_empty_keys:
+                            continue
+
+                if isinstance(name, ForceType):
+                    name = name.name
+
+                if isinstance(elem_value, basestring):
+                    elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
+
+                if self.zato_is_xml:
+                    setattr(out_item, name, elem_value)
+                else:
+                    out_item[name] = elem_value
+
+        return out_item
+
+    def iter_json(self, chunk_size=default_stream_chunk_size, _keyed_tuple=(WritableKeyedTuple, KeyedTuple)):
+        """ Yields JSON output in chunks of roughly chunk_size bytes. Each repeated element is converted and serialized
+        only when it is reached, which means that neither all of the elements as dicts nor the whole of the resulting
+        string need to be kept in RAM at once.
+        """
+        if not self.zato_output_repeated:
+            yield self.getvalue()
+            return
+
+        search = self.zato_meta.get('search')
+
+        if self.response_elem is not None:
+            prefix = b'{%s: [' % _dumps_bytes(self.response_elem)
+            suffix = b'], "_meta": %s}' % _dumps_bytes(search) if search else b']}'
+        else:
+            prefix = b'['
+            suffix = b']'
+
+        buff = [prefix]
+        buff_size = len(prefix)
+        is_sa_namedtuple = None
+
+        for item in self.zato_output:
+
+            # All elements must be of the same type so it's OK to check the first one only
+            if is_sa_namedtuple is None:
+                is_sa_namedtuple = isinstance(item, _keyed_tuple)
+            else:
+                buff.append(b', ')
+
+            data = _dumps_bytes(self._get_out_item(item, is_sa_namedtuple))
+            buff.append(data)
+            buff_size += len(data)
+
+            if buff_size >= chunk_size:
+                yield b''.join(buff)
+                buff = []
+                buff_size = 0
+
+        buff.append(suffix)
+        yield b''.join(buff)
+
     def getvalue(self, serialize=True, _keyed_tuple=(WritableKeyedTuple, KeyedTuple)):
         """ Gets the actual payload's value converted to a string representing either XML or JSON.
         """
+        if self.zato_output_stream and self.zato_output_repeated and serialize and not self.zato_is_xml:
+            return b''.join(self.iter_json())
+
         if self.zato_is_xml:
             if self.zato_output_repeated:
                 value = Element('item_list')
@@ -385,9 +578,12 @@ class SimpleIOPayload(SIOConverter):
 
         if self.zato_output_repeated:
             output = self.zato_output
+
+            # In streaming mode this may be any iterable, e.g. an SQLAlchemy query
+            if not isinstance(output, (list, tuple)):
+                output = list(output)
         else:
-            output = set(dir(self)) & self.zato_all_attrs
-            output = [dict((name, getattr(self, name)) for name in output)]
+            output = [dict((name, getattr(self, name)) for name in self.zato_all_attrs if hasattr(self, name))]
 
         if output:
 
@@ -395,30 +591,7 @@ class SimpleIOPayload(SIOConverter):
             is_sa_namedtuple = isinstance(output[0], _keyed_tuple)
 
             for item in output:
-
-                if self.zato_is_xml:
-                    out_item = Element('item')
-                else:
-                    out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
-
-                    if not elem_value and elem_value != 0:
-                        if self.zato_skip_empty_keys:
-                            if name not in self.zato_force_empty_keys:
-                                continue
-
-                    if isinstance(name, ForceType):
-                        name = name.name
-
-                    if isinstance(elem_value, basestring):
-                        elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
-
-                    if self.zato_is_xml:
-                        setattr(out_item, name, elem_value)
-                    else:
-                        out_item[name] = elem_value
+                out_item = self._get_out_item(item, is_sa_namedtuple)
 
                 if self.zato_output_repeated:
                     value.append(out_item)
@@ -553,7 +726,7 @@ class Response(object):
 
     payload = property(_get_payload, _set_payload)
 
-    def init(self, cid, io, data_format, _not_given=NOT_GIVEN):
+    def init(self, cid, io, data_format, sio_plan=None, _not_given=NOT_GIVEN):
         self.data_format = data_format
 
         required_list = getattr(io, 'output_required', [])
@@ -570,7 +743,9 @@ class Response(object):
         skip_empty_keys = getattr(io, 'skip_empty_keys', False)
         force_empty_keys = getattr(io, 'force_empty_keys', [])
         allow_empty_required = getattr(io, 'allow_empty_required', False)
+        output_stream = getattr(io, 'output_stream', False)
 
         if required_list or optional_list:
             self._payload = SimpleIOPayload(cid, data_format, required_list, optional_list, self.simple_io_config,
-                response_elem, namespace, output_repeated, skip_empty_keys, force_empty_keys, allow_empty_required)
+                response_elem, namespace, output_repeated, skip_empty_keys, force_empty_keys, allow_empty_required,
+                sio_plan if (sio_plan and sio_plan.sio is io) else None, output_stream)
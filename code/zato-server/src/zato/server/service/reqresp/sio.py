@@ -33,6 +33,10 @@ logger = logging.getLogger(__name__)
 
 NOT_GIVEN = b'ZATO_NOT_GIVEN'
 
+# Used if SimpleIO configuration has no bool_parameter_prefixes, int_parameters or int_parameter_suffixes - it needs to be
+# the same object each time because SIOPlan objects compare their configuration by identity.
+NO_SIO_CONFIG_LIST = ()
+
 # ################################################################################################################################
 
 class ValidationException(ZatoException):
@@ -347,45 +351,28 @@ def is_secret(param_name, _secrets_params=SECRETS.PARAMS):
 
 def convert_sio(cid, param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters,
     int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets, date_time_format=None, data_format=ZATO_NONE,
-    from_sio_to_external=False, special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC), _is_bool=is_bool, _is_int=is_int,
-    _is_secret=is_secret):
-    try:
-
-        if _is_bool(param, param_name, bool_parameter_prefixes):
-            if value == '' and force_empty_keys:
-                value = None
-            else:
-                value = asbool(value or None) # value can be an empty string and asbool chokes on that
-
-        if value is not None:
-            if isinstance(param, ForceType):
-                value = param.convert(value, param_name, data_format, from_sio_to_external)
-            else:
-                # Empty string sent in lieu of integers are equivalent to None,
-                # as though they were never sent - this is needed for internal metaclasses
-                if value == '' and _is_int(param_name, int_parameters, int_parameter_suffixes):
-                    value = None
-
-                if value and (value not in special_values) and has_simple_io_config:
-                    if _is_int(param_name, int_parameters, int_parameter_suffixes):
-                        value = int(value)
-                    elif encrypt_secrets and _is_secret(param_name):
-                        # It will be None in SIO responses
-                        if encrypt_func:
-                            value = encrypt_func(value)
+    from_sio_to_external=False, special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC)):
+    """ Converts a single SimpleIO parameter that has not been compiled upfront - see convert_sio_field.
+    """
+    field = compile_sio_param(param, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, param_name)
+    return convert_sio_field(cid, field, value, has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets,
+        data_format, from_sio_to_external, special_values)
 
-        return value
+# ################################################################################################################################
 
-    except Exception, e:
-        if isinstance(e, Reportable):
-            e.cid = cid
-            raise
-        else:
-            msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
-                param, param_name, repr(value), type(value), format_exc(e))
-            logger.error(msg)
+def _on_conversion_error(cid, e, param, param_name, value):
+    """ Re-raises an exception caught while converting a SimpleIO parameter - either as-is, if it is meant to be reported
+    to callers, or as a ZatoException otherwise. Must be called from an except block.
+    """
+    if isinstance(e, Reportable):
+        e.cid = cid
+        raise
+    else:
+        msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
+            param, param_name, repr(value), type(value), format_exc(e))
+        logger.error(msg)
 
-            raise ZatoException(msg=msg)
+        raise ZatoException(msg=msg)
 
 # ################################################################################################################################
 
@@ -439,9 +426,73 @@ convert_impl = {
 def convert_param(cid, payload, param, data_format, is_required, default_value, path_prefix, use_text, channel_params,
     has_simple_io_config, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func,
     encrypt_secrets, params_priority):
-    """ Converts request parameters from any data format supported into Python objects.
+    """ Converts request parameters from any data format supported into Python objects. Used for parameters
+    that have not been compiled upfront - see convert_param_field.
+    """
+    field = compile_sio_param(param, bool_parameter_prefixes, int_parameters, int_parameter_suffixes)
+    return convert_param_field(cid, payload, field, data_format, is_required, default_value, path_prefix, use_text,
+        channel_params, has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets, params_priority)
+
+# ################################################################################################################################
+
+def compile_sio_param(param, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, param_name=None,
+    _is_bool=is_bool, _is_int=is_int, _is_secret=is_secret):
+    """ Returns a tuple of flags describing how a single SimpleIO parameter is to be converted, so that each request and
+    response can use these flags instead of finding out what kind of a parameter it is each time.
+    The tuple is (param, param_name, is_bool, is_int, is_secret, is_force_type, is_complex, is_as_is, is_opaque).
+    """
+    is_force_type = isinstance(param, ForceType)
+    param_name = param_name or (param.name if is_force_type else param)
+
+    return (param, param_name, bool(_is_bool(param, param_name, bool_parameter_prefixes)),
+        bool(_is_int(param_name, int_parameters, int_parameter_suffixes)), _is_secret(param_name), is_force_type,
+        isinstance(param, COMPLEX_VALUE), isinstance(param, AsIs), isinstance(param, (AsIs, Opaque)))
+
+# ################################################################################################################################
+
+def convert_sio_field(cid, field, value, has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets,
+    data_format=ZATO_NONE, from_sio_to_external=False, special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC)):
+    """ Converts a single SimpleIO parameter compiled with compile_sio_param.
     """
-    param_name = param.name if isinstance(param, ForceType) else param
+    param, param_name, is_bool_param, is_int_param, is_secret_param, is_force_type, _, _, _ = field
+
+    try:
+
+        if is_bool_param:
+            if value == '' and force_empty_keys:
+                value = None
+            else:
+                value = asbool(value or None) # value can be an empty string and asbool chokes on that
+
+        if value is not None:
+            if is_force_type:
+                value = param.convert(value, param_name, data_format, from_sio_to_external)
+            else:
+                # Empty string sent in lieu of integers are equivalent to None,
+                # as though they were never sent - this is needed for internal metaclasses
+                if value == '' and is_int_param:
+                    value = None
+
+                if value and (value not in special_values) and has_simple_io_config:
+                    if is_int_param:
+                        value = int(value)
+                    elif encrypt_secrets and is_secret_param:
+                        # It will be None in SIO responses
+                        if encrypt_func:
+                            value = encrypt_func(value)
+
+        return value
+
+    except Exception, e:
+        _on_conversion_error(cid, e, param, param_name, value)
+
+# ################################################################################################################################
+
+def convert_param_field(cid, payload, field, data_format, is_required, default_value, path_prefix, use_text, channel_params,
+    has_simple_io_config, force_empty_keys, encrypt_func, encrypt_secrets, params_priority):
+    """ Converts request parameters, compiled with compile_sio_param, from any data format supported into Python objects.
+    """
+    param, param_name, _, _, _, _, is_complex, _, is_opaque = field
 
     # First thing is to find out if we have parameters in channel_params. If so and they have priority
     # over payload, we don't look further. If they don't have priority, whether the value from channel_params
@@ -452,8 +503,8 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
     # Convert it to a native Python data type
     if channel_value != ZATO_NONE:
-        channel_value = convert_sio(cid, param, param_name, channel_value, has_simple_io_config, False, bool_parameter_prefixes,
-            int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets, None, data_format, False)
+        channel_value = convert_sio_field(cid, field, channel_value, has_simple_io_config, force_empty_keys, encrypt_func,
+            encrypt_secrets, data_format, False)
 
     # Return the value immediately if we already know channel_params are of higer priority
     if params_priority == PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG and channel_value != ZATO_NONE:
@@ -462,8 +513,8 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
     # Ok, at that point we either don't have anything in channel_params or they don't have priority over payload.
 
     if payload is not None:
-        value = convert_impl[data_format](payload, param_name, cid, is_required, isinstance(param, COMPLEX_VALUE),
-            default_value, path_prefix, use_text)
+        value = convert_impl[data_format](payload, param_name, cid, is_required, is_complex, default_value, path_prefix,
+            use_text)
     else:
         value = NOT_GIVEN
 
@@ -486,21 +537,73 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
                 value = ''
 
     else:
-        if value is not None and not isinstance(param, COMPLEX_VALUE):
+        if value is not None and not is_complex:
             if isinstance(value, str):
                 value = value.decode('utf-8')
             else:
                 value = unicode(value)
 
-        if not isinstance(param, (AsIs, Opaque)):
-            return param_name, convert_sio(cid, param, param_name, value, has_simple_io_config, data_format==DATA_FORMAT.XML,
-                bool_parameter_prefixes, int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets,
-                None, data_format, False)
+        if not is_opaque:
+            return param_name, convert_sio_field(cid, field, value, has_simple_io_config, force_empty_keys, encrypt_func,
+                encrypt_secrets, data_format, False)
 
     return param_name, value
 
 # ################################################################################################################################
 
+def _get_sio_list(sio, name):
+    value = getattr(sio, name, [])
+    return [value] if isinstance(value, basestring) else value
+
+# ################################################################################################################################
+
+class SIOPlan(object):
+    """ A service's SimpleIO definition compiled for a given SimpleIO configuration - each input and output parameter
+    is turned into a tuple of flags (see compile_sio_param) telling requests and responses how to convert it.
+    Created when a service is deployed and reused by all of its invocations for as long as the configuration is the same.
+    """
+    __slots__ = ('sio', 'bool_parameter_prefixes', 'int_parameters', 'int_parameter_suffixes', 'input_required',
+        'input_optional', 'output', 'output_names', 'output_defaults')
+
+    def __init__(self, sio, simple_io_config):
+        self.sio = sio
+        self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST)
+        self.int_parameters = simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST)
+        self.int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST)
+
+        self.input_required = self._compile(_get_sio_list(sio, 'input_required'))
+        self.input_optional = self._compile(_get_sio_list(sio, 'input_optional'))
+
+        # Output parameters are (is_required, is_force_empty, field) tuples
+        force_empty_keys = getattr(sio, 'force_empty_keys', [])
+        output_required = self._compile(_get_sio_list(sio, 'output_required'))
+        output_optional = self._compile(_get_sio_list(sio, 'output_optional'))
+
+        self.output = tuple((True, self._is_force_empty(field[0], force_empty_keys), field) for field in output_required) + \
+            tuple((False, self._is_force_empty(field[0], force_empty_keys), field) for field in output_optional)
+
+        # Names of all output parameters and their initial values in SimpleIOPayload objects
+        self.output_names = frozenset(field[1] for field in output_required + output_optional)
+        self.output_defaults = dict.fromkeys(self.output_names, '')
+
+    def _compile(self, params):
+        return tuple(compile_sio_param(param, self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes)
+            for param in params)
+
+    def _is_force_empty(self, param, force_empty_keys):
+        # force_empty_keys may be set to True to force all the keys
+        return force_empty_keys is True or (isinstance(force_empty_keys, (list, tuple, set)) and param in force_empty_keys)
+
+    def is_valid_for(self, sio, bool_parameter_prefixes, int_parameters, int_parameter_suffixes):
+        """ Returns True if the plan was compiled for this exact SimpleIO definition and configuration.
+        """
+        return self.sio is sio and \
+            self.bool_parameter_prefixes is bool_parameter_prefixes and \
+            self.int_parameters is int_parameters and \
+            self.int_parameter_suffixes is int_parameter_suffixes
+
+# ################################################################################################################################
+
 class SIO_TYPE_MAP:
 
 # ################################################################################################################################
@@ -16,14 +16,11 @@ from datetime import datetime
 from hashlib import sha256
 from importlib import import_module
 from inspect import isclass
-from json import dumps
+from json import dumps, loads
 from traceback import format_exc
 
 # Bunch
-from bunch import bunchify
-
-# dill
-from dill import dumps as dill_dumps, load as dill_load
+from bunch import Bunch
 
 # gevent
 from gevent.lock import RLock
@@ -46,6 +43,7 @@ from zato.common.odb.model.base import Base as ModelBase
 from zato.common.util import deployment_info, import_module_from_path, is_func_overridden, is_python_file, visit_py_source
 from zato.server.service import after_handle_hooks, after_job_hooks, before_handle_hooks, before_job_hooks, PubSubHook, Service
 from zato.server.service.internal import AdminService
+from zato.server.service.reqresp.sio import SIOPlan
 
 # ################################################################################################################################
 
@@ -89,6 +87,7 @@ def set_up_class_attributes(class_, service_store=None, name=None):
         class_._out_plain_http = service_store.server.worker_store.worker_config.out_plain_http
         class_.amqp.invoke = class_.amqp.send = service_store.server.worker_store.amqp_invoke # .send is for pre-3.0 backward compat
         class_.amqp.invoke_async = class_.amqp.send = service_store.server.worker_store.amqp_invoke_async
+        class_.amqp.invoke_many = service_store.server.worker_store.amqp_invoke_many
 
         class_._worker_store = service_store.server.worker_store
         class_._worker_config = service_store.server.worker_store.worker_config
@@ -96,6 +95,14 @@ def set_up_class_attributes(class_, service_store=None, name=None):
         class_._json_pointer_store = service_store.server.worker_store.worker_config.json_pointer_store
         class_._xpath_store = service_store.server.worker_store.worker_config.xpath_store
 
+        # Compile SimpleIO definitions upfront so that requests and responses do not need to do it each time
+        simple_io_config = getattr(service_store.server.worker_store.worker_config, 'simple_io', None)
+        if class_.has_sio and simple_io_config:
+            try:
+                class_._sio_plan = SIOPlan(class_.SimpleIO, simple_io_config)
+            except Exception, e:
+                logger.warn('Could not compile SimpleIO of `%s`, e:`%s`', name, format_exc(e))
+
         _req_resp_freq_key = '%s%s' % (KVDB.REQ_RESP_SAMPLE, name)
         class_._req_resp_freq = int(service_store.server.kvdb.conn.hget(_req_resp_freq_key, 'freq') or 0)
 
@@ -221,60 +228,71 @@ class ServiceStore(InitializingObject):
 # ################################################################################################################################
 
     def import_internal_services(self, items, base_dir, sync_internal, is_first):
-        """ Imports and optionally caches locally internal services.
+        """ Imports internal services, using a local cache of names under which service classes can be found in each module.
+        Cache entries are keyed by the hash of each module's source code so only modules that changed since the cache
+        was last written need to be scanned for services again.
         """
-        cache_file_path = os.path.join(base_dir, 'config', 'repo', 'internal-cache.dat')
+        cache_file_path = os.path.join(base_dir, 'config', 'repo', 'internal-cache.json')
 
-        # sync_internal may be False but if the cache does not exist (which is the case if a server starts up the first time),
-        # we need to create it anyway and sync_internal becomes True then. However, the should be created only by the very first
-        # worker in a group of workers - the rest can simply assume that the cache is ready to read.
-        if is_first and not os.path.exists(cache_file_path):
-            sync_internal = True
+        # Synchronizing internal modules means re-building the internal cache from scratch.
+        old_cache = {} if sync_internal else self._read_internal_cache(cache_file_path)
+        new_cache = {}
 
-        if sync_internal:
+        deployed = []
+        odb_items = []
 
-            # Synchronizing internal modules means re-building the internal cache from scratch
-            # and re-deploying everything.
+        for mod_name in items:
+            mod = import_module(mod_name)
+            si = self._get_source_code_info(mod)
+            entry = old_cache.get(mod_name)
 
-            service_info = []
-            internal_cache = {
-                'service_info': service_info
-            }
+            # The module has not changed so we already know where its services are ..
+            if si.hash and entry and entry['hash'] == si.hash:
+                names = entry['names']
 
-            deployed = self.import_services_from_anywhere(items, base_dir)
+            # .. otherwise, it needs to be scanned.
+            else:
+                names = [name for name in sorted(dir(mod)) if self._is_service_class(getattr(mod, name))]
 
-            for class_ in deployed:
-                impl_name = class_.get_impl_name()
-                service_info.append({
-                    'class_': class_,
-                    'mod': inspect.getmodule(class_),
-                    'impl_name': impl_name,
-                    'service_id': self.impl_name_to_id[impl_name],
-                    'is_active': self.services[impl_name]['is_active'],
-                    'slow_threshold': self.services[impl_name]['slow_threshold'],
-                    'fs_location': inspect.getfile(class_),
-                })
+            new_cache[mod_name] = {'hash': si.hash, 'names': names}
+            deployed.extend(self._visit_module(mod, True, inspect.getfile(mod), odb_items=odb_items, si=si, names=names))
 
+        not_added = self._add_services_to_odb(odb_items)
 
-            # All set, write out the cache file
-            f = open(cache_file_path, 'wb')
-            f.write(dill_dumps(internal_cache))
-            f.close()
+        # The cache should be written out only by the very first worker in a group of workers
+        # - the rest can simply assume that it is ready to read.
+        if is_first and new_cache != old_cache:
+            self._write_internal_cache(cache_file_path, new_cache)
 
-            return deployed
+        return [class_ for class_ in deployed if class_ not in not_added]
 
-        else:
-            deployed = []
+# ################################################################################################################################
+
+    def _read_internal_cache(self, path):
+        """ Returns the internal services cache from the path given on input or an empty one if there is none to read.
+        """
+        if not os.path.exists(path):
+            return {}
 
-            f = open(cache_file_path, 'rb')
-            items = bunchify(dill_load(f))
-            f.close()
+        try:
+            with open(path, 'rb') as f:
+                return loads(f.read())
+        except(IOError, ValueError), e:
+            logger.warn('Could not read internal cache from `%s`, e:`%s`', path, format_exc(e))
+            return {}
 
-            for item in items.service_info:
-                self._visit_class(item.mod, deployed, item.class_, item.fs_location, True,
-                    item.service_id, item.is_active, item.slow_threshold)
+# ################################################################################################################################
 
-            return deployed
+    def _write_internal_cache(self, path, internal_cache):
+        """ Saves the internal services cache under the path given on input. A temporary file is renamed to the target one
+        so that readers never see a partially written cache.
+        """
+        tmp_path = '{}.{}'.format(path, os.getpid())
+
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps(internal_cache))
+
+        os.rename(tmp_path, path)
 
 # ################################################################################################################################
 
@@ -284,6 +302,9 @@ class ServiceStore(InitializingObject):
         """
         deployed = []
 
+        # Information about all the services deployed is stored in the ODB in one transaction
+        odb_items = []
+
         for item in items:
             if has_debug:
                 logger.debug('About to import services from:`%s`', item)
@@ -292,21 +313,23 @@ class ServiceStore(InitializingObject):
 
             # A regular directory
             if os.path.isdir(item):
-                deployed.extend(self.import_services_from_directory(item, base_dir))
+                deployed.extend(self.import_services_from_directory(item, base_dir, odb_items))
 
             # .. a .py/.pyw
             elif is_python_file(item):
-                deployed.extend(self.import_services_from_file(item, is_internal, base_dir))
+                deployed.extend(self.import_services_from_file(item, is_internal, base_dir, odb_items))
 
             # .. must be a module object
             else:
-                deployed.extend(self.import_services_from_module(item, is_internal))
+                deployed.extend(self.import_services_from_module(item, is_internal, odb_items))
 
-        return deployed
+        not_added = self._add_services_to_odb(odb_items)
+
+        return [class_ for class_ in deployed if class_ not in not_added]
 
 # ################################################################################################################################
 
-    def import_services_from_file(self, file_name, is_internal, base_dir):
+    def import_services_from_file(self, file_name, is_internal, base_dir, odb_items=None):
         """ Imports all the services from the path to a file.
         """
         deployed = []
@@ -317,13 +340,13 @@ class ServiceStore(InitializingObject):
             msg = 'Could not load source, file_name:`%s`, e:`%s`'
             logger.error(msg, file_name, format_exc(e))
         else:
-            deployed.extend(self._visit_module(mod_info.module, is_internal, mod_info.file_name))
+            deployed.extend(self._visit_module(mod_info.module, is_internal, mod_info.file_name, odb_items=odb_items))
         finally:
             return deployed
 
 # ################################################################################################################################
 
-    def import_services_from_directory(self, dir_name, base_dir):
+    def import_services_from_directory(self, dir_name, base_dir, odb_items=None):
         """ dir_name points to a directory.
 
         If dist2 is True, the directory is assumed to be a Distutils2 one and its
@@ -337,44 +360,54 @@ class ServiceStore(InitializingObject):
         deployed = []
 
         for py_path in visit_py_source(dir_name):
-            deployed.extend(self.import_services_from_file(py_path, False, base_dir))
+            deployed.extend(self.import_services_from_file(py_path, False, base_dir, odb_items))
 
         return deployed
 
 # ################################################################################################################################
 
-    def import_services_from_module(self, mod_name, is_internal):
+    def import_services_from_module(self, mod_name, is_internal, odb_items=None):
         """ Imports all the services from a module specified by the given name.
         """
-        return self.import_services_from_module_object(import_module(mod_name), is_internal)
+        return self.import_services_from_module_object(import_module(mod_name), is_internal, odb_items)
 
 # ################################################################################################################################
 
-    def import_services_from_module_object(self, mod, is_internal):
+    def import_services_from_module_object(self, mod, is_internal, odb_items=None):
         """ Imports all the services from a Python module object.
         """
-        return self._visit_module(mod, is_internal, inspect.getfile(mod))
+        return self._visit_module(mod, is_internal, inspect.getfile(mod), odb_items=odb_items)
 
 # ################################################################################################################################
 
-    def _should_deploy(self, name, item):
-        """ Is an object something we can deploy on a server?
+    def _is_service_class(self, item):
+        """ Is an object a service class, regardless of whether this particular server is allowed to deploy it or not?
         """
         if isclass(item) and hasattr(item, '__mro__') and hasattr(item, 'get_name'):
             if item is not Service and item is not AdminService and item is not PubSubHook:
                 if not hasattr(item, DONT_DEPLOY_ATTR_NAME) and not issubclass(item, ModelBase):
+                    return True
 
-                    service_name = item.get_name()
+        return False
 
-                    # Don't deploy SSO services if SSO as such is not enabled
-                    if not self.server.is_sso_enabled:
-                        if 'zato.sso' in service_name:
-                            return False
+# ################################################################################################################################
 
-                    if self.patterns_matcher.is_allowed(service_name):
-                        return True
-                    else:
-                        logger.info('Skipped disallowed `%s`', service_name)
+    def _should_deploy(self, name, item):
+        """ Is an object something we can deploy on a server?
+        """
+        if self._is_service_class(item):
+
+            service_name = item.get_name()
+
+            # Don't deploy SSO services if SSO as such is not enabled
+            if not self.server.is_sso_enabled:
+                if 'zato.sso' in service_name:
+                    return False
+
+            if self.patterns_matcher.is_allowed(service_name):
+                return True
+            else:
+                logger.info('Skipped disallowed `%s`', service_name)
 
 # ################################################################################################################################
 
@@ -403,7 +436,7 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
-    def _visit_class(self, mod, deployed, class_, fs_location, is_internal, service_id=None, is_active=None, slow_threshold=None):
+    def _visit_class(self, mod, deployed, class_, fs_location, is_internal, odb_items, si):
         timestamp = datetime.utcnow()
         depl_info = dumps(deployment_info('service-store', str(class_), timestamp.isoformat(), fs_location))
 
@@ -417,24 +450,49 @@ class ServiceStore(InitializingObject):
         self.services[impl_name]['deployment_info'] = depl_info
         self.services[impl_name]['service_class'] = class_
 
-        si = self._get_source_code_info(mod)
-
-        service_id, is_active, slow_threshold = self.odb.add_service(
-            name, impl_name, is_internal, timestamp, dumps(str(depl_info)), si)
+        # The ODB will be updated once all the services from current deployment are visited
+        odb_items.append(Bunch(name=name, impl_name=impl_name, is_internal=is_internal, deployment_time=timestamp,
+            details=dumps(str(depl_info)), source_info=si, class_=class_))
 
         deployed.append(class_)
 
-        self.services[impl_name]['is_active'] = is_active
-        self.services[impl_name]['slow_threshold'] = slow_threshold
-
-        self.id_to_impl_name[service_id] = impl_name
-        self.impl_name_to_id[impl_name] = service_id
-        self.name_to_impl_name[name] = impl_name
-
         if has_debug:
             logger.debug('Imported service:`%s`', name)
 
-        class_.after_add_to_store(logger)
+# ################################################################################################################################
+
+    def _add_services_to_odb(self, odb_items):
+        """ Stores in the ODB information about all the services given on input and completes their deployment using
+        what the ODB returned for each. Returns classes of services that could not be added.
+        """
+        not_added = set()
+
+        if not odb_items:
+            return not_added
+
+        odb_info = self.odb.add_services(odb_items)
+
+        with self.update_lock:
+            for item in odb_items:
+
+                info = odb_info.get(item.name)
+                if not info:
+                    logger.warn('Service `%s` (%s) could not be added to ODB', item.name, item.impl_name)
+                    not_added.add(item.class_)
+                    continue
+
+                service_id, is_active, slow_threshold = info
+
+                self.services[item.impl_name]['is_active'] = is_active
+                self.services[item.impl_name]['slow_threshold'] = slow_threshold
+
+                self.id_to_impl_name[service_id] = item.impl_name
+                self.impl_name_to_id[item.impl_name] = service_id
+                self.name_to_impl_name[item.name] = item.impl_name
+
+                item.class_.after_add_to_store(logger)
+
+        return not_added
 
 # ################################################################################################################################
 
@@ -445,18 +503,26 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
-    def _visit_module(self, mod, is_internal, fs_location, needs_odb_deployment=True):
-        """ Actually imports services from a module object.
+    def _visit_module(self, mod, is_internal, fs_location, needs_odb_deployment=True, odb_items=None, si=None, names=None):
+        """ Actually imports services from a module object. Unless a list to collect them in is given on input,
+        information about services found is stored in the ODB before returning.
         """
         deployed = []
+
+        has_own_odb_items = odb_items is None
+        odb_items = [] if has_own_odb_items else odb_items
+
+        # Source code information is the same for all the services from a given module
+        si = si or self._get_source_code_info(mod)
+
         try:
-            for name in sorted(dir(mod)):
+            for name in (sorted(dir(mod)) if names is None else names):
                 with self.update_lock:
-                    item = getattr(mod, name)
+                    item = getattr(mod, name, None)
 
                     if self._should_deploy(name, item):
                         if item.before_add_to_store(logger):
-                            self._visit_class(mod, deployed, item, fs_location, is_internal)
+                            self._visit_class(mod, deployed, item, fs_location, is_internal, odb_items, si)
                         else:
                             logger.info('Skipping `%s` from `%s`', item, fs_location)
 
@@ -465,6 +531,10 @@ class ServiceStore(InitializingObject):
                 'Exception while visit mod:`%s`, is_internal:`%s`, fs_location:`%s`, e:`%s`',
                 mod, is_internal, fs_location, format_exc(e))
         finally:
+            if has_own_odb_items:
+                not_added = self._add_services_to_odb(odb_items)
+                deployed = [class_ for class_ in deployed if class_ not in not_added]
+
             return deployed
 
 # ################################################################################################################################
@@ -10,26 +10,294 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from traceback import format_exc
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep
+
 # Zato
 from zato.common import KVDB
 
 logger = logging.getLogger(__name__)
 
+# ################################################################################################################################
+
+# How many of the most significant bits of a value are kept when it is assigned to a histogram bucket
+_significant_bits = 6
+
+# Prefix of hash fields that keep counters of buckets
+_bucket_prefix = 'b:'
+
+# ################################################################################################################################
+
+def get_index_key(key_prefix, period='', _index_prefix=KVDB.SERVICE_TIME_INDEX):
+    """ Returns a key of the Redis set that indexes all the keys of a given prefix, e.g. KVDB.SERVICE_TIME_RAW_BY_MINUTE,
+    that were written in a given period, e.g. in a minute such as 2018:01:02:03:04. Period may be empty for keys
+    that do not belong to any period.
+    """
+    return '{}{}:{}'.format(_index_prefix, key_prefix.rstrip(':').rsplit(':', 1)[-1], period)
+
+def get_parent_period(period):
+    """ Returns the period that a given one belongs to, e.g. 2018:01:02:03 for 2018:01:02:03:04.
+    """
+    return period.rsplit(':', 1)[0]
+
+def add_to_index(conn, key, key_prefix, period='', expire=None):
+    """ Adds a key to the index of its prefix and period, optionally making the index expire after that many seconds.
+    conn may be a pipeline, in which case the caller is responsible for executing it.
+    """
+    index_key = get_index_key(key_prefix, period)
+    conn.sadd(index_key, key)
+
+    if expire:
+        conn.expire(index_key, expire)
+
+def set_indexed_since(conn, now, _since_key=KVDB.SERVICE_TIME_INDEX_SINCE):
+    """ Stores the minute since which keys have been indexed, unless another server has stored it already.
+    """
+    conn.setnx(_since_key, now.strftime('%Y:%m:%d:%H:%M'))
+
+def is_indexed(conn, period, _since_key=KVDB.SERVICE_TIME_INDEX_SINCE):
+    """ Returns True if all the keys from a given period were written by servers that kept indexes. This is not the case
+    for periods that started before the minute indexes were first kept in, nor if they have never been kept at all.
+    """
+    since = conn.get(_since_key)
+    if not since:
+        return False
+
+    return period > since[:len(period)] if period else True
+
+def get_keys(conn, key_prefix, period, pattern):
+    """ Returns all keys of a given prefix from a given period. Keys are read from the period's index, which is empty
+    if there were no keys in that period. Only if keys may have been written by servers that did not keep indexes,
+    SCAN is used with an input pattern which, unlike KEYS, does not block Redis for the time it takes to go through
+    all the keys in the database. Note that keys returned may have already expired.
+    """
+    keys = conn.smembers(get_index_key(key_prefix, period))
+    return keys if (keys or is_indexed(conn, period)) else conn.scan_iter(pattern)
+
+# ################################################################################################################################
+
+def get_bucket(value, _significant_bits=_significant_bits):
+    """ Returns the lower bound of the histogram bucket that a value belongs to. Values below 64 have buckets of their own,
+    larger ones share a bucket with all the values that have the same 6 most significant bits, which means that the relative
+    error is always less than 1/32 no matter how large the values are.
+    """
+    shift = value.bit_length() - _significant_bits
+    return value if shift <= 0 else (value >> shift) << shift
+
+def get_bucket_value(bucket, _significant_bits=_significant_bits):
+    """ Returns a value that represents all the values from a bucket, i.e. the middle of the bucket.
+    """
+    shift = bucket.bit_length() - _significant_bits
+    return bucket if shift <= 0 else bucket + ((1 << shift) - 1) / 2.0
+
+# ################################################################################################################################
+
+class Histogram(object):
+    """ An HDR-style histogram of processing times, in milliseconds. Histograms are mergeable, i.e. a histogram of all
+    the values from several ones is created by adding their counters, which is what lets each worker process keep
+    its own ones and send them to Redis where they are combined by means of HINCRBY.
+    """
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.buckets = {} # Lower bound of a bucket -> how many values it has
+
+    def record(self, value, _get_bucket=get_bucket):
+        bucket = _get_bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+
+    def to_hash(self, _bucket_prefix=_bucket_prefix):
+        """ Returns the histogram as a dictionary of Redis hash fields.
+        """
+        out = {'{}{}'.format(_bucket_prefix, bucket): count for bucket, count in self.buckets.iteritems()}
+        out['count'] = self.count
+        out['total'] = self.total
+
+        return out
+
+    @staticmethod
+    def from_hash(data, _bucket_prefix=_bucket_prefix, _len_bucket_prefix=len(_bucket_prefix)):
+        """ Creates a histogram out of Redis hash fields previously returned by to_hash.
+        """
+        histogram = Histogram()
+        histogram.count = int(data.get('count', 0))
+        histogram.total = int(data.get('total', 0))
+
+        for key, value in data.iteritems():
+            if key.startswith(_bucket_prefix):
+                histogram.buckets[int(key[_len_bucket_prefix:])] = int(value)
+
+        return histogram
+
+    def get_min(self):
+        return get_bucket_value(min(self.buckets)) if self.buckets else 0
+
+    def get_max(self):
+        return get_bucket_value(max(self.buckets)) if self.buckets else 0
+
+    def get_percentile(self, percentile):
+        """ Returns a value at a given percentile, interpolating in the same manner that scipy.stats.scoreatpercentile does,
+        except that values are represented by their buckets.
+        """
+        if not self.count:
+            return 0
+
+        rank = percentile / 100.0 * (self.count - 1)
+        index = int(rank)
+        fraction = rank - index
+
+        lower = self._get_value_at(index)
+        if not fraction:
+            return lower
+
+        return lower + (self._get_value_at(index + 1) - lower) * fraction
+
+    def _get_value_at(self, index):
+        """ Returns a value that would be at a given index if all the values were sorted.
+        """
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > index:
+                return get_bucket_value(bucket)
+
+    def get_trimmed_mean(self, percentile):
+        """ Returns a mean of values that are not greater than the one at the given percentile.
+        """
+        if not self.count:
+            return 0
+
+        if percentile >= 100:
+            return self.total / self.count
+
+        limit = self.get_percentile(percentile)
+        total = count = 0
+
+        for bucket, bucket_count in self.buckets.iteritems():
+            value = get_bucket_value(bucket)
+            if value <= limit:
+                total += value * bucket_count
+                count += bucket_count
+
+        return total / count
+
+# ################################################################################################################################
+
+class ServiceTimingStore(object):
+    """ Keeps histograms of processing times of services in RAM of a worker process. Recording a time needs no I/O at all,
+    instead, all the histograms collected so far are periodically sent in one pipeline to Redis where they are merged
+    with those of other worker processes. There are no context switches in either .record or in the part of .flush
+    that swaps the histograms for new ones, which is why no lock is needed.
+    """
+    def __init__(self, conn, flush_interval, minute_expire=300):
+        self.conn = conn
+        self.flush_interval = flush_interval # In seconds
+        self.minute_expire = minute_expire
+        self.last = {}      # Service name -> its last processing time
+        self.all_time = {}  # Service name -> histogram of its processing times since last flush
+        self.by_minute = {} # (Service name, minute) -> histogram of processing times in that minute
+
+    def record(self, service_name, value, now, _histogram=Histogram):
+        self.last[service_name] = value
+
+        histogram = self.all_time.get(service_name)
+        if not histogram:
+            histogram = self.all_time[service_name] = _histogram()
+        histogram.record(value)
+
+        key = (service_name, now.strftime('%Y:%m:%d:%H:%M'))
+        histogram = self.by_minute.get(key)
+        if not histogram:
+            histogram = self.by_minute[key] = _histogram()
+        histogram.record(value)
+
+    def _hincrby(self, pipe, key, histogram):
+        for field, value in histogram.to_hash().iteritems():
+            pipe.hincrby(key, field, value)
+
+    def flush(self, _service_time_basic=KVDB.SERVICE_TIME_BASIC, _summary=KVDB.SERVICE_TIME_SUMMARY,
+            _summary_by_minute=KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE):
+        """ Sends all the histograms collected so far to Redis.
+        """
+        last, all_time, by_minute = self.last, self.all_time, self.by_minute
+        self.last, self.all_time, self.by_minute = {}, {}, {}
+
+        if not last:
+            return
+
+        with self.conn.pipeline() as pipe:
+
+            for service_name, value in last.iteritems():
+                pipe.hset('%s%s' % (_service_time_basic, service_name), 'last', value)
+
+            for service_name, histogram in all_time.iteritems():
+                key = '%s%s' % (_summary, service_name)
+                self._hincrby(pipe, key, histogram)
+                add_to_index(pipe, key, _summary)
+
+            for (service_name, minute), histogram in by_minute.iteritems():
+                key = '%s%s:%s' % (_summary_by_minute, service_name, minute)
+                self._hincrby(pipe, key, histogram)
+
+                # Same as with raw per-minute lists, there are 5 minutes to aggregate the summary before it expires
+                pipe.expire(key, self.minute_expire)
+                add_to_index(pipe, key, _summary_by_minute, minute, self.minute_expire)
+
+            pipe.execute()
+
+    def run(self, _sleep=sleep):
+        while True:
+            _sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.warn('Could not flush service processing times, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+def pop_histogram(conn, key):
+    """ Returns a histogram stored under a given key and deletes the key in the same transaction, so that no values added
+    by worker processes in the meantime are lost.
+    """
+    with conn.pipeline() as pipe:
+        pipe.hgetall(key)
+        pipe.delete(key)
+        data, _ = pipe.execute()
+
+    return Histogram.from_hash(data)
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
     def __init__(self, conn):
         self.conn = conn
 
-    def delete(self, start, stop, interval):
+    def delete(self, start, stop, interval, _prefix=KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE):
         with self.conn.pipeline() as p:
-            suffixes = (elem.strftime(':%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
+            suffixes = (elem.strftime('%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
             for suffix in suffixes:
-                for key in self.conn.keys('{}*{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix)):
+                for key in get_keys(self.conn, _prefix, suffix, '{}*:{}'.format(_prefix, suffix)):
                     p.delete(key)
 
+                # Keys are also indexed by their hour but that index will simply return keys that no longer exist
+                p.delete(get_index_key(_prefix, suffix))
+
             p.execute()
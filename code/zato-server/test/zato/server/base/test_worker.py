@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common.broker_message import SCHEDULER
+from zato.server.base.worker import WorkerStore
+
+# ################################################################################################################################
+
+class SchedulerJobExecutedBatchTestCase(TestCase):
+
+    def test_each_job_invoked(self):
+
+        executed = []
+
+        def on_job_executed(msg, args=None):
+            if msg['name'] == 'job-2':
+                raise Exception('Test exception')
+            executed.append((msg['name'], args))
+
+        # No connections or configuration are needed to unpack a batch
+        worker_store = WorkerStore.__new__(WorkerStore)
+        worker_store.on_broker_msg_SCHEDULER_JOB_EXECUTED = on_job_executed
+
+        worker_store.on_broker_msg_SCHEDULER_JOB_EXECUTED_BATCH({
+            'action': SCHEDULER.JOB_EXECUTED_BATCH.value,
+            'jobs': [{'action': SCHEDULER.JOB_EXECUTED.value, 'name':'job-{}'.format(idx)} for idx in range(1, 4)]
+        }, 'my-args')
+
+        sleep(0.05)
+
+        # A job that could not be invoked does not prevent the other ones from being invoked
+        self.assertEquals(sorted(executed), [('job-1', 'my-args'), ('job-3', 'my-args')])
+
+# ################################################################################################################################
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures how long it takes for a server process to read its configuration when each process queries ODB on its own,
+# as it was done previously, when the first process queries ODB and saves a snapshot of configuration, and when the other
+# processes read configuration from that snapshot. Uses an SQLite ODB with services, HTTP channels, outgoing connections
+# and security definitions. Run as: python bench_config_snapshot.py [objects]
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import os
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.bunch import Bunch
+from zato.common import SECRETS
+from zato.common.crypto import CryptoManager
+from zato.common.odb.api import ODBManager, WritableTupleQuery
+from zato.common.odb.model import Base, Cluster, HTTPBasicAuth, HTTPSOAP, Service
+from zato.distlock import LockManager
+from zato.server.base.parallel.config import ConfigLoader
+
+# ################################################################################################################################
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1)
+
+# ################################################################################################################################
+
+class Loader(ConfigLoader):
+    """ Has only the attributes of a server process that reading configuration needs.
+    """
+    def __init__(self, odb, crypto_manager, work_dir, kvdb_conn, use_config_snapshot):
+        self.odb = odb
+        self.crypto_manager = crypto_manager
+        self.repo_location = work_dir
+        self.kvdb = Bunch(conn=kvdb_conn)
+        self.zato_lock_manager = LockManager('fcntl', 'zato')
+        self.deployment_key = 'bench'
+        self.deployment_lock_timeout = 60
+        self.config = Bunch()
+        self.component_enabled = Bunch()
+        self.worker_store = Bunch()
+        self.sio_config = Bunch(int=Bunch(exact='id', suffix='_id'), bool=Bunch(prefix='is_'))
+        self.fs_server_config = Bunch(
+            component_enabled=Bunch(stats=False, slow_response=False),
+            misc=Bunch(use_config_snapshot=use_config_snapshot),
+            hot_deploy=Bunch(work_dir=work_dir))
+
+    def encrypt(self, data, _prefix=SECRETS.PREFIX):
+        return '{}{}'.format(_prefix, self.crypto_manager.encrypt(data.encode('utf8')))
+
+    def decrypt(self, encrypted, _prefix=SECRETS.PREFIX):
+        return self.crypto_manager.decrypt(encrypted.replace(_prefix, '', 1))
+
+# ################################################################################################################################
+
+def populate(session, crypto_manager, objects):
+    """ Creates as many objects as given on input, in equal parts services, HTTP channels, outgoing HTTP connections
+    and HTTP Basic Auth definitions, with channels making use of the services and the security definitions.
+    """
+    cluster = Cluster(None, 'bench', None, 'sqlite', None, None, None, None, None, 'localhost', 6379, 'localhost', 11223, 20151)
+    session.add(cluster)
+
+    count = objects // 4
+
+    for idx in xrange(count):
+
+        password = '{}{}'.format(SECRETS.PREFIX, crypto_manager.encrypt(b'password.{}'.format(idx)))
+        security = HTTPBasicAuth(None, 'sec.{}'.format(idx), True, 'user.{}'.format(idx), 'bench', password, cluster)
+        service = Service(None, 'service.{}'.format(idx), True, 'bench.service.Service{}'.format(idx), False, cluster)
+
+        channel = HTTPSOAP(None, 'channel.{}'.format(idx), True, False, 'channel', 'plain_http', None,
+            '/bench/{}'.format(idx), None, '', service=service, security=security, cluster=cluster)
+
+        outconn = HTTPSOAP(None, 'outconn.{}'.format(idx), True, False, 'outgoing', 'plain_http', 'http://localhost',
+            '/bench/{}'.format(idx), None, '', security=security, cluster=cluster)
+
+        session.add_all((security, service, channel, outconn))
+
+    session.commit()
+
+    return cluster
+
+# ################################################################################################################################
+
+def bench(odb, crypto_manager, work_dir, kvdb_conn, server, use_config_snapshot):
+    loader = Loader(odb, crypto_manager, work_dir, kvdb_conn, use_config_snapshot)
+
+    start = time()
+    loader.set_up_config(server)
+
+    return time() - start
+
+# ################################################################################################################################
+
+def main(objects):
+
+    work_dir = mkdtemp(prefix='zato-bench-')
+
+    try:
+        engine = create_engine('sqlite:///{}'.format(os.path.join(work_dir, 'odb.db')))
+        Base.metadata.create_all(engine)
+
+        odb = ODBManager()
+        odb._Session = sessionmaker(bind=engine, query_cls=WritableTupleQuery)
+
+        crypto_manager = CryptoManager(secret_key=CryptoManager.generate_key())
+        cluster = populate(odb.session(), crypto_manager, objects)
+        server = Bunch(cluster=Bunch(id=cluster.id))
+
+        kvdb_conn = FakeRedis()
+        snapshot_path = os.path.join(work_dir, 'config-snapshot.dat')
+
+        print('{:>26} {:>10}'.format('', 'ms'))
+
+        for label, use_config_snapshot in (
+                ('ODB', False),
+                ('ODB + snapshot saved', True),
+                ('snapshot', True),
+            ):
+            took = bench(odb, crypto_manager, work_dir, kvdb_conn, server, use_config_snapshot)
+            print('{:>26} {:>10.1f}'.format(label, took * 1000))
+
+        print('{:>26} {:>10.1f}'.format('snapshot size (kB)', os.path.getsize(snapshot_path) / 1024.0))
+
+    finally:
+        rmtree(work_dir)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+
+# ################################################################################################################################
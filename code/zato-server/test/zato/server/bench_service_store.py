@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures how long it takes for a server process to deploy all of internal services during a cold start, i.e. with no internal
+# cache and no services in ODB, and during a warm one, when both exist already. Each is measured with information about
+# services stored in ODB one commit per service, as it was done previously, and in one transaction per deployment.
+# Modules are imported before measurements start so as to compare only what the service store does. Uses an SQLite ODB.
+# Run as: python bench_service_store.py
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import os
+from importlib import import_module
+from pkgutil import walk_packages
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.bunch import Bunch
+from zato.common.odb.api import ODBManager, WritableTupleQuery
+from zato.common.odb.model import Base, Cluster, Server
+from zato.server.service import internal, store as store_mod
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+
+# Worker-level attributes of service classes do not depend on either the internal cache or ODB
+_set_up_class_attributes = store_mod.set_up_class_attributes
+store_mod.set_up_class_attributes = lambda class_, service_store=None, name=None: _set_up_class_attributes(class_)
+
+# ################################################################################################################################
+
+def get_internal_modules():
+    out = []
+
+    for _, mod_name, _ in walk_packages(internal.__path__, internal.__name__ + '.', onerror=lambda name: None):
+        try:
+            import_module(mod_name)
+        except Exception:
+            continue
+        else:
+            out.append(mod_name)
+
+    return [internal.__name__] + sorted(out)
+
+# ################################################################################################################################
+
+def get_odb(work_dir, name):
+    """ Returns an ODB manager for an SQLite database of the given name, creating the database if it does not exist yet.
+    """
+    engine = create_engine('sqlite:///{}'.format(os.path.join(work_dir, '{}.db'.format(name))))
+    Base.metadata.create_all(engine)
+
+    odb = ODBManager()
+    odb._Session = sessionmaker(bind=engine, query_cls=WritableTupleQuery)
+    odb._session = odb._Session()
+
+    odb.cluster = odb._session.query(Cluster).first()
+
+    if not odb.cluster:
+        odb.cluster = Cluster(None, 'bench', None, 'sqlite', None, None, None, None, None, 'localhost', 6379, 'localhost',
+            11223, 20151)
+        odb._session.add(Server(None, 'bench', odb.cluster, 'bench'))
+        odb._session.commit()
+
+    odb.server = odb._session.query(Server).one()
+
+    return odb
+
+# ################################################################################################################################
+
+def add_services_one_by_one(odb):
+    """ Stores information about each service in ODB separately, with one commit per service, as it was done previously.
+    """
+    def add_services(items):
+        return dict((item.name, odb.add_service(
+            item.name, item.impl_name, item.is_internal, item.deployment_time, item.details, item.source_info))
+                for item in items)
+
+    return add_services
+
+# ################################################################################################################################
+
+def bench(work_dir, modules, odb_name, one_by_one):
+
+    odb = get_odb(work_dir, odb_name)
+
+    if one_by_one:
+        odb.add_services = add_services_one_by_one(odb)
+
+    store = ServiceStore({}, None, odb, Bunch(is_sso_enabled=False))
+    store.patterns_matcher.read_config({'order': 'true_false', '*': 'True'})
+
+    start = time()
+
+    # What the first worker does before deploying services
+    odb.drop_deployed_services(odb.server.id)
+    deployed = store.import_internal_services(modules, work_dir, False, True)
+
+    took = time() - start
+
+    odb._session.close()
+
+    return took, len(deployed)
+
+# ################################################################################################################################
+
+def main():
+
+    work_dir = mkdtemp(prefix='zato-bench-')
+    cache_path = os.path.join(work_dir, 'config', 'repo', 'internal-cache.json')
+
+    try:
+        os.makedirs(os.path.dirname(cache_path))
+        modules = get_internal_modules()
+
+        print('{:>38} {:>10} {:>10}'.format('', 'ms', 'services'))
+
+        for label, odb_name, one_by_one, is_cold in (
+                ('cold, one commit per service', 'odb1', True, True),
+                ('cold, one transaction', 'odb2', False, True),
+                ('warm, one commit per service', 'odb1', True, False),
+                ('warm, one transaction', 'odb2', False, False),
+            ):
+
+            if is_cold and os.path.exists(cache_path):
+                os.remove(cache_path)
+
+            took, services = bench(work_dir, modules, odb_name, one_by_one)
+            print('{:>38} {:>10.1f} {:>10}'.format(label, took * 1000, services))
+
+    finally:
+        rmtree(work_dir)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures CPU time used per idle WebSocket connection, i.e. one that is waiting for its client to reply to a ping,
+# when responses are polled for every 10 ms, as was done previously, and when waiting greenlets are woken up
+# by the response itself. Run as: python bench_web_socket.py [connections] [seconds]
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import resource
+import sys
+from datetime import datetime, timedelta
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.server.connection.web_socket import WebSocket
+
+# ################################################################################################################################
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# ################################################################################################################################
+
+def get_connection(idx):
+    """ Returns a WebSocket object with only the attributes that waiting for responses needs, without an actual socket.
+    """
+    conn = WebSocket.__new__(WebSocket)
+    conn.pub_client_id = 'ws.{}'.format(idx)
+    conn.responses_expected = {}
+    conn.responses_received = {}
+    return conn
+
+# ################################################################################################################################
+
+def wait_polling(conn, request_id, wait_time, _now=datetime.utcnow, _delta=timedelta):
+    """ How responses used to be waited for.
+    """
+    now = _now()
+    until = now + _delta(seconds=wait_time)
+
+    while now < until:
+        response = conn.responses_received.get(request_id)
+        if response:
+            return response
+        else:
+            sleep(0.01)
+            now = _now()
+
+def wait_event(conn, request_id, wait_time):
+    conn._expect_client_response(request_id)
+    return conn._wait_for_client_response(request_id, wait_time)
+
+# ################################################################################################################################
+
+def bench(connections, seconds, wait_func):
+
+    conns = [get_connection(idx) for idx in xrange(connections)]
+
+    # Each connection waits for a response that does not arrive, as it is with pings sent to clients that went quiet
+    cpu_start = get_cpu_time()
+    joinall([spawn(wait_func, conn, 'ping.{}'.format(idx), seconds) for idx, conn in enumerate(conns)])
+    cpu_used = get_cpu_time() - cpu_start
+
+    return cpu_used, cpu_used / connections * 1000000 / seconds
+
+# ################################################################################################################################
+
+def main(connections, seconds):
+    print('{:>10} {:>12} {:>22}'.format('', 'cpu s', 'cpu us/s/connection'))
+
+    for label, wait_func in (('polling', wait_polling), ('event', wait_event)):
+        cpu_used, per_connection = bench(connections, seconds, wait_func)
+        print('{:>10} {:>12.2f} {:>22.2f}'.format(label, cpu_used, per_connection))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 10.0)
+
+# ################################################################################################################################
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures how many messages per second can be exchanged between servers and the IBM MQ connector, without an actual
+# queue manager, in both directions - when servers send messages to the connector and when the connector delivers to servers
+# messages taken off queues. Each is measured with a new HTTP connection per message, as it was done previously,
+# with persistent connections and with batches. Run as: python bench_wmq_ipc.py [messages] [batch_size]
+
+# stdlib
+import logging
+import sys
+from json import dumps, loads
+from thread import start_new_thread
+from threading import Event, Lock
+from time import time
+
+# requests
+from requests import post, Session
+
+# Zato
+from zato.common.util import get_free_port
+from zato.server.connection.jms_wmq.jms.container import CallbackBatcher, make_keep_alive_server
+
+# ################################################################################################################################
+
+auth = ('bench', 'bench')
+send_response = dumps({'msg_id': '00', 'correlation_id': '00'})
+
+# ################################################################################################################################
+
+class Counter(object):
+    """ A WSGI application counting messages received, either one at a time or in batches.
+    """
+    def __init__(self):
+        self.received = 0
+        self.expected = 0
+        self.done = Event()
+        self.lock = Lock()
+
+    def __call__(self, environ, start_response):
+        data = loads(environ['wsgi.input'].read(int(environ['CONTENT_LENGTH'])))
+
+        if 'msg_list' in data:
+            count = len(data['msg_list'])
+            response = dumps([loads(send_response)] * count)
+        else:
+            count = 1
+            response = send_response
+
+        with self.lock:
+            self.received += count
+            if self.received >= self.expected:
+                self.done.set()
+
+        start_response(b'200 OK', [(b'Content-type', b'text/json')])
+        return [response]
+
+# ################################################################################################################################
+
+def get_msg(idx):
+    return {'data': 'Message {}'.format(idx), 'outconn_name': 'bench', 'queue_name': 'BENCH.1'}
+
+# ################################################################################################################################
+
+def bench_send(address, messages, batch_size, label):
+
+    session = Session()
+    session.auth = auth
+    start = time()
+
+    if label == 'new connection':
+        for idx in xrange(messages):
+            post(address, data=dumps(get_msg(idx)), auth=auth)
+
+    elif label == 'persistent':
+        for idx in xrange(messages):
+            session.post(address, data=dumps(get_msg(idx)))
+
+    else:
+        for idx in xrange(0, messages, batch_size):
+            session.post(address, data=dumps({'msg_list': [get_msg(idx) for idx in xrange(idx, idx + batch_size)]}))
+
+    return messages / (time() - start)
+
+# ################################################################################################################################
+
+def bench_receive(address, counter, messages, batch_size, label):
+
+    counter.received = 0
+    counter.expected = messages
+    counter.done.clear()
+
+    start = time()
+
+    if label == 'new connection':
+        for idx in xrange(messages):
+            post(address, data=dumps({'msg': get_msg(idx)}), auth=auth)
+    else:
+        batcher = CallbackBatcher(address, auth, batch_size if label == 'batches' else 1, 0.01, logging.getLogger(__name__))
+        batcher.start()
+
+        for idx in xrange(messages):
+            batcher.put({'msg': get_msg(idx)})
+
+        counter.done.wait()
+        batcher.keep_running = False
+
+    return messages / (time() - start)
+
+# ################################################################################################################################
+
+def main(messages, batch_size):
+
+    counter = Counter()
+    port = get_free_port(35000)
+    server = make_keep_alive_server(b'127.0.0.1', port, counter)
+    start_new_thread(server.serve_forever, ())
+
+    address = 'http://127.0.0.1:{}/api'.format(port)
+
+    print('{:>16} {:>14} {:>14}'.format('', 'send msg/s', 'receive msg/s'))
+
+    for label in ('new connection', 'persistent', 'batches'):
+        sent = bench_send(address, messages, batch_size, label)
+        received = bench_receive(address, counter, messages, batch_size, label)
+        print('{:>16} {:>14.0f} {:>14.0f}'.format(label, sent, received))
+
+    server.shutdown()
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+
+# ################################################################################################################################
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import defaultdict
+from socket import timeout as socket_timeout
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# mock
+from mock import patch
+
+# Zato
+from zato.common import AMQP
+from zato.server.connection.amqp_ import ConnectorAMQP, Consumer, NotConfirmed
+
+# ################################################################################################################################
+
+class FakeMessage(object):
+    def __init__(self, delivery_tag, routing_key='key.1'):
+        self.delivery_tag = delivery_tag
+        self.delivery_info = {'routing_key': routing_key}
+        self.acks = []
+        self.rejects = 0
+        self._state = 'RECEIVED'
+
+    def ack(self, multiple=False):
+        self.acks.append(multiple)
+        self._state = 'ACK'
+
+    def reject(self):
+        self.rejects += 1
+        self._state = 'REJECTED'
+
+# ################################################################################################################################
+
+class ConsumerTestCase(TestCase):
+
+    def get_consumer(self, on_amqp_message, **config):
+        config.setdefault('dispatch_pool_size', 10)
+        config.setdefault('ack_batch_size', 100)
+        config.setdefault('ack_batch_time', 60)
+        return Consumer(Bunch(name='test', queue='test', **config), on_amqp_message)
+
+    def test_ack_batch(self):
+
+        def on_amqp_message(body, msg, *ignored):
+            sleep(0.01 * (3 - msg.delivery_tag)) # Older messages complete last
+            return True
+
+        consumer = self.get_consumer(on_amqp_message, ack_batch_size=3)
+        msgs = [FakeMessage(tag) for tag in range(1, 4)]
+
+        for msg in msgs:
+            consumer._on_amqp_message(None, msg)
+
+        consumer.pool.join()
+        consumer.flush_acks()
+
+        # All three were acknowledged with a single ack sent for the newest one
+        self.assertEquals([msg.acks for msg in msgs], [[], [], [True]])
+
+        metrics = consumer.get_metrics()
+        self.assertEquals(metrics['in_flight'], 0)
+        self.assertEquals(metrics['awaiting_ack'], 0)
+        self.assertEquals(metrics['acks_sent'], 1)
+        self.assertEquals(metrics['msgs_acked'], 3)
+
+    def test_ack_waits_for_older_messages(self):
+
+        def on_amqp_message(body, msg, *ignored):
+            if msg.delivery_tag == 1:
+                sleep(0.1)
+            return True
+
+        consumer = self.get_consumer(on_amqp_message)
+        msgs = [FakeMessage(tag) for tag in range(1, 3)]
+
+        for msg in msgs:
+            consumer._on_amqp_message(None, msg)
+
+        sleep(0.02)
+        consumer.flush_acks(True)
+
+        # The second message is handled but cannot be acknowledged before the first one is
+        self.assertEquals([msg.acks for msg in msgs], [[], []])
+        self.assertEquals(consumer.get_metrics()['awaiting_ack'], 1)
+
+        consumer.pool.join()
+        consumer.flush_acks(True)
+        self.assertEquals([msg.acks for msg in msgs], [[], [True]])
+
+    def test_ack_after_failure(self):
+
+        def on_amqp_message(body, msg, *ignored):
+            if msg.delivery_tag == 2:
+                raise Exception('Expected')
+            return True
+
+        consumer = self.get_consumer(on_amqp_message)
+        msgs = [FakeMessage(tag) for tag in range(1, 5)]
+
+        for msg in msgs:
+            consumer._on_amqp_message(None, msg)
+
+        consumer.pool.join()
+        consumer.flush_acks(True)
+
+        # The message that failed is left unacknowledged and so messages after it are acknowledged one by one
+        self.assertEquals([msg.acks for msg in msgs], [[True], [], [False], [False]])
+
+    def get_connector_consumer(self, on_message_callback, ack_mode):
+        """ Returns a consumer that invokes services through a connector's on_amqp_message.
+        """
+        connector = ConnectorAMQP.__new__(ConnectorAMQP)
+        connector.on_message_callback = on_message_callback
+
+        return self.get_consumer(connector.on_amqp_message, id=1, service_name='test', data_format=None, ack_mode=ack_mode)
+
+    def test_reject_mode(self):
+
+        def on_message_callback(*ignored_args, **ignored_kwargs):
+            pass
+
+        consumer = self.get_connector_consumer(on_message_callback, AMQP.ACK_MODE.REJECT.id)
+        msgs = [FakeMessage(tag) for tag in range(1, 4)]
+
+        for msg in msgs:
+            consumer._on_amqp_message(None, msg)
+
+        # Greenlets from the dispatch pool do not write to the channel ..
+        consumer.pool.join()
+        self.assertEquals([msg.rejects for msg in msgs], [0, 0, 0])
+
+        # .. it is the consumer itself that rejects messages and this does not make any message unsettled.
+        consumer.flush_acks(True)
+        self.assertEquals([msg.rejects for msg in msgs], [1, 1, 1])
+        self.assertEquals([msg.acks for msg in msgs], [[], [], []])
+        self.assertFalse(consumer.ack_state.has_unsettled)
+
+    def test_service_acks_itself(self):
+
+        def on_message_callback(*ignored_args, **kwargs):
+            msg = kwargs['zato_ctx']['zato.channel_item']['amqp_msg']
+            if msg.delivery_tag == 2:
+                msg.ack()
+            elif msg.delivery_tag == 3:
+                msg.reject()
+
+        consumer = self.get_connector_consumer(on_message_callback, AMQP.ACK_MODE.ACK.id)
+        msgs = [FakeMessage(tag) for tag in range(1, 5)]
+
+        for msg in msgs:
+            consumer._on_amqp_message(None, msg)
+
+        consumer.pool.join()
+        consumer.flush_acks(True)
+
+        # Messages that services settled themselves are skipped and the rest are still acknowledged in one go
+        self.assertEquals([msg.acks for msg in msgs], [[], [False], [], [True]])
+        self.assertEquals([msg.rejects for msg in msgs], [0, 0, 1, 0])
+        self.assertFalse(consumer.ack_state.has_unsettled)
+        self.assertEquals(consumer.get_metrics()['acks_sent'], 1)
+
+    def test_preserve_order(self):
+
+        handled = []
+
+        def on_amqp_message(body, msg, *ignored):
+            sleep(0.01 * (3 - msg.delivery_tag))
+            handled.append(msg.delivery_tag)
+            return True
+
+        consumer = self.get_consumer(on_amqp_message, preserve_order=True)
+
+        for tag in range(1, 4):
+            consumer._on_amqp_message(None, FakeMessage(tag))
+
+        consumer.pool.join()
+        self.assertEquals(handled, [1, 2, 3])
+        self.assertFalse(consumer.ack_state.by_routing_key)
+
+# ################################################################################################################################
+
+class FakeChannel(object):
+    """ Confirms messages published once drain_events is called, except for the ones whose delivery tags are to be nacked
+    or ignored, i.e. not confirmed at all.
+    """
+    def __init__(self, nack=(), ignore=()):
+        self.events = defaultdict(set)
+        self.nack = nack
+        self.ignore = ignore
+        self.published = []
+        self.confirmed = 0
+        self.max_pending = 0
+
+    def confirm_select(self):
+        pass
+
+    def publish(self, msg, **kwargs):
+        self.published.append(msg)
+        self.max_pending = max(self.max_pending, len(self.published) - self.confirmed)
+
+    def drain_events(self, timeout):
+        if self.confirmed == len(self.published):
+            raise socket_timeout()
+
+        for delivery_tag in range(self.confirmed + 1, len(self.published) + 1):
+            self.confirmed = delivery_tag
+            if delivery_tag in self.ignore:
+                continue
+            event = 'basic_nack' if delivery_tag in self.nack else 'basic_ack'
+            for callback in self.events[event]:
+                callback(delivery_tag, False)
+
+# ################################################################################################################################
+
+class PublishConfirmTestCase(TestCase):
+
+    def publish(self, channel, msg_list, confirm_window):
+        out = [None] * len(msg_list)
+
+        with patch('zato.server.connection.amqp_.Producer', lambda channel: channel):
+            connector = ConnectorAMQP.__new__(ConnectorAMQP)
+            connector._publish_confirm(channel, channel, out, msg_list, None, {}, confirm_window, 0.01)
+
+        return out
+
+    def test_all_confirmed(self):
+        channel = FakeChannel()
+        out = self.publish(channel, range(10), 3)
+
+        self.assertEquals(out, [True] * 10)
+        self.assertEquals(channel.published, range(10))
+        self.assertEquals(channel.max_pending, 3)
+
+    def test_not_confirmed(self):
+        channel = FakeChannel(nack=(2,), ignore=(4,))
+        out = self.publish(channel, range(5), 10)
+
+        self.assertEquals(out[0], True)
+        self.assertIsInstance(out[1], NotConfirmed)
+        self.assertEquals(out[2], True)
+        self.assertIsInstance(out[3], NotConfirmed)
+        self.assertEquals(out[4], True)
+
+# ################################################################################################################################
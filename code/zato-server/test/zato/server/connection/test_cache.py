@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common import CACHE
+from zato.server.connection.cache import Cache, CacheAPI
+
+# ################################################################################################################################
+
+_SET = CACHE.STATE_CHANGED.SET
+_DELETE = CACHE.STATE_CHANGED.DELETE
+_EXPIRE = CACHE.STATE_CHANGED.EXPIRE
+_CLEAR = CACHE.STATE_CHANGED.CLEAR
+_SET_BY_PREFIX = CACHE.STATE_CHANGED.SET_BY_PREFIX
+_DELETE_BY_REGEX = CACHE.STATE_CHANGED.DELETE_BY_REGEX
+
+# ################################################################################################################################
+
+def get_config(**config):
+    config.setdefault('name', 'test')
+    config.setdefault('sync_method', CACHE.SYNC_METHOD.IN_BATCHES.id)
+    config.setdefault('sync_batch_window', 60000)
+    config.setdefault('after_state_changed_callback', None)
+    config.setdefault('after_state_changed_batch_callback', None)
+
+    return Bunch(max_size=1000, max_item_size=1000, extend_expiry_on_get=True, extend_expiry_on_set=True, **config)
+
+# ################################################################################################################################
+
+class SyncBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def get_cache(self, **config):
+        config.setdefault('after_state_changed_batch_callback', lambda name, batch: self.batches.append(batch))
+        return Cache(get_config(**config))
+
+    def flush(self, cache):
+        cache._flush_sync_batch()
+        return [(op, data['key']) for op, data in self.batches.pop()] if self.batches else []
+
+    def test_value_ops_collapse_per_key(self):
+        cache = self.get_cache()
+
+        cache.set('a', 1)
+        cache.set('b', 1)
+        cache.set('a', 2)
+        cache.delete('b')
+
+        # The last change to a given key replaces all earlier ones and is sent in the order it was made in
+        self.assertEquals(cache.sync_batch.values()[0][1]['value'], 2)
+        self.assertEquals(self.flush(cache), [(_SET, 'a'), (_DELETE, 'b')])
+        self.assertEquals(self.flush(cache), [])
+
+    def test_expiry_ops_collapse_per_key(self):
+        cache = self.get_cache()
+
+        cache.set('a', 1)
+        cache.expire('a', 10)
+        cache.expire('a', 20)
+
+        # An expire replaces an earlier expire only
+        self.assertEquals(cache.sync_batch.values()[-1][1]['expiry'], 20)
+        self.assertEquals(self.flush(cache), [(_SET, 'a'), (_EXPIRE, 'a')])
+
+        # A set replaces an earlier expire too
+        cache.expire('a', 5)
+        cache.set('a', 3)
+        self.assertEquals(self.flush(cache), [(_SET, 'a')])
+
+    def test_other_ops_keep_order(self):
+        cache = self.get_cache()
+
+        cache._add_to_sync_batch(_SET_BY_PREFIX, 'test', {'key':'p'})
+        cache._add_to_sync_batch(_SET, 'test', {'key':'a'})
+        cache._add_to_sync_batch(_DELETE_BY_REGEX, 'test', {'key':'r'})
+        cache._add_to_sync_batch(_SET_BY_PREFIX, 'test', {'key':'p'})
+        cache._add_to_sync_batch(_SET, 'test', {'key':'a'})
+
+        # Other operations are never coalesced, even if repeated
+        self.assertEquals(self.flush(cache), [(_SET_BY_PREFIX, 'p'), (_DELETE_BY_REGEX, 'r'), (_SET_BY_PREFIX, 'p'), (_SET, 'a')])
+
+    def test_clear_supersedes_everything(self):
+        cache = self.get_cache()
+
+        cache.set('a', 1)
+        cache._add_to_sync_batch(_SET_BY_PREFIX, 'test', {'key':'p'})
+        cache.clear()
+        cache.set('b', 1)
+
+        batch = cache.sync_batch.values()
+        self.assertEquals([op for op, data in batch], [_CLEAR, _SET])
+        self.assertEquals(batch[1][1]['key'], 'b')
+
+    def test_sync_after_batch(self):
+        cache = self.get_cache()
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        cache.delete('b')
+        cache.expire('c', 60)
+
+        cache._flush_sync_batch()
+
+        other = self.get_cache(sync_method=CACHE.SYNC_METHOD.NO_SYNC.id)
+        other.set('b', 2)
+        other.sync_after_batch(self.batches.pop())
+
+        self.assertEquals(sorted(other.impl.keys()), ['a', 'c'])
+        self.assertEquals(other.get('c'), 3)
+
+    def test_close_stops_batch_loop(self):
+        cache = self.get_cache(sync_batch_window=10)
+        self.assertTrue(cache.has_sync_batch_loop)
+
+        cache.set('a', 1)
+        cache.close()
+        sleep(0.05)
+
+        # Changes buffered are not sent out after the cache is closed
+        self.assertFalse(cache.has_sync_batch_loop)
+        self.assertEquals(self.batches, [])
+
+# ################################################################################################################################
+
+class CacheAPITestCase(TestCase):
+
+    def test_delete_closes_cache(self):
+
+        published = []
+
+        api = CacheAPI(Bunch(worker_id=1, broker_client=Bunch(publish=published.append)))
+        api.create(get_config(cache_type=CACHE.TYPE.BUILTIN, is_default=False, sync_batch_window=10))
+
+        cache = api.builtin['test']
+        cache.set('a', 1)
+
+        api.delete(Bunch(cache_type=CACHE.TYPE.BUILTIN, name='test'))
+        sleep(0.05)
+
+        self.assertNotIn('test', api.builtin)
+        self.assertFalse(cache.keep_running)
+        self.assertFalse(cache.has_sync_batch_loop)
+        self.assertEquals(published, [])
+
+# ################################################################################################################################
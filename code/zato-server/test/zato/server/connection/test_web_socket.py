@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from timeit import default_timer
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# pyrapidjson
+from rapidjson import loads
+
+# gevent
+from gevent import spawn_later
+
+# Zato
+from zato.server.connection.web_socket import KeepAliveManager, WebSocket
+
+# ################################################################################################################################
+
+def get_connection(pub_client_id='ws.1', class_=WebSocket):
+    conn = class_.__new__(class_)
+    conn.pub_client_id = pub_client_id
+    conn.responses_expected = {}
+    return conn
+
+# ################################################################################################################################
+
+class ClientResponseTestCase(TestCase):
+
+    def get_connection(self):
+        return get_connection()
+
+    def test_response_wakes_up_waiter(self):
+        conn = self.get_connection()
+        msg = Bunch(in_reply_to='req.1', data='abc')
+
+        conn._expect_client_response('req.1')
+        spawn_later(0.05, conn._handle_client_response, 'cid.1', msg)
+
+        start = default_timer()
+        self.assertIs(conn._wait_for_client_response('req.1', 5), msg)
+        self.assertLess(default_timer() - start, 1)
+        self.assertFalse(conn.responses_expected)
+
+    def test_response_before_wait(self):
+        conn = self.get_connection()
+
+        # The response arrives before the sender started to wait for it
+        conn._expect_client_response('req.1')
+        conn._set_client_response('req.1', True)
+
+        self.assertIs(conn._wait_for_client_response('req.1', 5), True)
+
+    def test_timeout(self):
+        conn = self.get_connection()
+
+        conn._expect_client_response('req.1')
+        self.assertIsNone(conn._wait_for_client_response('req.1', 0.05))
+        self.assertFalse(conn.responses_expected)
+
+        # A response that comes too late is ignored
+        conn._set_client_response('req.1', True)
+        self.assertFalse(conn.responses_expected)
+
+# ################################################################################################################################
+
+class KeepAliveManagerTestCase(TestCase):
+
+    def test_ping_batch(self):
+
+        events = []
+
+        class _WebSocket(WebSocket):
+            stream = True
+
+            def ping(self, data):
+
+                # Only the first client responds
+                if self.pub_client_id == 'ws.1':
+                    request_id = loads(data)['meta']['id']
+                    spawn_later(0.01, self._set_client_response, request_id, True)
+
+            def on_ping_response(self, ping_extend):
+                events.append(('response', self.pub_client_id, ping_extend))
+
+            def on_ping_missed(self):
+                events.append(('missed', self.pub_client_id))
+
+        keep_alive = KeepAliveManager('test', ping_interval=30, ping_wait_time=0.1)
+        keep_alive.is_running = True # So that no dispatcher greenlet is started
+
+        conns = []
+        for pub_client_id in ('ws.1', 'ws.2'):
+            conn = get_connection(pub_client_id, _WebSocket)
+            keep_alive.add(conn)
+            conns.append(conn)
+
+        keep_alive.ping_batch(conns)
+
+        self.assertEquals(events, [('response', 'ws.1', 30), ('missed', 'ws.2')])
+
+        for conn in conns:
+            self.assertFalse(conn.responses_expected)
+
+        metrics = keep_alive.get_metrics()
+        self.assertEquals(metrics['connections'], 2)
+        self.assertEquals(metrics['pings_sent'], 2)
+        self.assertEquals(metrics['pings_missed'], 1)
+        self.assertGreater(metrics['ping_rtt_max'], 0)
+
+    def test_ping_batch_response_during_ping(self):
+
+        events = []
+
+        class _WebSocket(WebSocket):
+            stream = True
+
+            def ping(self, data):
+
+                # The response arrives before ping returns
+                self._set_client_response(loads(data)['meta']['id'], True)
+
+            def on_ping_response(self, ping_extend):
+                events.append(('response', self.pub_client_id, ping_extend))
+
+        keep_alive = KeepAliveManager('test', ping_interval=30, ping_wait_time=0.1)
+        keep_alive.is_running = True
+
+        conn = get_connection('ws.1', _WebSocket)
+        keep_alive.add(conn)
+        keep_alive.ping_batch([conn])
+
+        self.assertEquals(events, [('response', 'ws.1', 30)])
+        self.assertFalse(conn.responses_expected)
+        self.assertEquals(keep_alive.get_metrics()['pings_missed'], 0)
+
+    def test_remove(self):
+        keep_alive = KeepAliveManager('test')
+        keep_alive.is_running = True
+
+        conn = get_connection()
+        keep_alive.add(conn)
+        keep_alive.remove(conn)
+
+        self.assertEquals(keep_alive.get_metrics()['connections'], 0)
+        self.assertIs(keep_alive.heap[0][-1], None)
+
+# ################################################################################################################################
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from timeit import default_timer
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common.util.time_ import utcnow_as_ms
+from zato.server.pubsub import InRAMSyncBacklog
+
+# ################################################################################################################################
+
+def get_backlog():
+    pubsub = Bunch()
+    pubsub.server = Bunch(name='server1', pid=123)
+    pubsub.get_topic_by_id = lambda topic_id: Bunch(name='/topic/{}'.format(topic_id))
+    return InRAMSyncBacklog(pubsub)
+
+def get_messages(topic_id, count, expiration_time=None):
+    expiration_time = expiration_time or utcnow_as_ms() + 3600
+    return [{'pub_msg_id': 'msg-{}-{}'.format(topic_id, idx), 'topic_id': topic_id, 'expiration_time': expiration_time}
+        for idx in xrange(count)]
+
+# ################################################################################################################################
+
+class InRAMSyncBacklogTestCase(TestCase):
+
+    def assert_empty(self, backlog):
+        self.assertFalse(backlog.msg_id_to_msg)
+        self.assertFalse(backlog.msg_id_to_sub_key)
+        self.assertFalse(backlog.msg_id_to_topic_id)
+        self.assertFalse(any(backlog.topic_msg_id.values()))
+        self.assertFalse(any(backlog.sub_key_to_msg_id.values()))
+
+# ################################################################################################################################
+
+    def test_reverse_mappings(self):
+        backlog = get_backlog()
+        backlog.add_messages('cid', 1, '/topic/1', 100, ['sk1', 'sk2'], get_messages(1, 3))
+        backlog.add_messages('cid', 2, '/topic/2', 100, ['sk3'], get_messages(2, 2))
+
+        self.assertEquals(backlog.msg_id_to_topic_id['msg-1-0'], 1)
+        self.assertEquals(backlog.msg_id_to_topic_id['msg-2-1'], 2)
+        self.assertEquals(backlog.msg_id_to_sub_key['msg-1-2'], set(['sk1', 'sk2']))
+        self.assertEquals(backlog.msg_id_to_sub_key['msg-2-0'], set(['sk3']))
+
+        backlog.delete_messages(['msg-1-0'])
+        self.assertNotIn('msg-1-0', backlog.msg_id_to_topic_id)
+        self.assertEquals(backlog.topic_msg_id[1], set(['msg-1-1', 'msg-1-2']))
+        self.assertEquals(backlog.sub_key_to_msg_id['sk1'], set(['msg-1-1', 'msg-1-2']))
+        self.assertEquals(backlog.sub_key_to_msg_id['sk3'], set(['msg-2-0', 'msg-2-1']))
+
+        backlog.clear_topic(1)
+        backlog.clear_topic(2)
+        self.assert_empty(backlog)
+
+# ################################################################################################################################
+
+    def test_max_depth_not_in_reverse_mapping(self):
+        backlog = get_backlog()
+        backlog.log_messages_to_store = lambda *ignored: None
+        backlog.add_messages('cid', 1, '/topic/1', 1, ['sk1'], get_messages(1, 2))
+
+        self.assertEquals(backlog.msg_id_to_sub_key['msg-1-0'], set())
+        self.assertFalse(backlog.sub_key_to_msg_id)
+
+        backlog.clear_topic(1)
+        self.assert_empty(backlog)
+
+# ################################################################################################################################
+
+    def test_unsubscribe(self):
+        backlog = get_backlog()
+        backlog.add_messages('cid', 1, '/topic/1', 100, ['sk1', 'sk2'], get_messages(1, 2))
+
+        backlog.unsubscribe(1, '/topic/1', ['sk1'])
+        self.assertEquals(backlog.msg_id_to_sub_key['msg-1-0'], set(['sk2']))
+        self.assertEquals(backlog.msg_id_to_topic_id['msg-1-0'], 1)
+
+        backlog.unsubscribe(1, '/topic/1', ['sk2'])
+        self.assert_empty(backlog)
+
+# ################################################################################################################################
+
+    def test_retrieve(self):
+        backlog = get_backlog()
+        backlog.add_messages('cid', 1, '/topic/1', 100, ['sk1'], get_messages(1, 2))
+
+        self.assertEquals(len(backlog.retrieve_messages_by_sub_keys(1, ['sk1'])), 2)
+        self.assert_empty(backlog)
+
+# ################################################################################################################################
+
+    def test_delete_load_10k_subscribers(self):
+        """ Deletes messages of one topic while 10k other subscribers have messages of their own waiting in other topics.
+        """
+        backlog = get_backlog()
+
+        for idx in xrange(10000):
+            topic_id = 1000 + idx
+            backlog.add_messages('cid', topic_id, '/topic/{}'.format(topic_id), 100, ['sk-{}'.format(idx)],
+                get_messages(topic_id, 1))
+
+        backlog.add_messages('cid', 1, '/topic/1', 10000, ['sk-a', 'sk-b'], get_messages(1, 2000))
+
+        start = default_timer()
+        backlog.clear_topic(1)
+        elapsed = default_timer() - start
+
+        # Without the reverse mappings, each of the messages would be looked up in each of the 10k sets
+        self.assertLess(elapsed, 1.0)
+
+        self.assertFalse(backlog.topic_msg_id[1])
+        self.assertFalse(backlog.sub_key_to_msg_id['sk-a'])
+        self.assertEquals(len(backlog.msg_id_to_msg), 10000)
+        self.assertEquals(len(backlog.msg_id_to_topic_id), 10000)
+        self.assertEquals(backlog.sub_key_to_msg_id['sk-9999'], set(['msg-10999-0']))
+
+# ################################################################################################################################
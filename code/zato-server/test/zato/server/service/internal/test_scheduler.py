@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+
+# Bunch
+from bunch import Bunch
+
+# SQLAlchemy
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import SCHEDULER
+from zato.common.odb.model import Job
+from zato.common.test import ODBTestCase
+from zato.server.service.internal.scheduler import DeactivateList
+
+# ################################################################################################################################
+
+class DeactivateListTestCase(ODBTestCase):
+
+    def setUp(self):
+        super(DeactivateListTestCase, self).setUp()
+        self.session = sessionmaker(bind=self.engine)
+
+        session = self.session()
+        for idx in range(1, 5):
+            session.add(Job(idx, 'job-{}'.format(idx), True, SCHEDULER.JOB_TYPE.ONE_TIME, datetime.utcnow(),
+                cluster_id=1, service_id=1))
+        session.commit()
+        session.close()
+
+    def test_deactivate_list(self):
+
+        DeactivateList.get_name()
+
+        service = DeactivateList()
+        service.odb = Bunch(session=self.session)
+        service.request = Bunch(input=Bunch(id_list=[1, 3]))
+        service.handle()
+
+        session = self.session()
+        is_active = dict(session.query(Job.id, Job.is_active).all())
+        session.close()
+
+        # Only the jobs given on input are deactivated
+        self.assertEquals(is_active, {1:False, 2:True, 3:False, 4:True})
+
+# ################################################################################################################################
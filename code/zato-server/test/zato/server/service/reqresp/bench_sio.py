@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Measures how long it takes to parse the input and produce the output of a service with 30 SimpleIO parameters,
+# with and without the SimpleIO definition compiled upfront. Run as: python bench_sio.py [iterations]
+
+# stdlib
+import logging
+import sys
+from timeit import default_timer
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import DATA_FORMAT
+from zato.server.service.reqresp import Request, SimpleIOPayload
+from zato.server.service.reqresp.sio import Boolean, Integer, SIOPlan, Unicode
+
+# ################################################################################################################################
+
+logger = logging.getLogger(__name__)
+
+simple_io_config = Bunch()
+simple_io_config.bool_parameter_prefixes = ['is_', 'needs_', 'should_']
+simple_io_config.int_parameters = ['id']
+simple_io_config.int_parameter_suffixes = ['_id', '_count', '_size']
+
+# ################################################################################################################################
+
+class SimpleIO:
+    input_required = ['id', 'user_id', 'account_id', 'name', 'description', 'is_active', 'needs_review',
+        Integer('priority'), Unicode('title'), 'item_count', 'page_size', 'city', 'country', 'street', 'zip_code']
+    input_optional = ['order_id', 'should_notify', 'email', 'phone', Boolean('flag'), 'comment', 'region', 'status',
+        'created', 'updated', 'owner_id', 'is_internal', 'tag', 'source', 'target']
+    output_required = input_required
+    output_optional = input_optional
+
+# ################################################################################################################################
+
+def get_payload():
+    payload = {}
+
+    for param in SimpleIO.input_required + SimpleIO.input_optional:
+        name = getattr(param, 'name', param)
+        if name.startswith(('is_', 'needs_', 'should_')) or name == 'flag':
+            value = 'true'
+        elif name == 'id' or name == 'priority' or name.endswith(('_id', '_count', '_size')):
+            value = '123'
+        else:
+            value = 'abc'
+        payload[name] = value
+
+    return payload
+
+# ################################################################################################################################
+
+def bench_request(payload, iterations, sio_plan):
+    start = default_timer()
+
+    for idx in xrange(iterations):
+        request = Request(logger, simple_io_config)
+        request.payload = payload
+        request.init(True, 'cid', SimpleIO, DATA_FORMAT.JSON, 'http', {}, None, sio_plan)
+
+    return (default_timer() - start) / iterations
+
+# ################################################################################################################################
+
+def bench_response(output, iterations, sio_plan):
+    start = default_timer()
+
+    for idx in xrange(iterations):
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, SimpleIO.output_required, SimpleIO.output_optional,
+            simple_io_config, 'response', '', False, False, [], False, sio_plan)
+        payload.set_payload_attrs(output)
+        payload.getvalue(False)
+
+    return (default_timer() - start) / iterations
+
+# ################################################################################################################################
+
+def main(iterations):
+    payload = get_payload()
+    sio_plan = SIOPlan(SimpleIO, simple_io_config)
+
+    # Both ways must give the same results
+    request1 = Request(logger, simple_io_config)
+    request1.payload = payload
+    request1.init(True, 'cid', SimpleIO, DATA_FORMAT.JSON, 'http', {}, None)
+
+    request2 = Request(logger, simple_io_config)
+    request2.payload = payload
+    request2.init(True, 'cid', SimpleIO, DATA_FORMAT.JSON, 'http', {}, None, sio_plan)
+
+    assert request1.input == request2.input, (request1.input, request2.input)
+    output = dict(request1.input)
+
+    print('{:>10} {:>14} {:>14}'.format('', 'request [us]', 'response [us]'))
+
+    for label, plan in (('generic', None), ('compiled', sio_plan)):
+        request_latency = bench_request(payload, iterations, plan)
+        response_latency = bench_response(output, iterations, plan)
+        print('{:>10} {:>14.3f} {:>14.3f}'.format(label, request_latency * 1e6, response_latency * 1e6))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+
+# ################################################################################################################################
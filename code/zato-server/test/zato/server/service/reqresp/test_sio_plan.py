@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from logging import getLogger
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import DATA_FORMAT, ParsingException
+from zato.server.service.reqresp import Request, SimpleIOPayload
+from zato.server.service.reqresp.sio import AsIs, Boolean, Integer, NO_SIO_CONFIG_LIST, SIOPlan, Unicode
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+def get_simple_io_config():
+    simple_io_config = Bunch()
+    simple_io_config.bool_parameter_prefixes = ['is_']
+    simple_io_config.int_parameters = ['id']
+    simple_io_config.int_parameter_suffixes = ['_id']
+    return simple_io_config
+
+# ################################################################################################################################
+
+class MySIO:
+    input_required = ('id', 'user_id', 'is_active', Integer('count'), 'name')
+    input_optional = (Boolean('flag'), Unicode('comment'), AsIs('raw_id'), 'password', 'missing')
+    output_required = ('id', 'user_id', 'is_active', Integer('count'), 'name')
+    output_optional = (Boolean('flag'), Unicode('comment'), AsIs('raw_id'), 'missing')
+    force_empty_keys = ('missing',)
+
+# ################################################################################################################################
+
+class SIOPlanTestCase(TestCase):
+
+    def setUp(self):
+        self.simple_io_config = get_simple_io_config()
+        self.sio_plan = SIOPlan(MySIO, self.simple_io_config)
+
+    def get_input(self, payload, sio_plan, channel_params=None):
+        request = Request(logger, self.simple_io_config)
+        request.payload = payload
+        request.channel_params.update(channel_params or {})
+        request.init(True, 'cid', MySIO, DATA_FORMAT.JSON, 'http', {}, lambda value: 'enc-{}'.format(value), sio_plan)
+        return request.input
+
+    def get_output(self, sio_plan, skip_empty_keys=False, repeated=False, **output):
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, MySIO.output_required, MySIO.output_optional,
+            self.simple_io_config, 'response', '', False, skip_empty_keys, MySIO.force_empty_keys, False, sio_plan)
+
+        if repeated:
+            payload.append(output)
+            payload.append(output)
+        else:
+            payload.set_payload_attrs(output)
+
+        return payload.getvalue(False)
+
+# ################################################################################################################################
+
+    def test_compile(self):
+        fields = dict((field[1], field) for field in self.sio_plan.input_required + self.sio_plan.input_optional)
+
+        # param, param_name, is_bool, is_int, is_secret, is_force_type, is_complex, is_as_is, is_opaque
+        self.assertEquals(fields['id'][1:], ('id', False, True, False, False, False, False, False))
+        self.assertEquals(fields['is_active'][1:], ('is_active', True, False, False, False, False, False, False))
+        self.assertEquals(fields['flag'][1:], ('flag', True, False, False, True, False, False, False))
+        self.assertEquals(fields['raw_id'][1:], ('raw_id', False, True, False, True, True, True, True))
+        self.assertEquals(fields['password'][1:], ('password', False, False, True, False, False, False, False))
+
+        self.assertEquals(self.sio_plan.output_names, set(['id', 'user_id', 'is_active', 'count', 'name', 'flag', 'comment',
+            'raw_id', 'missing']))
+        self.assertEquals([(is_required, is_force_empty, field[1]) for is_required, is_force_empty, field in self.sio_plan.output],
+            [(True, False, 'id'), (True, False, 'user_id'), (True, False, 'is_active'), (True, False, 'count'),
+             (True, False, 'name'), (False, False, 'flag'), (False, False, 'comment'), (False, False, 'raw_id'),
+             (False, True, 'missing')])
+
+# ################################################################################################################################
+
+    def test_input_same_as_generic(self):
+        payload = {'id': '1', 'user_id': '2', 'is_active': 'true', 'count': '3', 'name': 'abc', 'flag': 'false',
+            'comment': b'zażółć', 'raw_id': '4', 'password': 'secret'}
+
+        for channel_params in (None, {'name': 'from-channel', 'extra': 'x'}):
+            expected = self.get_input(payload, None, channel_params)
+            given = self.get_input(payload, self.sio_plan, channel_params)
+
+            self.assertEquals(given, expected)
+            self.assertEquals(given.id, 1)
+            self.assertEquals(given.password, 'enc-secret')
+            self.assertEquals(given.raw_id, '4')
+
+        for sio_plan in (None, self.sio_plan):
+            self.assertRaises(ParsingException, self.get_input, {'id': '1'}, sio_plan)
+
+# ################################################################################################################################
+
+    def test_output_same_as_generic(self):
+        output = {'id': '1', 'user_id': 2, 'is_active': 'false', 'count': '3', 'name': 'abc', 'flag': 'true', 'raw_id': '4'}
+
+        for skip_empty_keys in (False, True):
+            for repeated in (False, True):
+                expected = self.get_output(None, skip_empty_keys, repeated, **output)
+                given = self.get_output(self.sio_plan, skip_empty_keys, repeated, **output)
+                self.assertEquals(given, expected)
+
+        response = self.get_output(self.sio_plan, True, **output)['response']
+        self.assertEquals(response['id'], 1)
+        self.assertEquals(response['raw_id'], '4')
+        self.assertNotIn('comment', response)
+        self.assertIn('missing', response)
+
+# ################################################################################################################################
+
+    def test_plan_not_used_with_other_config(self):
+        sio_plan = SIOPlan(MySIO, get_simple_io_config())
+
+        self.assertFalse(sio_plan.is_valid_for(MySIO, self.simple_io_config.bool_parameter_prefixes,
+            self.simple_io_config.int_parameters, self.simple_io_config.int_parameter_suffixes))
+
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, MySIO.output_required, MySIO.output_optional,
+            self.simple_io_config, 'response', '', False, False, MySIO.force_empty_keys, False, sio_plan)
+        self.assertIsNone(payload.zato_output_fields)
+
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, MySIO.output_required, MySIO.output_optional,
+            self.simple_io_config, 'response', '', False, False, MySIO.force_empty_keys, False, self.sio_plan)
+        self.assertIs(payload.zato_output_fields, self.sio_plan.output)
+
+# ################################################################################################################################
+
+    def test_plan_used_with_config_without_lists(self):
+
+        # Neither bool_parameter_prefixes, int_parameters nor int_parameter_suffixes are configured
+        simple_io_config = Bunch()
+        sio_plan = SIOPlan(MySIO, simple_io_config)
+
+        self.assertTrue(sio_plan.is_valid_for(MySIO, simple_io_config.get('bool_parameter_prefixes', NO_SIO_CONFIG_LIST),
+            simple_io_config.get('int_parameters', NO_SIO_CONFIG_LIST),
+            simple_io_config.get('int_parameter_suffixes', NO_SIO_CONFIG_LIST)))
+
+        payload = SimpleIOPayload('cid', DATA_FORMAT.JSON, MySIO.output_required, MySIO.output_optional,
+            simple_io_config, 'response', '', False, False, MySIO.force_empty_keys, False, sio_plan)
+        self.assertIs(payload.zato_output_fields, sio_plan.output)
+
+# ################################################################################################################################
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# anyjson
+from anyjson import loads
+
+# Bunch
+from bunch import Bunch
+
+# SQLAlchemy
+from sqlalchemy.util import KeyedTuple
+
+# Zato
+from zato.common import DATA_FORMAT
+from zato.server.service.reqresp import SimpleIOPayload
+
+# ################################################################################################################################
+
+output_required = ('id', 'name')
+output_optional = ('comment',)
+
+# ################################################################################################################################
+
+class SIOStreamTestCase(TestCase):
+
+    def get_payload(self, output_stream, response_elem='response'):
+        simple_io_config = Bunch(bool_parameter_prefixes=['is_'], int_parameters=['id'], int_parameter_suffixes=['_id'])
+        return SimpleIOPayload('cid', DATA_FORMAT.JSON, output_required, output_optional, simple_io_config, response_elem,
+            '', True, False, [], False, None, output_stream)
+
+    def get_rows(self, count):
+        for idx in xrange(count):
+            yield KeyedTuple([str(idx), 'name-{}'.format(idx), None], ['id', 'name', 'comment'])
+
+# ################################################################################################################################
+
+    def test_same_as_getvalue(self):
+        for response_elem in ('response', None):
+            expected = self.get_payload(False, response_elem)
+            expected[:] = list(self.get_rows(10))
+
+            given = self.get_payload(True, response_elem)
+            given[:] = self.get_rows(10)
+
+            self.assertEquals(loads(b''.join(given.iter_json())), loads(expected.getvalue()))
+
+# ################################################################################################################################
+
+    def test_rows_iterated_lazily(self):
+        payload = self.get_payload(True)
+        rows = self.get_rows(1000)
+        payload[:] = rows
+
+        chunks = payload.iter_json(chunk_size=1024)
+        first = next(chunks)
+
+        # Only part of the rows have been consumed so far
+        self.assertTrue(len(first) >= 1024)
+        self.assertTrue(len(list(rows)) > 0)
+
+# ################################################################################################################################
+
+    def test_chunks(self):
+        payload = self.get_payload(True)
+        payload[:] = self.get_rows(1000)
+        payload.zato_meta['search'] = {'num_pages': 1}
+
+        chunks = list(payload.iter_json(chunk_size=1024))
+        self.assertTrue(len(chunks) > 1)
+
+        value = loads(b''.join(chunks))
+        self.assertEquals(len(value['response']), 1000)
+        self.assertEquals(value['response'][999]['id'], 999)
+        self.assertEquals(value['response'][999]['name'], 'name-999')
+        self.assertEquals(value['_meta'], {'num_pages': 1})
+
+# ################################################################################################################################
+
+    def test_empty(self):
+        payload = self.get_payload(True)
+        payload[:] = iter([])
+        self.assertEquals(loads(b''.join(payload.iter_json())), {'response': []})
+
+# ################################################################################################################################
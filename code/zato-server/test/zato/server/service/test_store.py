@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+import sys
+from hashlib import sha256
+from json import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from uuid import uuid4
+
+# Bunch
+from bunch import Bunch
+
+# mock
+from mock import patch
+
+# Zato
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+
+module_source = b"""
+from zato.server.service import Service
+
+class MyServiceA(Service):
+    name = 'test.store.{suffix}.a'
+
+class MyServiceB(Service):
+    name = 'test.store.{suffix}.b'
+"""
+
+# ################################################################################################################################
+
+class InternalCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(prefix='zato-test-')
+        self.cache_path = os.path.join(self.base_dir, 'config', 'repo', 'internal-cache.json')
+        os.makedirs(os.path.dirname(self.cache_path))
+
+        # A module of its own for each test so that it is always imported anew
+        suffix = uuid4().hex
+        self.mod_name = 'zato_test_store_{}'.format(suffix)
+        self.source = module_source.replace(b'{suffix}', suffix.encode('utf8'))
+        self.hash = sha256(self.source).hexdigest()
+
+        with open(os.path.join(self.base_dir, '{}.py'.format(self.mod_name)), 'wb') as f:
+            f.write(self.source)
+
+        sys.path.insert(0, self.base_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.base_dir)
+        sys.modules.pop(self.mod_name, None)
+        rmtree(self.base_dir)
+
+    def import_internal_services(self):
+
+        def add_services(items):
+            return dict((item.name, (idx, True, 99999)) for idx, item in enumerate(items, 1))
+
+        store = ServiceStore({}, None, Bunch(add_services=add_services), Bunch(is_sso_enabled=False))
+        store.patterns_matcher.read_config({'order': 'true_false', '*': 'True'})
+
+        # Worker-level attributes of service classes are not needed to check which services are deployed
+        with patch('zato.server.service.store.set_up_class_attributes'):
+            deployed = store.import_internal_services([self.mod_name], self.base_dir, False, True)
+
+        return sorted(class_.__name__ for class_ in deployed)
+
+    def write_cache(self, hash, names):
+        with open(self.cache_path, 'wb') as f:
+            f.write(dumps({self.mod_name: {'hash': hash, 'names': names}}))
+
+    def read_cache(self):
+        with open(self.cache_path, 'rb') as f:
+            return loads(f.read())
+
+    def test_cache_miss(self):
+
+        # There is no cache yet so the module is scanned for services and the cache is written
+        self.assertEquals(self.import_internal_services(), ['MyServiceA', 'MyServiceB'])
+        self.assertEquals(self.read_cache(), {self.mod_name: {'hash': self.hash, 'names': ['MyServiceA', 'MyServiceB']}})
+
+    def test_cache_hit(self):
+
+        # The module has not changed so only the services from the cache are deployed, without scanning the module ..
+        self.write_cache(self.hash, ['MyServiceA'])
+        self.assertEquals(self.import_internal_services(), ['MyServiceA'])
+
+        # .. and the cache is left as it was.
+        self.assertEquals(self.read_cache(), {self.mod_name: {'hash': self.hash, 'names': ['MyServiceA']}})
+
+    def test_cache_stale(self):
+
+        # The module changed since the cache was written so it is scanned again and the cache is updated
+        self.write_cache('old-hash', ['MyServiceA'])
+        self.assertEquals(self.import_internal_services(), ['MyServiceA', 'MyServiceB'])
+        self.assertEquals(self.read_cache(), {self.mod_name: {'hash': self.hash, 'names': ['MyServiceA', 'MyServiceB']}})
+
+# ################################################################################################################################
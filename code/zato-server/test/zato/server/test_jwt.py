@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Cryptography
+from cryptography.fernet import Fernet
+
+# Zato
+from zato.server.jwt import JWT
+
+# ################################################################################################################################
+
+class FakeCache(object):
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.puts = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def put(self, key, value, ttl, async=True):
+        self.puts += 1
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+# ################################################################################################################################
+
+class JWTTestCase(TestCase):
+
+    def get_backend(self, *args):
+        backend = JWT(None, None, Fernet.generate_key(), *args)
+        backend.cache = FakeCache()
+        return backend
+
+    def get_token(self, backend, username='user1', ttl=60):
+        token = backend._create_token(username=username, ttl=ttl)
+        backend.cache.put(token, token, ttl)
+        backend.cache.puts = 0
+        return token
+
+    def test_no_local_cache(self):
+        backend = self.get_backend()
+        token = self.get_token(backend)
+
+        for x in range(3):
+            self.assertTrue(backend.validate('user1', token).valid)
+
+        self.assertEquals(backend.cache.gets, 3)
+        self.assertEquals(backend.cache.puts, 3)
+
+    def test_local_cache(self):
+        backend = self.get_backend(10, 60, 30)
+        token = self.get_token(backend)
+
+        for x in range(3):
+            self.assertTrue(backend.validate('user1', token).valid)
+
+        # Tokens were looked up and their expiration was extended only once
+        self.assertEquals(backend.cache.gets, 1)
+        self.assertEquals(backend.cache.puts, 1)
+
+        self.assertFalse(backend.validate('user2', token).valid)
+
+        # Tokens deleted are no longer valid even though they were cached
+        backend.delete(token)
+        self.assertFalse(backend.validate('user1', token).valid)
+
+    def test_local_cache_size(self):
+        backend = self.get_backend(2, 60)
+        tokens = [self.get_token(backend) for x in range(3)]
+
+        for token in tokens:
+            backend.validate('user1', token)
+
+        self.assertEquals(list(backend.local_cache), tokens[1:])
+
+    def test_local_cache_expired(self):
+        backend = self.get_backend(10, 60)
+        token = self.get_token(backend)
+
+        backend.validate('user1', token)
+        backend.local_cache[token].expires_at = 0
+        backend.validate('user1', token)
+
+        self.assertEquals(backend.cache.gets, 2)
+
+# ################################################################################################################################
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from unittest import TestCase
+
+# SciPy
+from scipy import stats as sp_stats
+
+# Zato
+from zato.common import KVDB
+from zato.server.stats import add_to_index, get_bucket, get_bucket_value, get_index_key, get_keys, get_parent_period, Histogram, \
+     is_indexed, ServiceTimingStore, set_indexed_since
+
+# ################################################################################################################################
+
+class FakePipeline(object):
+    def __init__(self, data):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def hincrby(self, key, field, value):
+        hash_ = self.data.setdefault(key, {})
+        hash_[field] = hash_.get(field, 0) + value
+
+    def sadd(self, key, value):
+        self.data.setdefault(key, set()).add(value)
+
+    def expire(self, key, value):
+        pass
+
+    def execute(self):
+        pass
+
+class FakeConn(FakePipeline):
+    def __init__(self):
+        self.data = {}
+        self.scanned = []
+
+    def pipeline(self):
+        return FakePipeline(self.data)
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setnx(self, key, value):
+        self.data.setdefault(key, value)
+
+    def scan_iter(self, pattern):
+        self.scanned.append(pattern)
+        return iter([])
+
+# ################################################################################################################################
+
+class HistogramTestCase(TestCase):
+
+    def test_buckets(self):
+        for value in range(64):
+            self.assertEquals(get_bucket(value), value)
+            self.assertEquals(get_bucket_value(value), value)
+
+        for value in (64, 100, 1000, 12345, 10**6):
+            bucket = get_bucket(value)
+            self.assertLessEqual(bucket, value)
+            self.assertLess(abs(get_bucket_value(bucket) - value) / value, 1 / 32)
+
+    def test_same_as_scipy_for_small_values(self):
+        times = [1, 2, 2, 3, 5, 8, 13, 21, 34, 55]
+
+        histogram = Histogram()
+        for value in times:
+            histogram.record(value)
+
+        for percentile in (0, 50, 90, 100):
+            max_score = sp_stats.scoreatpercentile(times, percentile)
+            self.assertAlmostEqual(histogram.get_trimmed_mean(percentile), sp_stats.tmean(times, (None, max_score)))
+
+        self.assertEquals(histogram.get_min(), 1)
+        self.assertEquals(histogram.get_max(), 55)
+        self.assertEquals(histogram.count, len(times))
+
+    def test_merge_and_hash(self):
+        h1 = Histogram()
+        h2 = Histogram()
+
+        for value in range(0, 1000, 3):
+            h1.record(value)
+            h2.record(value + 1)
+
+        h1.merge(Histogram.from_hash(h2.to_hash()))
+
+        expected = Histogram()
+        for value in range(0, 1000, 3):
+            expected.record(value)
+            expected.record(value + 1)
+
+        self.assertEquals(h1.buckets, expected.buckets)
+        self.assertEquals(h1.count, expected.count)
+        self.assertEquals(h1.total, expected.total)
+
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertEquals(histogram.get_min(), 0)
+        self.assertEquals(histogram.get_max(), 0)
+        self.assertEquals(histogram.get_trimmed_mean(50), 0)
+
+# ################################################################################################################################
+
+class ServiceTimingStoreTestCase(TestCase):
+
+    def test_record_flush(self):
+        conn = FakeConn()
+        store = ServiceTimingStore(conn, 5)
+        now = datetime(2018, 1, 2, 3, 4, 5)
+
+        for value in (10, 20, 30):
+            store.record('my.service', value, now)
+
+        # Nothing is sent until a flush
+        self.assertFalse(conn.data)
+
+        store.flush()
+        store.record('my.service', 40, now)
+        store.flush()
+
+        self.assertEquals(conn.data[KVDB.SERVICE_TIME_BASIC + 'my.service'], {'last': 40})
+
+        histogram = Histogram.from_hash(conn.data[KVDB.SERVICE_TIME_SUMMARY + 'my.service'])
+        self.assertEquals(histogram.count, 4)
+        self.assertEquals(histogram.total, 100)
+
+        histogram = Histogram.from_hash(conn.data[KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE + 'my.service:2018:01:02:03:04'])
+        self.assertEquals(histogram.count, 4)
+        self.assertEquals(histogram.get_max(), 40)
+
+        # Everything was flushed already
+        self.assertFalse(store.all_time)
+        self.assertFalse(store.by_minute)
+
+        # Keys written are indexed for them to be found without scanning the whole database
+        self.assertEquals(conn.data[get_index_key(KVDB.SERVICE_TIME_SUMMARY)], {KVDB.SERVICE_TIME_SUMMARY + 'my.service'})
+        self.assertEquals(conn.data[get_index_key(KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE, '2018:01:02:03:04')],
+            {KVDB.SERVICE_TIME_SUMMARY_BY_MINUTE + 'my.service:2018:01:02:03:04'})
+
+# ################################################################################################################################
+
+class IndexTestCase(TestCase):
+
+    def test_get_index_key(self):
+        self.assertNotEquals(get_index_key(KVDB.SERVICE_TIME_RAW), get_index_key(KVDB.SERVICE_TIME_RAW_BY_MINUTE))
+        self.assertNotEquals(
+            get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, '2018:01:02:03'),
+            get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, '2018:01:02:03'))
+
+    def test_get_parent_period(self):
+        self.assertEquals(get_parent_period('2018:01:02:03:04'), '2018:01:02:03')
+        self.assertEquals(get_parent_period('2018:01:02:03'), '2018:01:02')
+        self.assertEquals(get_parent_period('2018:01'), '2018')
+
+    def test_get_keys(self):
+        conn = FakeConn()
+        prefix = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE
+
+        add_to_index(conn, prefix + 'a:2018:01:02:03:04', prefix, '2018:01:02:03')
+        add_to_index(conn, prefix + 'b:2018:01:02:03:05', prefix, '2018:01:02:03')
+
+        # Keys from an indexed period are read from the index ..
+        keys = get_keys(conn, prefix, '2018:01:02:03', prefix + '*:2018:01:02:03*')
+        self.assertEquals(sorted(keys), [prefix + 'a:2018:01:02:03:04', prefix + 'b:2018:01:02:03:05'])
+        self.assertFalse(conn.scanned)
+
+        # .. and other periods are scanned for if no server is known to have kept indexes.
+        self.assertEquals(list(get_keys(conn, prefix, '2018:01:02:04', prefix + '*:2018:01:02:04*')), [])
+        self.assertEquals(conn.scanned, [prefix + '*:2018:01:02:04*'])
+
+    def test_get_keys_empty_period(self):
+        conn = FakeConn()
+        prefix = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE
+
+        set_indexed_since(conn, datetime(2018, 1, 2, 3, 4))
+
+        # A period with no keys is not scanned for if all of its keys would have been indexed
+        self.assertEquals(list(get_keys(conn, prefix, '2018:01:02:04', prefix + '*:2018:01:02:04*')), [])
+        self.assertEquals(list(get_keys(conn, KVDB.SERVICE_TIME_RAW, '', KVDB.SERVICE_TIME_RAW + '*')), [])
+        self.assertFalse(conn.scanned)
+
+    def test_is_indexed(self):
+        conn = FakeConn()
+        self.assertFalse(is_indexed(conn, '2018:01:02:03:05'))
+
+        set_indexed_since(conn, datetime(2018, 1, 2, 3, 4))
+        set_indexed_since(conn, datetime(2018, 1, 2, 3, 10)) # Does not overwrite the first one
+
+        # Periods that started after indexes were first kept ..
+        self.assertTrue(is_indexed(conn, ''))
+        self.assertTrue(is_indexed(conn, '2018:01:02:03:05'))
+        self.assertTrue(is_indexed(conn, '2018:01:02:04'))
+        self.assertTrue(is_indexed(conn, '2018:02'))
+
+        # .. and ones that include the time before that.
+        self.assertFalse(is_indexed(conn, '2018:01:02:03:04'))
+        self.assertFalse(is_indexed(conn, '2018:01:02:03'))
+        self.assertFalse(is_indexed(conn, '2018:01'))
+        self.assertFalse(is_indexed(conn, '2017:12:31:23:59'))
+
+# ################################################################################################################################
@@ -9,16 +9,28 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import OrderedDict
 from contextlib import closing
 from datetime import datetime, timedelta
 from logging import getLogger
+from time import time
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import spawn_later
+
 # ipaddress
 from ipaddress import ip_address
 
+# SQLAlchemy
+from sqlalchemy import bindparam
+
 # Zato
 from zato.common.audit import audit_pii
+from zato.common.broker_message import SSO as BROKER_MSG_SSO
 from zato.common.odb.model import SSOSession as SessionModel
 from zato.sso import const, status_code, Session as SessionEntity, ValidationError
 from zato.sso.attr import AttrAPI
@@ -91,11 +103,27 @@ class SessionInfo(object):
 
 # ################################################################################################################################
 
+class CachedSession(object):
+    """ A session, along with its user's details, kept in a server's local cache of sessions.
+    """
+    __slots__ = ('sso_info', 'cached_until')
+
+    def __init__(self, sso_info, cached_until):
+        self.sso_info = sso_info
+        self.cached_until = cached_until
+
+# ################################################################################################################################
+
 class SessionAPI(object):
     """ Logs a user in or out, provided that all authentication and authorization checks succeed,
     or returns details about already existing sessions.
+
+    If configured to, sessions looked up by their UST are cached locally for up to cache_ttl seconds and the cache
+    is cleared of a given user's sessions on logout or when that user changes in any way. Similarly, if renew_batch_interval
+    is set, session renewals are not stored in the database immediately but collected and saved in bulk that often.
     """
-    def __init__(self, sso_conf, encrypt_func, decrypt_func, hash_func, verify_hash_func):
+    def __init__(self, server, sso_conf, encrypt_func, decrypt_func, hash_func, verify_hash_func):
+        self.server = server
         self.sso_conf = sso_conf
         self.encrypt_func = encrypt_func
         self.decrypt_func = decrypt_func
@@ -103,6 +131,22 @@ class SessionAPI(object):
         self.verify_hash_func = verify_hash_func
         self.odb_session_func = None
 
+        # Caching and write-behind renewals are used only when running in servers, e.g. never in CLI
+        session_conf = self.sso_conf.get('session') or {}
+        self.cache_size = int(session_conf.get('cache_size', 0)) if server else 0
+        self.cache_ttl = float(session_conf.get('cache_ttl', 30))
+        self.renew_batch_interval = float(session_conf.get('renew_batch_interval', 0)) if server else 0
+
+        # UST -> CachedSession
+        self.cache = OrderedDict()
+
+        # User ID -> a set of USTs of that user's sessions in cache
+        self.cache_by_user = {}
+
+        # UST -> new expiration time, for renewals that were not stored in the database yet
+        self.renewals = {}
+        self.renewals_flush_scheduled = False
+
 # ################################################################################################################################
 
     def set_odb_session_func(self, func):
@@ -337,6 +381,9 @@ class SessionAPI(object):
                     set_password(self.odb_session_func, self.encrypt_func, self.hash_func, self.sso_conf, user.user_id,
                             ctx.input['new_password'], False)
 
+                    # The user's other sessions may be cached
+                    self.invalidate_user(user.user_id)
+
             # All validated, we can create a session object now
             creation_time = _now()
             expiration_time = creation_time + timedelta(minutes=self.sso_conf.session.expiry)
@@ -362,12 +409,123 @@ class SessionAPI(object):
 
             return info
 
+# ################################################################################################################################
+
+    def _get_cached_session(self, ust, now, _time=time):
+        """ Returns a session from the local cache unless it is not there or it expired, either in the cache or for good.
+        """
+        cached = self.cache.pop(ust, None)
+        if cached:
+            if cached.cached_until > _time() and cached.sso_info.expiration_time > now:
+
+                # Popped and added anew to mark it as the most recently used one
+                self.cache[ust] = cached
+                return cached.sso_info
+            else:
+                self._remove_cached_session(ust, cached.sso_info.user_id)
+
+# ################################################################################################################################
+
+    def _set_cached_session(self, ust, sso_info, _time=time):
+        """ Adds a session to the local cache, evicting the least recently used ones if the cache is full.
+        """
+        self.cache[ust] = CachedSession(sso_info, _time() + self.cache_ttl)
+        self.cache_by_user.setdefault(sso_info.user_id, set()).add(ust)
+
+        while len(self.cache) > self.cache_size:
+            evicted_ust, evicted = self.cache.popitem(last=False)
+            self._remove_cached_session(evicted_ust, evicted.sso_info.user_id, False)
+
+# ################################################################################################################################
+
+    def _remove_cached_session(self, ust, user_id, needs_cache_pop=True):
+        """ Removes a single session from the local cache.
+        """
+        if needs_cache_pop:
+            self.cache.pop(ust, None)
+
+        user_ust_set = self.cache_by_user.get(user_id)
+        if user_ust_set:
+            user_ust_set.discard(ust)
+            if not user_ust_set:
+                del self.cache_by_user[user_id]
+
+# ################################################################################################################################
+
+    def invalidate_user(self, user_id, needs_publish=True):
+        """ Removes all of a user's sessions from the local cache and, optionally, tells all the other servers
+        and workers to do the same in their own caches.
+        """
+        if not self.cache_size:
+            return
+
+        for ust in self.cache_by_user.pop(user_id, ()):
+            self.cache.pop(ust, None)
+
+        if needs_publish:
+            try:
+                self.server.broker_client.publish({
+                    'action': BROKER_MSG_SSO.SESSION_CACHE_INVALIDATE.value,
+                    'user_id': user_id,
+                    'source_worker_id': self.server.worker_id,
+                })
+            except Exception:
+                logger.warn('Could not publish SSO session cache invalidation for user `%s`, e:`%s`', user_id, format_exc())
+
+# ################################################################################################################################
+
+    def _add_renewal(self, ust, expiration_time):
+        """ Stores a session renewal to be saved in the database along with all the other ones collected in the meantime.
+        """
+        self.renewals[ust] = expiration_time
+
+        if not self.renewals_flush_scheduled:
+            self.renewals_flush_scheduled = True
+            spawn_later(self.renew_batch_interval, self.flush_renewals)
+
+# ################################################################################################################################
+
+    def flush_renewals(self):
+        """ Saves in bulk all the session renewals collected so far.
+        """
+        self.renewals_flush_scheduled = False
+
+        if not self.renewals:
+            return
+
+        renewals, self.renewals = self.renewals, {}
+
+        try:
+            with closing(self.odb_session_func()) as session:
+                session.execute(
+                    SessionModelUpdate().values({
+                        'expiration_time': bindparam('_expiration_time'),
+                }).where(
+                    SessionModelTable.c.ust==bindparam('_ust')
+                ), [{'_ust': ust, '_expiration_time': expiration_time} for ust, expiration_time in renewals.iteritems()])
+                session.commit()
+        except Exception:
+            logger.warn('Could not store %d SSO session renewal(s), e:`%s`', len(renewals), format_exc())
+
 # ################################################################################################################################
 
     def _get_session_by_ust(self, session, ust, now):
         """ Low-level implementation of self.get_session_by_ust.
         """
-        return get_session_by_ust(session, ust, now)
+        if self.cache_size:
+            sso_info = self._get_cached_session(ust, now)
+            if sso_info:
+                return sso_info
+
+        sso_info = get_session_by_ust(session, ust, now)
+
+        if sso_info and self.cache_size:
+
+            # A mutable copy is cached because the session's expiration time will change each time it is renewed
+            sso_info = Bunch(sso_info._asdict())
+            self._set_cached_session(ust, sso_info)
+
+        return sso_info
 
 # ################################################################################################################################
 
@@ -402,12 +560,24 @@ class SessionAPI(object):
         # Everything is validated, we can renew the session, if told to.
         if renew:
             expiration_time = now + timedelta(minutes=self.sso_conf.session.expiry)
-            session.execute(
-                SessionModelUpdate().values({
-                    'expiration_time': expiration_time,
-            }).where(
-                SessionModelTable.c.ust==ctx.ust
-            ))
+
+            # Sessions found in cache are renewed in there too
+            cached = self.cache.get(ctx.ust)
+            if cached:
+                cached.sso_info.expiration_time = expiration_time
+
+            # The renewal will be stored along with other ones ..
+            if self.renew_batch_interval:
+                self._add_renewal(ctx.ust, expiration_time)
+
+            # .. or it is stored immediately.
+            else:
+                session.execute(
+                    SessionModelUpdate().values({
+                        'expiration_time': expiration_time,
+                }).where(
+                    SessionModelTable.c.ust==ctx.ust
+                ))
             return expiration_time
         else:
             # Indicate success
@@ -524,13 +694,18 @@ class SessionAPI(object):
         with closing(self.odb_session_func()) as session:
 
             # Check that the session and user exist ..
-            if self._get(session, ust, current_app, remote_addr, needs_decrypt=False, renew=False):
+            sso_info = self._get(session, ust, current_app, remote_addr, needs_decrypt=False, renew=False, needs_attrs=True)
+            if sso_info:
 
-                # .. and if so, delete the session now.
+                # .. and if so, delete the session now ..
                 session.execute(
                     SessionModelDelete().\
                     where(SessionModelTable.c.ust==ust)
                 )
                 session.commit()
 
+                # .. along with its renewal that was possibly not stored yet and any cached sessions of that user.
+                self.renewals.pop(ust, None)
+                self.invalidate_user(sso_info.user_id)
+
 # ################################################################################################################################
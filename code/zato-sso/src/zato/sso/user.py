@@ -210,7 +210,8 @@ class UserAPI(object):
         self.password_expiry = self.sso_conf.password.expiry
 
         # For convenience, sessions are accessible through user API.
-        self.session = SessionAPI(self.sso_conf, self.encrypt_func, self.decrypt_func, self.hash_func, self.verify_hash_func)
+        self.session = SessionAPI(self.server, self.sso_conf, self.encrypt_func, self.decrypt_func, self.hash_func,
+            self.verify_hash_func)
 
 # ################################################################################################################################
 
@@ -632,6 +633,9 @@ class UserAPI(object):
             ).rowcount
             session.commit()
 
+            # The user's sessions were deleted along with the user
+            self.session.invalidate_user(user.user_id)
+
             if rows_matched != 1:
                 msg = 'Expected for rows_matched to be 1 instead of %d, user_id:`%s`, username:`%s`'
                 logger.warn(msg, rows_matched, user_id, username)
@@ -672,6 +676,8 @@ class UserAPI(object):
             )
             session.commit()
 
+        self.session.invalidate_user(user_id)
+
 # ################################################################################################################################
 
     def lock_user_cli(self, user_id):
@@ -860,6 +866,9 @@ class UserAPI(object):
                 )
                 session.commit()
 
+            # Cached sessions must not keep the user's previous attributes, e.g. whether the account is locked
+            self.session.invalidate_user(_user_id)
+
 # ################################################################################################################################
 
     def update_current_user(self, cid, data, current_ust, current_app, remote_addr):
@@ -893,6 +902,8 @@ class UserAPI(object):
         set_password(self.odb_session_func, self.encrypt_func, self.hash_func, self.sso_conf, user_id, password,
             must_change, password_expiry)
 
+        self.session.invalidate_user(user_id)
+
 # ################################################################################################################################
 
     def change_password(self, cid, data, current_ust, current_app, remote_addr):
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2018, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from time import time
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# mock
+from mock import patch
+
+# Zato
+from zato.common.broker_message import SSO as BROKER_MSG_SSO
+from zato.sso.session import SessionAPI
+from zato.sso.user import UserAPI
+
+# ################################################################################################################################
+
+SSOInfo = namedtuple('SSOInfo', ('user_id', 'expiration_time'))
+
+# ################################################################################################################################
+
+class FakeODBSession(object):
+    """ Collects all the statements executed and tells whether it was committed and closed.
+    """
+    def __init__(self):
+        self.executed = []
+        self.is_committed = False
+        self.is_closed = False
+
+    def execute(self, *args):
+        self.executed.append(args)
+
+    def commit(self):
+        self.is_committed = True
+
+    def close(self):
+        self.is_closed = True
+
+# ################################################################################################################################
+
+def get_sso_conf(cache_size=2, cache_ttl=30, renew_batch_interval=0):
+    return Bunch({
+        'main': Bunch(encrypt_email=False, encrypt_password=False),
+        'password': Bunch(expiry=30, min_length=1, max_length=100, reject_list=set(), inform_if_invalid=False),
+        'session': Bunch(expiry=60, cache_size=cache_size, cache_ttl=cache_ttl, renew_batch_interval=renew_batch_interval),
+    })
+
+# ################################################################################################################################
+
+class SessionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.published = []
+        self.odb_sessions = []
+        self.server = Bunch(worker_id=1, broker_client=Bunch(publish=self.published.append))
+
+    def odb_session_func(self):
+        session = FakeODBSession()
+        self.odb_sessions.append(session)
+        return session
+
+    def get_session_api(self, **config):
+        api = SessionAPI(self.server, get_sso_conf(**config), None, lambda data: data, None, None)
+        api.set_odb_session_func(self.odb_session_func)
+        return api
+
+    def get_sso_info(self, user_id, expires_in=60):
+        return Bunch(user_id=user_id, expiration_time=datetime.utcnow() + timedelta(minutes=expires_in))
+
+    def test_cache_disabled_outside_servers(self):
+        api = SessionAPI(None, get_sso_conf(renew_batch_interval=1), None, None, None, None)
+        self.assertEquals(api.cache_size, 0)
+        self.assertEquals(api.renew_batch_interval, 0)
+
+    def test_get_by_ust_cached(self):
+        api = self.get_session_api()
+        now = datetime.utcnow()
+
+        with patch('zato.sso.session.get_session_by_ust') as get_session_by_ust:
+            get_session_by_ust.return_value = SSOInfo('u1', now + timedelta(minutes=60))
+
+            first = api._get_session_by_ust(None, 'ust1', now)
+            second = api._get_session_by_ust(None, 'ust1', now)
+
+        # The second lookup is served from the cache
+        self.assertEquals(get_session_by_ust.call_count, 1)
+        self.assertIs(first, second)
+        self.assertEquals(first.user_id, 'u1')
+
+    def test_ttl_expiry(self):
+        api = self.get_session_api(cache_ttl=10)
+        now = datetime.utcnow()
+
+        api._set_cached_session('ust1', self.get_sso_info('u1'))
+        self.assertEquals(api._get_cached_session('ust1', now).user_id, 'u1')
+
+        # Once cache_ttl is exceeded, the session is no longer returned and is removed from the cache
+        self.assertIsNone(api._get_cached_session('ust1', now, _time=lambda: time() + 11))
+        self.assertFalse(api.cache)
+        self.assertFalse(api.cache_by_user)
+
+    def test_session_expiry(self):
+        api = self.get_session_api()
+        now = datetime.utcnow()
+
+        api._set_cached_session('ust1', self.get_sso_info('u1', expires_in=1))
+
+        # The session itself expired even though it could still be kept in the cache
+        self.assertIsNone(api._get_cached_session('ust1', now + timedelta(minutes=2)))
+        self.assertFalse(api.cache)
+        self.assertFalse(api.cache_by_user)
+
+    def test_lru_eviction(self):
+        api = self.get_session_api(cache_size=2)
+        now = datetime.utcnow()
+
+        api._set_cached_session('ust1', self.get_sso_info('u1'))
+        api._set_cached_session('ust2', self.get_sso_info('u2'))
+
+        # Using the first session makes the second one the least recently used ..
+        api._get_cached_session('ust1', now)
+        api._set_cached_session('ust3', self.get_sso_info('u1'))
+
+        # .. so this is the one that is evicted.
+        self.assertEquals(list(api.cache), ['ust1', 'ust3'])
+        self.assertEquals(api.cache_by_user, {'u1': {'ust1', 'ust3'}})
+
+    def test_invalidate_user(self):
+        api = self.get_session_api(cache_size=10)
+
+        api._set_cached_session('ust1', self.get_sso_info('u1'))
+        api._set_cached_session('ust2', self.get_sso_info('u2'))
+        api._set_cached_session('ust3', self.get_sso_info('u1'))
+
+        api.invalidate_user('u1')
+
+        # Only the sessions of that user are removed and other servers are told to remove them as well
+        self.assertEquals(list(api.cache), ['ust2'])
+        self.assertEquals(api.cache_by_user, {'u2': {'ust2'}})
+        self.assertEquals(self.published, [{
+            'action': BROKER_MSG_SSO.SESSION_CACHE_INVALIDATE.value,
+            'user_id': 'u1',
+            'source_worker_id': 1,
+        }])
+
+        # Invalidation received from other servers is not published again
+        api.invalidate_user('u2', False)
+        self.assertFalse(api.cache)
+        self.assertEquals(len(self.published), 1)
+
+    def test_logout_invalidates_user(self):
+        api = self.get_session_api()
+
+        api._set_cached_session('ust1', self.get_sso_info('u1'))
+        api._set_cached_session('ust2', self.get_sso_info('u1'))
+        api.renewals['ust1'] = datetime.utcnow()
+        api._get = lambda *ignored_args, **ignored_kwargs: Bunch(user_id='u1')
+
+        api.logout('ust1', 'my-app', '127.0.0.1')
+
+        # The session is deleted, its pending renewal is dropped and no other session of that user stays in the cache
+        self.assertTrue(self.odb_sessions[0].is_committed)
+        self.assertEquals(len(self.odb_sessions[0].executed), 1)
+        self.assertFalse(api.renewals)
+        self.assertFalse(api.cache)
+        self.assertEquals(self.published[0]['user_id'], 'u1')
+
+# ################################################################################################################################
+
+class UserAPISessionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.published = []
+        server = Bunch(worker_id=1, broker_client=Bunch(publish=self.published.append))
+
+        self.user_api = UserAPI(server, get_sso_conf(), lambda: FakeODBSession(), None, None, None, None, None)
+        self.user_api.session._set_cached_session('ust1', Bunch(user_id='u1', expiration_time=datetime.utcnow()))
+        self.user_api.session._set_cached_session('ust2', Bunch(user_id='u2', expiration_time=datetime.utcnow()))
+
+    def test_lock_invalidates_user(self):
+        self.user_api.lock_user_cli('u1')
+
+        self.assertEquals(list(self.user_api.session.cache), ['ust2'])
+        self.assertEquals(self.published[0]['user_id'], 'u1')
+
+    def test_set_password_invalidates_user(self):
+        self.user_api.set_password('cid', 'u2', 'new-password', False, None, 'my-app', '127.0.0.1')
+
+        self.assertEquals(list(self.user_api.session.cache), ['ust1'])
+        self.assertEquals(self.published[0]['user_id'], 'u2')
+
+# ################################################################################################################################
+
+class SessionRenewalTestCase(TestCase):
+
+    def setUp(self):
+        self.odb_sessions = []
+
+    def odb_session_func(self):
+        session = FakeODBSession()
+        self.odb_sessions.append(session)
+        return session
+
+    def get_session_api(self, renew_batch_interval):
+        api = SessionAPI(Bunch(worker_id=1), get_sso_conf(renew_batch_interval=renew_batch_interval), None, None, None, None)
+        api.set_odb_session_func(self.odb_session_func)
+        return api
+
+    def test_flush_renewals(self):
+        api = self.get_session_api(0.05)
+        now = datetime.utcnow()
+
+        api._add_renewal('ust1', now)
+        api._add_renewal('ust2', now)
+        api._add_renewal('ust1', now + timedelta(minutes=1))
+
+        # Nothing is stored until the interval elapses ..
+        self.assertTrue(api.renewals_flush_scheduled)
+        self.assertFalse(self.odb_sessions)
+
+        sleep(0.1)
+
+        # .. and then all the renewals are stored in one statement, each session with its latest expiration time.
+        self.assertEquals(len(self.odb_sessions), 1)
+        session = self.odb_sessions[0]
+
+        self.assertTrue(session.is_committed)
+        self.assertTrue(session.is_closed)
+        self.assertEquals(len(session.executed), 1)
+
+        _, params = session.executed[0]
+        self.assertEquals(sorted((item['_ust'], item['_expiration_time']) for item in params), [
+            ('ust1', now + timedelta(minutes=1)), ('ust2', now)])
+
+        self.assertFalse(api.renewals)
+        self.assertFalse(api.renewals_flush_scheduled)
+
+    def test_flush_no_renewals(self):
+        api = self.get_session_api(0.05)
+        api.flush_renewals()
+
+        self.assertFalse(self.odb_sessions)
+
+# ################################################################################################################################
@@ -60,9 +60,12 @@ $.fn.zato.cache.builtin.data_table.new_row = function(item, data, include_tr) {
     row += String.format('<td>{0}</td>', is_active ? "Yes":"No");
     row += String.format('<td>{0}</td>', is_default ? "Yes":"No");
 
+    row += String.format('<td>{0}</td>', "<span class='form_hint'>(n/a)</span>");
+    row += String.format('<td>{0}</td>', "<span class='form_hint'>(n/a)</span>");
     row += String.format('<td>{0}</td>', "<span class='form_hint'>(n/a)</span>");
     row += String.format('<td>{0}</td>', item.max_size);
     row += String.format('<td>{0}</td>', item.max_item_size);
+    row += String.format('<td>{0}</td>', item.max_total_size ? item.max_total_size : '0');
     row += String.format('<td>{0}</td>', extend_expiry_on_get ? "Yes":"No");
     row += String.format('<td>{0}</td>', extend_expiry_on_set ? "Yes":"No");
 
@@ -80,6 +83,9 @@ $.fn.zato.cache.builtin.data_table.new_row = function(item, data, include_tr) {
     row += String.format("<td class='ignore'>{0}</td>", is_default);
     row += String.format("<td class='ignore'>{0}</td>", item.extend_expiry_on_get);
     row += String.format("<td class='ignore'>{0}</td>", item.extend_expiry_on_set);
+    row += String.format("<td class='ignore'>{0}</td>", item.use_key_index == true);
+    row += String.format("<td class='ignore'>{0}</td>", item.sync_method);
+    row += String.format("<td class='ignore'>{0}</td>", item.sync_batch_window);
     row += String.format("<td class='ignore'>{0}</td>", data.cache_id);
 
     if(include_tr) {
@@ -108,6 +114,8 @@ $.fn.zato.cache.builtin.clear = function(id) {
 
     var _callback = function() {
         $('#cache_current_size_' + id).html('0');
+        $('#cache_current_size_bytes_' + id).html('0');
+        $('#cache_evictions_' + id).html('0');
     }
 
     $.fn.zato.data_table.delete_(id, 'td.item_id_',
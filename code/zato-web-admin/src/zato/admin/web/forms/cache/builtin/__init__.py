@@ -26,9 +26,14 @@ class CreateForm(forms.Form):
         initial=CACHE.DEFAULT.MAX_SIZE, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
     max_item_size = forms.CharField(
         initial=CACHE.DEFAULT.MAX_ITEM_SIZE, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
+    max_total_size = forms.CharField(
+        initial=CACHE.DEFAULT.MAX_TOTAL_SIZE, widget=forms.TextInput(attrs={'style':'width:15%'}))
     extend_expiry_on_get = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
     extend_expiry_on_set = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
+    use_key_index = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     sync_method = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
+    sync_batch_window = forms.CharField(
+        initial=CACHE.DEFAULT.SYNC_BATCH_WINDOW, widget=forms.TextInput(attrs={'style':'width:15%'}))
     persistent_storage = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
     cache_id = forms.CharField(widget=forms.HiddenInput())
 